@@ -1,5 +1,8 @@
 
 class Node:
+    __slots__ = ('token',)
+    visitName = None
+
     def __init__(self):
         self.token = None
 
@@ -7,160 +10,319 @@ class Node:
         pass
 
 class Empty(Node):
+    __slots__ = ()
+    visitName = 'visit_empty'
+
     def __init__(self):
-        pass
+        Node.__init__(self)
 
     def accept(self, visitor):
-        visitor.visit_empty(self)
+        return visitor.visit_empty(self)
 
 class Binary(Node):
+    __slots__ = ('left', 'operator', 'right')
+    visitName = 'visit_binary'
+
     def __init__(self, left, operator, right):
+        Node.__init__(self)
         self.left = left
         self.operator = operator
         self.right = right
 
     def accept(self, visitor):
-        visitor.visit_binary(self)
+        return visitor.visit_binary(self)
 
 class Unary(Node):
+    __slots__ = ('operator', 'right')
+    visitName = 'visit_unary'
+
     def __init__(self, operator, right):
+        Node.__init__(self)
         self.operator = operator
         self.right = right
 
     def accept(self, visitor):
-        visitor.visit_unary(self)
+        return visitor.visit_unary(self)
     
 class PreProcess(Node):
+    __slots__ = ('variable', 'operator')
+    visitName = 'visit_pre_process'
+
     def __init__(self, variable, operator):
+        Node.__init__(self)
         self.variable = variable
         self.operator = operator
     
     def accept(self, visitor):
-        visitor.visit_pre_process(self)
+        return visitor.visit_pre_process(self)
 
 class PostProcesst(Node):
+    __slots__ = ('variable', 'operator')
+    visitName = 'visit_post_process'
+
     def __init__(self, variable, operator):
+        Node.__init__(self)
         self.variable = variable
         self.operator = operator
     
     def accept(self, visitor):
-        visitor.visit_post_process(self)
+        return visitor.visit_post_process(self)
 
 
 class Logical(Node):
+    __slots__ = ('left', 'operator', 'right')
+    visitName = 'visit_logical'
+
     def __init__(self, left, operator, right):
+        Node.__init__(self)
         self.left = left
         self.operator = operator
         self.right = right
 
     def accept(self, visitor):
-        visitor.visit_logical(self)
+        return visitor.visit_logical(self)
 
 
 
 class Grouping(Node):
+    __slots__ = ('expression',)
+    visitName = 'visit_grouping'
+
     def __init__(self, expression):
+        Node.__init__(self)
         self.expression = expression
 
     def accept(self, visitor):
-        visitor.visit_grouping(self)
+        return visitor.visit_grouping(self)
 
 
 class Declaration(Node):
+    __slots__ = ('name', 'initializer')
+    visitName = 'visit_declaration'
+
     def __init__(self, name, initializer):
+        Node.__init__(self)
         self.name = name
         self.initializer = initializer
 
     def accept(self, visitor):
-        visitor.visit_declaration(self)
+        return visitor.visit_declaration(self)
 
 class Variable(Node):
+    __slots__ = ('name',)
+    visitName = 'visit_variable'
+
     def __init__(self, name):
+        Node.__init__(self)
         self.name = name
 
 
     def accept(self, visitor):
-        visitor.visit_variable(self)
+        return visitor.visit_variable(self)
 
 
 class Assign(Node):
+    __slots__ = ('name', 'value')
+    visitName = 'visit_assign'
+
     def __init__(self, name, value):
+        Node.__init__(self)
         self.name = name
         self.value = value
 
     def accept(self, visitor):
-        visitor.visit_assign(self)
+        return visitor.visit_assign(self)
 
 
 class Nil(Node):
+    __slots__ = ()
+    visitName = 'visit_nil'
+
     def __init__(self, token):
         self.token = token
     def accept(self, visitor):
-        visitor.visit_nil(self)
+        return visitor.visit_nil(self)
 
 class Boolean(Node):
+    __slots__ = ('value',)
+    visitName = 'visit_boolean'
+
     def __init__(self, value, token):
         self.value = value
         self.token = token
 
     def accept(self, visitor):
-        visitor.visit_boolean(self)
+        return visitor.visit_boolean(self)
 
 class Number(Node):
+    __slots__ = ('value',)
+    visitName = 'visit_number'
+
     def __init__(self, value,token):
         self.value = value
         self.token = token
 
     def accept(self, visitor):
-        visitor.visit_number(self)
+        return visitor.visit_number(self)
 
 class String(Node):
+    __slots__ = ('value',)
+    visitName = 'visit_string'
+
     def __init__(self, value, token):
         self.value = value
         self.token = token
 
     def accept(self, visitor):
-        visitor.visit_string(self)
+        return visitor.visit_string(self)
 
 
 class Now(Node):
+    __slots__ = ()
+    visitName = 'visit_now'
+
     def __init__(self, token):
         self.token = token
     def accept(self, visitor):
-        visitor.visit_now(self)
+        return visitor.visit_now(self)
 
 #
 # Statements
 #   
 class Statement(Node):
-    pass
+    __slots__ = ()
 
 class ExprStatement(Statement):
+    __slots__ = ('expression',)
+    visitName = 'visit_expression_statement'
+
     def __init__(self, expression):
+        Node.__init__(self)
         self.expression = expression
 
     def accept(self, visitor):
-        visitor.visit_expression_statement(self)
+        return visitor.visit_expression_statement(self)
 
 
 class Program(Node):
+    __slots__ = ('statements',)
+    visitName = 'visit_program'
+
     def __init__(self, statements):
+        Node.__init__(self)
         self.statements = statements
 
     def accept(self, visitor):
-        visitor.visit_program(self)
+        return visitor.visit_program(self)
 
 class BlockStatement(Statement):
+    __slots__ = ('statements',)
+    visitName = 'visit_block_statement'
+
     def __init__(self, statements):
+        Node.__init__(self)
         self.statements = statements
 
     def accept(self, visitor):
-        visitor.visit_block_statement(self)
+        return visitor.visit_block_statement(self)
 
 
 class PrintStatement(Statement):
+    __slots__ = ('expression',)
+    visitName = 'visit_print_statement'
+
     def __init__(self, expression):
+        Node.__init__(self)
         self.expression = expression
 
     def accept(self, visitor):
-        visitor.visit_print_statement(self)
\ No newline at end of file
+        return visitor.visit_print_statement(self)
+
+class Call(Node):
+    __slots__ = ('callee', 'paren', 'arguments')
+    visitName = 'visit_call'
+
+    def __init__(self, callee, paren, arguments):
+        self.token = paren
+        self.callee = callee
+        self.paren = paren
+        self.arguments = arguments
+
+    def accept(self, visitor):
+        return visitor.visit_call(self)
+
+
+class IfStatement(Statement):
+    __slots__ = ('condition', 'then_branch', 'else_branch')
+    visitName = 'visit_if_statement'
+
+    def __init__(self, condition, then_branch, else_branch):
+        Node.__init__(self)
+        self.condition = condition
+        self.then_branch = then_branch
+        self.else_branch = else_branch
+
+    def accept(self, visitor):
+        return visitor.visit_if_statement(self)
+
+
+class WhileStatement(Statement):
+    __slots__ = ('condition', 'body')
+    visitName = 'visit_while_statement'
+
+    def __init__(self, condition, body):
+        Node.__init__(self)
+        self.condition = condition
+        self.body = body
+
+    def accept(self, visitor):
+        return visitor.visit_while_statement(self)
+
+
+class LoopStatement(Statement):
+    __slots__ = ('body',)
+    visitName = 'visit_loop_statement'
+
+    def __init__(self, body):
+        Node.__init__(self)
+        self.body = body
+
+    def accept(self, visitor):
+        return visitor.visit_loop_statement(self)
+
+
+class FrameStatement(Statement):
+    __slots__ = ()
+    visitName = 'visit_frame_statement'
+
+    def __init__(self, token):
+        self.token = token
+
+    def accept(self, visitor):
+        return visitor.visit_frame_statement(self)
+
+
+class ReturnStatement(Statement):
+    __slots__ = ('value',)
+    visitName = 'visit_return_statement'
+
+    def __init__(self, token, value):
+        self.token = token
+        self.value = value
+
+    def accept(self, visitor):
+        return visitor.visit_return_statement(self)
+
+
+class ProcessDeclaration(Statement):
+    __slots__ = ('name', 'params', 'body')
+    visitName = 'visit_process_declaration'
+
+    def __init__(self, name, params, body):
+        self.token = name
+        self.name = name
+        self.params = params
+        self.body = body
+
+    def accept(self, visitor):
+        return visitor.visit_process_declaration(self)
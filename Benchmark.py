@@ -0,0 +1,183 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+from Lexer import RegexLexer
+from Parser import Parser
+from Interpreter import Interpreter, Session, AST_ENGINES
+from Compiler import ENGINES
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS = os.path.join(HERE, "benchmarks")
+BASELINE = os.path.join(CORPUS, "baseline.json")
+
+
+class Workload:
+    # One corpus file and the artifacts each phase consumes, prepared once so that
+    # every phase is timed on its own: tokens for parse, an AST for codegen, code for run.
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, "rt") as f:
+            self.source = f.read()
+        self.tokens = RegexLexer(self.source).tokenize()
+        with quiet():
+            interpreter = Interpreter()
+            program = self.parse()
+            interpreter.build(program)
+            for lower in AST_ENGINES.values():
+                getattr(interpreter, lower)(program)
+        self.code = interpreter.code
+        self.program = self.parse()
+
+    def lex(self):
+        return RegexLexer(self.source).tokenize()
+
+    def parse(self):
+        return Parser(self.tokens, pratt=True).parse()
+
+    def codegen(self):
+        # no folding or peephole: both would rewrite the shared AST and blur what is measured
+        interpreter = Interpreter(optimize=False)
+        interpreter.build(self.program)
+        return interpreter
+
+    def run(self, engine):
+        with quiet():
+            return Session(self.code, engine).run()
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        yield
+
+
+class Benchmark:
+    # Times lex / parse / codegen / run for every workload (ops/sec, best of
+    # `rounds`), records the tracemalloc peak of one call, and compares against
+    # a saved JSON baseline.
+    def __init__(self, workloads, engines=("loop", "table"), rounds=5):
+        self.workloads = workloads
+        self.engines = engines
+        self.rounds = rounds
+
+    def phases(self, workload):
+        yield "lex", workload.lex
+        yield "parse", workload.parse
+        yield "codegen", workload.codegen
+        for engine in self.engines:
+            yield f"run:{engine}", lambda engine=engine: workload.run(engine)
+
+    def measure(self, function):
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(self.rounds, number)) / number
+        tracemalloc.start()
+        try:
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {"ops": round(1.0 / best, 3), "seconds": best, "peak": peak}
+
+    def runAll(self, report=None):
+        results = {}
+        for workload in self.workloads:
+            results[workload.name] = {}
+            for phase, function in self.phases(workload):
+                result = self.measure(function)
+                results[workload.name][phase] = result
+                if report is not None:
+                    report(workload.name, phase, result)
+        return {"meta": self.meta(), "results": results}
+
+    def meta(self):
+        return {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "engines": list(self.engines),
+            "rounds": self.rounds,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+
+def save(data, path):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(current, baseline, threshold):
+    # a phase regresses when its ops/sec drops, or its peak memory grows, by more than threshold
+    regressions = []
+    for name, phases in current["results"].items():
+        for phase, result in phases.items():
+            before = baseline["results"].get(name, {}).get(phase)
+            if before is None:
+                continue
+            speed = result["ops"] / before["ops"]
+            memory = result["peak"] / before["peak"] if before["peak"] else 1.0
+            if speed < 1.0 - threshold:
+                regressions.append((name, phase, "ops/sec", before["ops"], result["ops"], speed))
+            if memory > 1.0 + threshold:
+                regressions.append((name, phase, "peak", before["peak"], result["peak"], memory))
+    return regressions
+
+
+def report_line(name, phase, result):
+    print(f"{name:<14} {phase:<11} {result['ops']:>12,.2f} ops/s {result['seconds'] * 1000:>10.3f} ms {result['peak'] / 1024:>10.1f} KiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BU lexer/parser/codegen/VM benchmarks")
+    parser.add_argument("workloads", nargs="*", help="corpus names or .bu paths (default: all of benchmarks/)")
+    parser.add_argument("--engines", default="loop,table", help="comma separated VM engines to time, e.g. table,register")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--save", nargs="?", const=BASELINE, help="write results as the baseline")
+    parser.add_argument("--compare", nargs="?", const=BASELINE, help="compare against a baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed fractional slowdown")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    paths = []
+    for name in args.workloads or sorted(glob.glob(os.path.join(CORPUS, "*.bu"))):
+        paths.append(name if name.endswith(".bu") else os.path.join(CORPUS, name + ".bu"))
+    engines = tuple(engine for engine in args.engines.split(",") if engine)
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f"unknown engine {engine}")
+
+    benchmark = Benchmark([Workload(path) for path in paths], engines, args.rounds)
+    results = benchmark.runAll(report_line)
+
+    if args.json:
+        save(results, args.json)
+    if args.save:
+        save(results, args.save)
+        print(f"baseline written to {args.save}")
+    if args.compare:
+        regressions = compare(results, load(args.compare), args.threshold)
+        for name, phase, metric, before, after, ratio in regressions:
+            print(f"REGRESSION {name} {phase} {metric}: {before:,.2f} -> {after:,.2f} ({ratio:.2f}x)")
+        if regressions:
+            return 1
+        print(f"no regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,24 +3,26 @@ from Visitor import Visitor
 from Ast import  *
 from Compiler import *
 from Token import TokenType
+from Types import ANY, BOOL, INT, NUMBER, STRING, only
 
 
-class Task:
-    def __init__(self):
-        self.bytes = []
-        self.lines = []
+# the comparison that is true exactly when the key is false, for !(a op b)
+INVERSE = {
+    TokenType.EQUAL_EQUAL: OpCode.NOT_EQUAL,
+    TokenType.BANG_EQUAL: OpCode.EQUAL,
+    TokenType.LESS: OpCode.GREATER_EQUAL,
+    TokenType.LESS_EQUAL: OpCode.GREATER,
+    TokenType.GREATER: OpCode.LESS_EQUAL,
+    TokenType.GREATER_EQUAL: OpCode.LESS,
+}
 
 
-    def write(self, byte, line):
-        self.bytes.append(byte)
-        self.lines.append(line)
-
+class Task(Chunk):
     def emitByte(self, byte, line):
         self.write(byte, line)
 
     def emitBytes(self, b0, b1, line):
-        self.emitByte(b0, line)
-        self.emitByte(b1, line)
+        self.write_bytes(b0, b1, line)
 
 
 class ByteGenerator (Visitor):
@@ -28,13 +30,14 @@ class ByteGenerator (Visitor):
         self.interpreter = interpreter
         self.compiler = self.interpreter.GetCurrent()
         self.taks = []
+        self.processes = {}
+        self.types = {}
 
     def processTasks(self):
         while len(self.taks) > 0:
             task = self.taks.pop(0)
-            for i in range(len(task.bytes)):
-                self.compiler.bytes.append(task.bytes[i])
-                self.compiler.lines.append(task.lines[i] )    
+            self.compiler.bytes += task.bytes
+            self.compiler.lines.extend(task.lines)
 
     def counter(self):
         return len(self.compiler.bytes)
@@ -44,11 +47,43 @@ class ByteGenerator (Visitor):
             return self.compiler.lines[-1]
         return self.compiler.lines[index]
     
-    def lastLine(self):
+    def lastLine(self, default=0):
+        if len(self.compiler.lines) == 0:
+            return default
         return self.compiler.lines[-1]
     
-    def compile(self, program):
-        program.accept(self)
+    def compile(self, program, types=None):
+        self.types = types or {}
+        self.visit(program)
+
+    def typeOf(self, expr):
+        # inferred by TypeInference; any type when the pass did not run
+        return self.types.get(expr, ANY)
+
+    def invertible(self, comparison):
+        # !(a < b) is a >= b unless an operand can be NaN
+        if comparison.operator.type in (TokenType.EQUAL_EQUAL, TokenType.BANG_EQUAL):
+            return True
+        left, right = self.typeOf(comparison.left), self.typeOf(comparison.right)
+        return (only(left, INT | BOOL) and only(right, INT | BOOL)) or (only(left, STRING) and only(right, STRING))
+
+    def identity(self, expr):
+        # the operand an integer identity reduces expr to, or None
+        op = expr.operator.type
+        if op in (TokenType.PLUS, TokenType.EQUAL_PLUS):
+            unit, commutes = 0, True
+        elif op in (TokenType.MINUS, TokenType.EQUAL_MINUS):
+            unit, commutes = 0, False
+        elif op in (TokenType.STAR, TokenType.EQUAL_MULT):
+            unit, commutes = 1, True
+        else:
+            return None
+        pairs = [(expr.left, expr.right), (expr.right, expr.left)] if commutes else [(expr.left, expr.right)]
+        for operand, literal in pairs:
+            if isinstance(literal, Number) and type(literal.value) is int and literal.value == unit \
+                    and self.typeOf(operand) == INT:
+                return operand
+        return None
 
 
 
@@ -56,34 +91,91 @@ class ByteGenerator (Visitor):
         self.compiler.write(byte, line)
 
     def emitBytes(self, b0, b1, line):
-        self.emitByte(b0, line)
-        self.emitByte(b1, line)
-
-    def emit_constant(self, value, line):
-        self.emitBytes(OpCode.CONST, self.compiler.addConstant(value), line)
+        self.compiler.write_bytes(b0, b1, line)
+
+    def emit_constant(self, value, token):
+        self.emitBytes(OpCode.CONST, self.addConstant(value, token), token.line)
+
+    # operands are at most 16 bits, even behind WIDE
+
+    def addConstant(self, value, token):
+        index = self.compiler.addConstant(value)
+        if index > 0xFFFF:
+            self.interpreter.error(token, "Too many constants in one chunk.")
+        return index
+
+    def addName(self, token):
+        index = self.compiler.addName(token.lexeme)
+        if index > 0xFFFF:
+            self.interpreter.error(token, "Too many global variables.")
+        return index
+
+    def emitJump(self, op, line):
+        # 16-bit placeholder, filled in by patchJump once the target is known
+        self.emitByte(op, line)
+        self.emitByte(0xFF, line)
+        self.emitByte(0xFF, line)
+        return self.counter() - 2
+
+    def patchJump(self, offset, token):
+        jump = self.counter() - offset - 2
+        if jump > 0xFFFF:
+            self.interpreter.error(token, "Too much code to jump over.")
+        self.compiler.bytes[offset] = jump >> 8
+        self.compiler.bytes[offset + 1] = jump & 0xFF
+
+    def emitLoop(self, start, token):
+        self.emitByte(OpCode.LOOP, token.line)
+        jump = self.counter() + 2 - start
+        if jump > 0xFFFF:
+            self.interpreter.error(token, "Loop body too large.")
+        self.emitByte(jump >> 8, token.line)
+        self.emitByte(jump & 0xFF, token.line)
 
     
     def visit_binary(self, expr):
 
         op   = expr.operator.type
         line = expr.operator.line
-        expr.left.accept(self)
-        expr.right.accept(self)
 
-        print("BINARY",op, line)
+        # b == true is b and b == false is !b when b is always a boolean
+        if op == TokenType.EQUAL_EQUAL or op == TokenType.BANG_EQUAL:
+            operand, literal = (expr.left, expr.right) if isinstance(expr.right, Boolean) else (expr.right, expr.left)
+            if isinstance(literal, Boolean) and self.typeOf(operand) == BOOL:
+                self.visit(operand)
+                if literal.value != (op == TokenType.EQUAL_EQUAL):
+                    self.emitByte(OpCode.NOT, line)
+                return
+        # x + 0, 0 + x, x - 0, x * 1 and 1 * x are x when x is always an int
+        operand = self.identity(expr)
+        if operand is not None:
+            self.visit(operand)
+            return
+        # an int squared is x * x, without evaluating x twice
+        if op == TokenType.POWER and isinstance(expr.right, Number) and type(expr.right.value) is int \
+                and expr.right.value == 2 and self.typeOf(expr.left) == INT:
+            self.visit(expr.left)
+            self.emitByte(OpCode.DUP, line)
+            self.emitByte(OpCode.MUL, line)
+            return
+
+        self.visit(expr.left)
+        self.visit(expr.right)
 
         if op == TokenType.PLUS:
             self.emitByte(OpCode.ADD, line)
         elif op == TokenType.EQUAL_PLUS:
             self.emitByte(OpCode.ADD, line)
-        elif op == TokenType.MINUS:
+        elif op == TokenType.MINUS or op == TokenType.EQUAL_MINUS:
             self.emitByte(OpCode.SUB, line)
-        elif op == TokenType.STAR:
+        elif op == TokenType.STAR or op == TokenType.EQUAL_MULT:
             self.emitByte(OpCode.MUL, line)
-        elif op == TokenType.SLASH:
+        elif op == TokenType.SLASH or op == TokenType.EQUAL_DIV:
             self.emitByte(OpCode.DIV, line)
-        elif op == TokenType.PERCENT:
+        elif op == TokenType.PERCENT or op == TokenType.MOD:
             self.emitByte(OpCode.MOD, line)
+        elif op == TokenType.POWER:
+            self.emitByte(OpCode.POW, line)
         elif op == TokenType.GREATER:
             self.emitByte(OpCode.GREATER, line)
         elif op == TokenType.GREATER_EQUAL:
@@ -94,11 +186,28 @@ class ByteGenerator (Visitor):
             self.emitByte(OpCode.LESS_EQUAL, line)
         elif op == TokenType.BANG_EQUAL:
             self.emitByte(OpCode.NOT_EQUAL, line)
+        elif op == TokenType.EQUAL_EQUAL:
+            self.emitByte(OpCode.EQUAL, line)
 
     def visit_unary(self, expr):
         op = expr.operator.type
         line = expr.operator.line
-        expr.right.accept(self)
+        right = expr.right
+
+        # !(a < b) is a >= b; !!b is b for a boolean and -(-x) is x for a number
+        if op == TokenType.BANG and isinstance(right, Binary) and right.operator.type in INVERSE \
+                and self.invertible(right):
+            self.visit(right.left)
+            self.visit(right.right)
+            self.emitByte(INVERSE[right.operator.type], right.operator.line)
+            return
+        if isinstance(right, Unary) and right.operator.type == op:
+            inner = self.typeOf(right.right)
+            if (op == TokenType.BANG and inner == BOOL) or (op == TokenType.MINUS and only(inner, NUMBER)):
+                self.visit(right.right)
+                return
+
+        self.visit(right)
 
         if op == TokenType.MINUS:
             self.emitByte(OpCode.NEGATE, line)
@@ -106,22 +215,21 @@ class ByteGenerator (Visitor):
             self.emitByte(OpCode.NOT, line)
 
     def visit_number(self, expr):
-        self.emit_constant(expr.value, expr.token.line)
+        self.emit_constant(expr.value, expr.token)
         
 
     def visit_string(self, expr):
-        self.emit_constant(expr.value, expr.token.line)
+        self.emit_constant(expr.value, expr.token)
 
     def visit_boolean(self, expr):
-        self.emit_constant(expr.value, expr.token.line)
+        self.emit_constant(expr.value, expr.token)
 
     def visit_nil(self, expr):
-        self.emit(OpCode.NIL, expr.token.line)
+        self.emitByte(OpCode.NIL, expr.token.line)
 
 
     def visit_pre_process(self, expr):
-        print("PRE PROCESS")
-        expr.variable.accept(self)  
+        self.visit(expr.variable)  
         if expr.operator.type == TokenType.PLUS_PLUS:
             self.emitByte(OpCode.OPINC, expr.operator.line)
             
@@ -130,47 +238,49 @@ class ByteGenerator (Visitor):
         if isinstance(expr.variable, Variable):
             resolve = self.compiler.resolveLocal(expr.variable.name.lexeme)
             if resolve == -1:
-                index = self.compiler.addConstant(expr.variable.name.lexeme)
+                index = self.addName(expr.variable.name)
                 self.emitBytes(OpCode.GLOBAL_ASSIGN, index, expr.operator.line)  # Atualiza o valor incrementado/decrementado
             else:
                 self.emitBytes(OpCode.LOCAL_SET, resolve, expr.operator.line)  # Atualiza o valor incrementado/decrementado
     def visit_post_process(self, expr):
-        print("POST PROCESS")
-
-        
         task = Task()
         self.taks.append(task)
         
-        expr.variable.accept(self)  
+        self.visit(expr.variable)  
+        # the deferred update re-reads the variable, since the value pushed above is consumed by the enclosing expression
+        line = expr.operator.line
+        resolve = self.compiler.resolveLocal(expr.variable.name.lexeme)
+        if resolve == -1:
+            index = self.addName(expr.variable.name)
+            task.emitBytes(OpCode.GLOBAL_GET, index, line)
+        else:
+            task.emitBytes(OpCode.LOCAL_GET, resolve, line)
         if expr.operator.type == TokenType.PLUS_PLUS:
-            task.emitByte(OpCode.OPINC, expr.operator.line)
-
+            task.emitByte(OpCode.OPINC, line)
         elif expr.operator.type == TokenType.MINUS_MINUS:
-            task.emitByte(OpCode.OPDEC, expr.operator.line)
-        if isinstance(expr.variable, Variable):
-            resolve = self.compiler.resolveLocal(expr.variable.name.lexeme)
-            if resolve == -1:
-                index = self.compiler.addConstant(expr.variable.name.lexeme)
-                task.emitBytes(OpCode.GLOBAL_ASSIGN, index, expr.operator.line)  # Atualiza o valor incrementado/decrementado
-            else:
-                task.emitBytes(OpCode.LOCAL_SET, resolve, expr.operator.line)  # Atualiza o valor incrementado/decrementado
-
+            task.emitByte(OpCode.OPDEC, line)
+        if resolve == -1:
+            task.emitBytes(OpCode.GLOBAL_ASSIGN, index, line)  # Atualiza o valor incrementado/decrementado
+        else:
+            task.emitBytes(OpCode.LOCAL_SET, resolve, line)  # Atualiza o valor incrementado/decrementado
+        task.emitByte(OpCode.POP, line)
 
-        
     
 
     def visit_expression_statement(self, stmt):
-        stmt.expression.accept(self)
+        self.visit(stmt.expression)
+        self.emitByte(OpCode.POP, self.lastLine())
+        self.processTasks()
 
     
     def visit_grouping(self, expr):
-        expr.expression.accept(self)
+        self.visit(expr.expression)
 
     def visit_variable(self, expr):
         #print("READ VARIABLE",expr.name)
         resolve = self.compiler.resolveLocal(expr.name.lexeme)
         if resolve == -1:
-            index = self.compiler.addConstant(expr.name.lexeme)
+            index = self.addName(expr.name)
             self.emitBytes(OpCode.GLOBAL_GET, index, expr.name.line)
         else:
             self.emitBytes(OpCode.LOCAL_GET, resolve, expr.name.line)
@@ -178,40 +288,140 @@ class ByteGenerator (Visitor):
     def visit_assign(self, expr):
         #print("ASSIGN",expr.name)
 
-        expr.value.accept(self)
+        self.visit(expr.value)
         resolve = self.compiler.resolveLocal(expr.name.lexeme)
         if resolve == -1:
-            index = self.compiler.addConstant(expr.name.lexeme)
+            index = self.addName(expr.name)
             self.emitBytes(OpCode.GLOBAL_ASSIGN, index, expr.name.line)
         else:
             self.emitBytes(OpCode.LOCAL_SET, resolve, expr.name.line)
 
     def visit_declaration(self, expr):
         #print("DECLARATION",expr.name.lexeme)
-        expr.initializer.accept(self)
+        if expr.initializer is None:
+            self.emitByte(OpCode.NIL, expr.name.line)
+        else:
+            self.visit(expr.initializer)
 
         if self.compiler.scopeDepth == 0:
-            index = self.compiler.addConstant(expr.name.lexeme)
+            index = self.addName(expr.name)
             self.emitBytes(OpCode.GLOBAL_SET, index, expr.name.line)
         else:
+            # the initializer value stays on the stack as the local's slot
             if not self.compiler.declareVariable(expr.name.lexeme, False):
-                self.error(expr.name, "Variable already declared in this scope.")
+                self.interpreter.error(expr.name, "Variable already declared in this scope.")
+            if self.compiler.localCount > 0x10000:
+                self.interpreter.error(expr.name, "Too many local variables.")
+        self.processTasks()
             
 
     def visit_program(self, program):
+        # processes may be spawned before their declaration, so register them all first
+        for statement in program.statements:
+            if isinstance(statement, ProcessDeclaration):
+                name = statement.name.lexeme
+                if name in self.processes:
+                    self.interpreter.error(statement.name, "Process already declared.")
+                code = self.interpreter.NewCompiler(name)
+                code.arity = len(statement.params)
+                self.processes[name] = code
         for statement in program.statements:
-            statement.accept(self)
+            self.visit(statement)
         self.emitByte(OpCode.NIL,self.lastLine()+1)
         self.emitByte(OpCode.RETURN,self.lastLine()+1)
 
+    def visit_process_declaration(self, stmt):
+        if self.compiler is not self.interpreter.GetCurrent() or self.compiler.scopeDepth > 0:
+            self.interpreter.error(stmt.name, "Processes can only be declared at top level.")
+        enclosing = self.compiler
+        self.compiler = self.processes[stmt.name.lexeme]
+        # parameters are the first locals, placed on the new process stack by SPAWN
+        self.compiler.beginScope()
+        for param in stmt.params:
+            if not self.compiler.declareVariable(param.lexeme, True):
+                self.interpreter.error(param, "Duplicate parameter name.")
+        for statement in stmt.body.statements:
+            self.visit(statement)
+        self.processTasks()
+        line = self.lastLine(stmt.name.line)
+        self.emitByte(OpCode.NIL, line)
+        self.emitByte(OpCode.RETURN, line)
+        self.compiler = enclosing
+
+    def visit_call(self, expr):
+        name = expr.callee.name
+        code = self.processes.get(name.lexeme)
+        if code is None:
+            self.interpreter.error(name, "Undefined process.")
+        if len(expr.arguments) != code.arity:
+            self.interpreter.error(expr.paren, f"Expected {code.arity} arguments but got {len(expr.arguments)}.")
+        for argument in expr.arguments:
+            self.visit(argument)
+        self.emitBytes(OpCode.SPAWN, self.addConstant(code, expr.paren), expr.paren.line)
+
+    def visit_frame_statement(self, stmt):
+        self.processTasks()
+        self.emitByte(OpCode.FRAME, stmt.token.line)
+
+    def visit_return_statement(self, stmt):
+        if stmt.value is None:
+            self.emitByte(OpCode.NIL, stmt.token.line)
+        else:
+            self.visit(stmt.value)
+        self.processTasks()
+        self.emitByte(OpCode.RETURN, stmt.token.line)
+
+    def visit_logical(self, expr):
+        self.visit(expr.left)
+        line = expr.operator.line
+        if expr.operator.type == TokenType.AND:
+            jump = self.emitJump(OpCode.JUMP_IF_FALSE, line)
+        else:
+            jump = self.emitJump(OpCode.JUMP_IF_TRUE, line)
+        self.emitByte(OpCode.POP, line)
+        self.visit(expr.right)
+        self.patchJump(jump, expr.operator)
+
+    def visit_if_statement(self, stmt):
+        self.visit(stmt.condition)
+        self.processTasks()
+        line = self.lastLine()
+        thenJump = self.emitJump(OpCode.JUMP_IF_FALSE, line)
+        self.emitByte(OpCode.POP, line)
+        self.visit(stmt.then_branch)
+        elseJump = self.emitJump(OpCode.JUMP, self.lastLine())
+        self.patchJump(thenJump, stmt.token)
+        self.emitByte(OpCode.POP, line)
+        if stmt.else_branch is not None:
+            self.visit(stmt.else_branch)
+        self.patchJump(elseJump, stmt.token)
+
+    def visit_while_statement(self, stmt):
+        start = self.counter()
+        self.visit(stmt.condition)
+        self.processTasks()
+        line = self.lastLine()
+        exitJump = self.emitJump(OpCode.JUMP_IF_FALSE, line)
+        self.emitByte(OpCode.POP, line)
+        self.visit(stmt.body)
+        self.emitLoop(start, stmt.token)
+        self.patchJump(exitJump, stmt.token)
+        self.emitByte(OpCode.POP, line)
+
+    def visit_loop_statement(self, stmt):
+        start = self.counter()
+        self.visit(stmt.body)
+        self.emitLoop(start, stmt.token)
+
     def visit_block_statement(self, stmt):
         self.compiler.beginScope()
-        for declaration in stmt.declarations:
-            declaration.accept(self)
-        self.compiler.endScope()
+        for statement in stmt.statements:
+            self.visit(statement)
         self.processTasks()
+        for _ in range(self.compiler.endScope()):
+            self.emitByte(OpCode.POP, self.lastLine())
 
     def visit_print_statement(self, stmt):
-        stmt.expression.accept(self)
+        self.visit(stmt.expression)
         self.emitByte(OpCode.PRINT, stmt.token.line)
         self.processTasks()
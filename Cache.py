@@ -0,0 +1,124 @@
+import hashlib
+import marshal
+import os
+from array import array
+from Compiler import OPS, Code
+from Verifier import verify, VerifyError
+
+# MAGIC, then the SHA-1 of the marshalled payload, then the payload; the digest
+# is checked before unmarshalling, since marshal trusts the lengths it reads
+MAGIC = b"BUC\x00"
+VERSION = 3
+
+# modules whose changes make cached bytecode stale
+FRONTEND = ("Lexer.py", "Parser.py", "Ast.py", "ByteCode.py", "Types.py", "Compiler.py", "Optimizer.py",
+            "Verifier.py", "Cache.py")
+
+# stands in for a process code object inside a serialized constant pool
+CODE = "__code__"
+
+
+def compilerHash():
+    digest = hashlib.sha1(str(VERSION).encode())
+    for op, info in OPS.items():
+        digest.update(f"{op.value}={info.name}{info.operands}{info.pops},{info.pushes},{info.ends};".encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in FRONTEND:
+        try:
+            with open(os.path.join(here, name), "rb") as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(name.encode())
+    return digest.hexdigest()
+
+
+def sourceHash(source):
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+class BytecodeCache:
+    # Stores every frozen Code (bytes, line table, constants) and the global
+    # name table as <script>.buc, next to the source or in cacheDir. The main
+    # chunk comes first; process chunks referenced from constants follow it.
+    def __init__(self, interpreter, cacheDir=None):
+        self.interpreter = interpreter
+        self.cacheDir = cacheDir
+        # an optimized and an unoptimized build of one script are different bytecode
+        self.version = compilerHash() + (":optimized" if interpreter.optimize else ":plain")
+
+    def path(self, sourcePath):
+        base = os.path.splitext(sourcePath)[0] + ".buc"
+        if self.cacheDir is None:
+            return base
+        return os.path.join(self.cacheDir, os.path.basename(base))
+
+    def dump(self, code, codes):
+        constants = []
+        for value in code.constants:
+            if isinstance(value, Code):
+                value = (CODE, codes.index(value))
+            constants.append(value)
+        return (code.name, code.arity, code.bytes, array('I', code.lines).tobytes(), constants)
+
+    def restore(self, data, names):
+        name, arity, code, lines, constants = data
+        table = array('I')
+        table.frombytes(lines)
+        return Code(name, arity, code, table, (), names)
+
+    def link(self, code, data, codes):
+        constants = []
+        for value in data[-1]:
+            if type(value) is tuple:
+                if len(value) != 2 or value[0] != CODE or not 0 <= value[1] < len(codes):
+                    raise ValueError(f"bad process reference {value!r}")
+                value = codes[value[1]]
+            constants.append(value)
+        code.link(constants)
+
+    def save(self, sourcePath, source):
+        path = self.path(sourcePath)
+        codes = self.interpreter.codes
+        chunks = [self.dump(code, codes) for code in codes]
+        payload = (self.version, sourceHash(source), list(self.interpreter.names), chunks)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp = path + ".tmp"
+        try:
+            data = marshal.dumps(payload)
+            with open(temp, "wb") as f:
+                f.write(MAGIC)
+                f.write(hashlib.sha1(data).digest())
+                f.write(data)
+            os.replace(temp, path)
+        except OSError:
+            return False
+        return True
+
+    def load(self, sourcePath, source):
+        try:
+            with open(self.path(sourcePath), "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    return False
+                check = f.read(20)
+                data = f.read()
+            if hashlib.sha1(data).digest() != check:
+                return False
+            version, digest, names, chunks = marshal.loads(data)
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+        if version != self.version or digest != sourceHash(source):
+            return False
+        try:
+            codes = [self.restore(data, names) for data in chunks]
+            for code, data in zip(codes, chunks):
+                self.link(code, data, codes)
+            verify(codes)
+        except (VerifyError, ValueError, TypeError, IndexError):
+            # damaged or hand-edited: compile from source instead
+            return False
+        for name in names:
+            self.interpreter.names.intern(name)
+        self.interpreter.load(codes)
+        return True
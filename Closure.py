@@ -0,0 +1,387 @@
+import itertools
+import time
+import weakref
+
+from Compiler import OpCode, OPS, State, UNDEFINED, Code
+from Optimizer import Peephole, JUMPS
+
+
+# Translates a frozen Code into one generated Python generator function, built
+# once per Code and shared by every fiber that runs it (engine "closure").
+#
+# Basic blocks become branches of a `while True` dispatch on a block number;
+# inside a block, values move through Python temporaries instead of the list
+# stack, and constants, slots and operands are inlined, so nothing is fetched
+# or decoded at run time. The list stack only holds what is live across block
+# boundaries, FRAME and locals below the block's entry depth. FRAME is a
+# `yield`, so a process resumes in the middle of its block on the next tick.
+
+BINARY = {
+    OpCode.ADD: "+",
+    OpCode.SUB: "-",
+    OpCode.MUL: "*",
+    OpCode.DIV: "/",
+    OpCode.MOD: "%",
+    OpCode.POW: "**",
+    OpCode.EQUAL: "==",
+    OpCode.NOT_EQUAL: "!=",
+    OpCode.GREATER: ">",
+    OpCode.GREATER_EQUAL: ">=",
+    OpCode.LESS: "<",
+    OpCode.LESS_EQUAL: "<=",
+}
+
+# net stack effect, for the entry depth of each block; SPAWN depends on its target
+EFFECT = {op: info.pushes - info.pops for op, info in OPS.items() if info.pops is not None}
+
+ENDS = tuple(op for op, info in OPS.items() if info.ends)
+
+# compiled units by Code, and by generated file name for tracebacks and the profiler;
+# a Unit holds no reference to its Code, so both entries go when the Code does
+UNITS = weakref.WeakKeyDictionary()
+FILES = weakref.WeakValueDictionary()
+SERIAL = itertools.count()
+
+
+class Unit:
+    # the generated function of one Code plus its Python line -> bytecode offset map
+    def __init__(self, code, function, source, offsets, filename):
+        self.name = code.name
+        self.lines = code.lines
+        self.function = function
+        self.source = source
+        self.offsets = offsets
+        self.filename = filename
+
+    def offset(self, lineno):
+        if 0 < lineno < len(self.offsets):
+            return self.offsets[lineno]
+        return 0
+
+    def line(self, lineno):
+        lines = self.lines
+        return lines[min(self.offset(lineno), len(lines) - 1)] if lines else 0
+
+
+def unit(code):
+    compiled = UNITS.get(code)
+    if compiled is None:
+        compiled = UNITS[code] = ClosureCompiler(code).build()
+        FILES[compiled.filename] = compiled
+    return compiled
+
+
+def routine(fiber):
+    return unit(fiber.code).function(fiber, fiber.stack, fiber.globals)
+
+
+def annotate(error, fiber):
+    # map the innermost generated frame of the traceback back to a BU line
+    traceback = error.__traceback__
+    found = None
+    while traceback is not None:
+        compiled = FILES.get(traceback.tb_frame.f_code.co_filename)
+        if compiled is not None:
+            found = (compiled, traceback.tb_lineno)
+        traceback = traceback.tb_next
+    if found is not None:
+        compiled, lineno = found
+        fiber.ip = compiled.offset(lineno)
+        error.add_note(f"[line {compiled.line(lineno)}] in {compiled.name}")
+
+
+class ClosureCompiler:
+    def __init__(self, code):
+        self.code = code
+        self.lines = []
+        self.offsets = [0]
+        self.temp = 0
+        self.namespace = {
+            "UNDEFINED": UNDEFINED,
+            "FRAME": State.FRAME,
+            "RUNTIME_ERROR": State.RUNTIME_ERROR,
+            "ABORT": State.ABORT,
+            "now": time.time,
+        }
+        # spawn targets are read from the fiber at run time, so the function does
+        # not keep its own or another Code alive
+        for index, value in enumerate(code.constants):
+            if not isinstance(value, Code):
+                self.namespace[f"k{index}"] = value
+
+    def build(self):
+        instructions = Peephole(self.code).decode()
+        blocks = self.blocks(instructions)
+        depths = self.depths(blocks)
+
+        self.emit(0, 0, "def routine(fiber, stack, g):")
+        self.emit(1, 0, "pop = stack.pop")
+        self.emit(1, 0, "spawn = fiber.scheduler.spawn if fiber.scheduler is not None else None")
+        self.emit(1, 0, "block = 0")
+        self.emit(1, 0, "while True:")
+        self.dispatch(blocks, depths, 0, len(blocks), 2)
+        self.emit(1, 0, "yield")
+
+        source = "\n".join(self.lines) + "\n"
+        filename = f"<bu {self.code.name} {next(SERIAL)}>"
+        exec(compile(source, filename, "exec"), self.namespace)
+        return Unit(self.code, self.namespace["routine"], source, self.offsets, filename)
+
+    def emit(self, indent, offset, text):
+        self.lines.append("    " * indent + text)
+        self.offsets.append(offset)
+
+    def fresh(self):
+        self.temp += 1
+        return f"t{self.temp}"
+
+    def blocks(self, instructions):
+        starts = {0}
+        for index, ins in enumerate(instructions):
+            if ins.target is not None:
+                starts.add(ins.target.offset)
+            if ins.op in JUMPS or ins.op in ENDS:
+                starts.add(instructions[index + 1].offset if index + 1 < len(instructions) else None)
+        blocks = []
+        for ins in instructions:
+            if ins.offset in starts:
+                blocks.append([])
+            blocks[-1].append(ins)
+        self.ids = {block[0].offset: number for number, block in enumerate(blocks)}
+        return blocks
+
+    def effect(self, ins):
+        if ins.op == OpCode.SPAWN:
+            return 1 - self.code.constants[ins.args[0]].arity
+        return EFFECT.get(ins.op, 0)
+
+    def depths(self, blocks):
+        # stack depth on entry to every block; process arguments are already on the stack
+        depths = {0: self.code.arity}
+        work = [0]
+        while work:
+            number = work.pop()
+            depth = depths[number]
+            block = blocks[number]
+            for ins in block:
+                if ins.target is not None:
+                    self.reach(depths, work, self.ids[ins.target.offset], depth + self.effect(ins))
+                depth += self.effect(ins)
+            if block[-1].op not in ENDS and number + 1 < len(blocks):
+                self.reach(depths, work, number + 1, depth)
+        return depths
+
+    def reach(self, depths, work, number, depth):
+        known = depths.get(number)
+        if known is None:
+            depths[number] = depth
+            work.append(number)
+        elif known != depth:
+            raise ValueError(f"{self.code.name}: stack depth {depth} != {known} at block {number}")
+
+    def dispatch(self, blocks, depths, low, high, indent):
+        # binary tree of comparisons on the block number
+        if high - low == 1:
+            if low in depths:
+                Block(self, blocks[low], low, depths[low], len(blocks), indent).translate()
+            else:
+                self.emit(indent, 0, "pass")
+            return
+        middle = (low + high) // 2
+        self.emit(indent, 0, f"if block < {middle}:")
+        self.dispatch(blocks, depths, low, middle, indent + 1)
+        self.emit(indent, 0, "else:")
+        self.dispatch(blocks, depths, middle, high, indent + 1)
+
+
+class Block:
+    # translation state of one basic block: `real` items are in the list stack,
+    # `pending` holds the Python names of the values above them
+    def __init__(self, compiler, instructions, number, depth, count, indent):
+        self.compiler = compiler
+        self.instructions = instructions
+        self.number = number
+        self.real = depth
+        self.pending = []
+        self.count = count
+        self.indent = indent
+        self.offset = instructions[0].offset
+
+    def emit(self, text, indent=0):
+        self.compiler.emit(self.indent + indent, self.offset, text)
+
+    def push(self, value):
+        self.pending.append(value)
+
+    def pop(self):
+        if self.pending:
+            return self.pending.pop()
+        name = self.compiler.fresh()
+        self.emit(f"{name} = pop()")
+        self.real -= 1
+        return name
+
+    def peek(self):
+        if self.pending:
+            return self.pending[-1]
+        name = self.compiler.fresh()
+        self.emit(f"{name} = stack[-1]")
+        return name
+
+    def value(self, expression):
+        name = self.compiler.fresh()
+        self.emit(f"{name} = {expression}")
+        self.push(name)
+
+    def local(self, slot):
+        if slot < self.real:
+            name = self.compiler.fresh()
+            self.emit(f"{name} = stack[{slot}]")
+            return name
+        return self.pending[slot - self.real]
+
+    def flush(self):
+        if len(self.pending) == 1:
+            self.emit(f"stack.append({self.pending[0]})")
+        elif self.pending:
+            self.emit(f"stack.extend(({', '.join(self.pending)},))")
+        self.real += len(self.pending)
+        self.pending = []
+
+    def fail(self, state, message, after):
+        self.emit(f"print({message!r})", 1)
+        self.emit(f"fiber.ip = {after}", 1)
+        self.emit(f"fiber.state = {state}", 1)
+        self.emit("return", 1)
+
+    def goto(self, offset):
+        self.emit(f"block = {self.compiler.ids[offset]}")
+        self.emit("continue")
+
+    def translate(self):
+        names = self.compiler.code.names
+        for index, ins in enumerate(self.instructions):
+            op = ins.op
+            args = ins.args
+            self.offset = ins.offset
+            after = self.instructions[index + 1].offset if index + 1 < len(self.instructions) else None
+
+            if op == OpCode.CONST:
+                self.push(f"k{args[0]}")
+            elif op == OpCode.TRUE:
+                self.push("True")
+            elif op == OpCode.FALSE:
+                self.push("False")
+            elif op == OpCode.NIL:
+                self.push("None")
+            elif op == OpCode.POP:
+                if self.pending:
+                    self.pending.pop()
+                else:
+                    self.emit("del stack[-1]")
+                    self.real -= 1
+            elif op == OpCode.DUP:
+                self.push(self.peek())
+            elif op in BINARY:
+                right = self.pop()
+                left = self.pop()
+                self.value(f"{left} {BINARY[op]} {right}")
+            elif op == OpCode.NOT:
+                self.value(f"not {self.pop()}")
+            elif op == OpCode.NEGATE:
+                self.value(f"-{self.pop()}")
+            elif op == OpCode.OPINC:
+                self.value(f"{self.pop()} + 1")
+            elif op == OpCode.OPDEC:
+                self.value(f"{self.pop()} - 1")
+            elif op == OpCode.ADD_CONST:
+                self.value(f"{self.pop()} + k{args[0]}")
+            elif op == OpCode.PRINT:
+                self.emit(f"print({self.pop()})")
+            elif op == OpCode.NOW:
+                self.value("now()")
+            elif op == OpCode.LOCAL_GET:
+                self.push(self.local(args[0]))
+            elif op == OpCode.LOCAL_SET:
+                slot = args[0]
+                top = self.peek()
+                if slot < self.real:
+                    self.emit(f"stack[{slot}] = {top}")
+                else:
+                    self.pending[slot - self.real] = top
+            elif op == OpCode.ADD_LOCALS:
+                self.value(f"{self.local(args[0])} + {self.local(args[1])}")
+            elif op == OpCode.GLOBAL_GET:
+                slot = args[0]
+                name = self.compiler.fresh()
+                self.emit(f"{name} = g[{slot}]")
+                self.emit(f"if {name} is UNDEFINED:")
+                self.fail("RUNTIME_ERROR", f"Variable {names[slot]} not defined", ins.offset + ins.size())
+                self.push(name)
+            elif op == OpCode.GLOBAL_SET:
+                slot = args[0]
+                self.emit(f"if g[{slot}] is not UNDEFINED:")
+                self.fail("RUNTIME_ERROR", f"Variable {names[slot]} already defined", ins.offset + ins.size())
+                self.emit(f"g[{slot}] = {self.pop()}")
+            elif op == OpCode.GLOBAL_ASSIGN:
+                slot = args[0]
+                self.emit(f"if g[{slot}] is UNDEFINED:")
+                self.fail("RUNTIME_ERROR", f"Undefined variable {names[slot]} ", ins.offset + ins.size())
+                self.emit(f"g[{slot}] = {self.peek()}")
+            elif op == OpCode.INC_GLOBAL or op == OpCode.DEC_GLOBAL:
+                slot = args[0]
+                name = self.compiler.fresh()
+                self.emit(f"{name} = g[{slot}]")
+                self.emit(f"if {name} is UNDEFINED:")
+                self.fail("RUNTIME_ERROR", f"Variable {names[slot]} not defined", ins.offset + ins.size())
+                self.emit(f"{name} = g[{slot}] = {name} {'+' if op == OpCode.INC_GLOBAL else '-'} 1")
+                self.push(name)
+            elif op == OpCode.SPAWN:
+                target = self.compiler.code.constants[args[0]]
+                arguments = [self.pop() for _ in range(target.arity)]
+                arguments.reverse()
+                self.value(f"spawn(fiber.constants[{args[0]}], [{', '.join(arguments)}])")
+            elif op == OpCode.FRAME:
+                self.flush()
+                self.emit(f"fiber.ip = {ins.offset + 1}")
+                self.emit("yield FRAME")
+            elif op == OpCode.JUMP or op == OpCode.LOOP or op == OpCode.BACK:
+                self.flush()
+                self.goto(ins.target.offset)
+                return
+            elif op == OpCode.JUMP_IF_FALSE or op == OpCode.JUMP_IF_TRUE:
+                condition = self.peek()
+                self.flush()
+                test = "not " if op == OpCode.JUMP_IF_FALSE else ""
+                self.emit(f"if {test}{condition}:")
+                self.emit(f"block = {self.compiler.ids[ins.target.offset]}", 1)
+                self.emit("continue", 1)
+                if after is None:
+                    self.goto(self.nextOffset())
+                    return
+            elif op == OpCode.RETURN:
+                self.pop()
+                self.emit(f"fiber.ip = {ins.offset + 1}")
+                self.emit("return")
+                return
+            elif op == OpCode.HALT:
+                self.emit('print("HALT")')
+                self.emit(f"fiber.ip = {ins.offset + 1}")
+                self.emit("fiber.state = ABORT")
+                self.emit("return")
+                return
+            else:
+                self.emit(f'print("UNKNOWN INSTRUCTION {int(op)}")')
+                self.emit(f"fiber.ip = {ins.offset + 1}")
+                self.emit("fiber.state = RUNTIME_ERROR")
+                self.emit("return")
+                return
+        self.flush()
+        if self.number + 1 < self.count:
+            self.goto(self.nextOffset())
+        else:
+            self.emit("return")
+
+    def nextOffset(self):
+        last = self.instructions[-1]
+        return last.offset + last.size()
@@ -1,13 +1,17 @@
-from enum import Enum, auto
+from enum import Enum, IntEnum, auto
+from array import array
+import sys
 import time
+import random
 
 class State(Enum):
     OK = auto()
     RUNTIME_ERROR = auto()
     ABORT = auto()
+    FRAME = auto()  # the running process yielded until the next tick
     
 
-class OpCode(Enum):
+class OpCode(IntEnum):
     PUSH     = auto()
     POP      = auto()
     DUP      = auto()
@@ -29,6 +33,7 @@ class OpCode(Enum):
     DIV      = auto()
     NEG      = auto()
     MOD       = auto()
+    POW      = auto()
 
     TRUE     = auto()
     FALSE    = auto()
@@ -61,73 +66,150 @@ class OpCode(Enum):
     LOCAL_SET = auto()
     LOCAL_GET = auto()
 
-class Local:
-    def __init__(self, name, index, depth, isArgument):
+    WIDE     = auto()  # next instruction carries a 16-bit operand
+
+    # superinstructions emitted by Optimizer.Peephole
+    ADD_CONST  = auto()
+    ADD_LOCALS = auto()
+    INC_GLOBAL = auto()
+    DEC_GLOBAL = auto()
+
+    # processes
+    FRAME    = auto()
+    SPAWN    = auto()
+
+    # specialized forms Quicken writes into a session's adaptive copy; never in a Code
+    GLOBAL_GET_DEFINED    = auto()
+    GLOBAL_ASSIGN_DEFINED = auto()
+    INC_GLOBAL_DEFINED    = auto()
+    DEC_GLOBAL_DEFINED    = auto()
+    LESS_JUMP          = auto()
+    LESS_EQUAL_JUMP    = auto()
+    GREATER_JUMP       = auto()
+    GREATER_EQUAL_JUMP = auto()
+    EQUAL_JUMP         = auto()
+    NOT_EQUAL_JUMP     = auto()
+
+class Undefined:
+    def __repr__(self):
+        return "undefined"
+
+UNDEFINED = Undefined()
+
+
+class OpInfo:
+    # one row of OPS
+    __slots__ = ('name', 'operands', 'pops', 'pushes', 'ends')
+
+    def __init__(self, name, operands, pops, pushes, ends):
         self.name = name
-        self.index = index
-        self.depth = depth
-        self.isArgument = False
-        self.value = None
-        
+        self.operands = operands
+        self.pops = pops
+        self.pushes = pushes
+        self.ends = ends
 
-class Compiler:
-    def __init__(self,name, interpreter):
-        self.bytes = []
-        self.lines = []
-        self.constants = []
-        self.stack = []
-        self.index = 0
-        self.name=name
-        self.locals=[]
-        self.scopeDepth = 0
-        self.ip = 0
-        self.interpreter = interpreter
 
-    def declareVariable(self, name, isArgument):
-        for i in range(len(self.locals) - 1, -1, -1):
-            if self.locals[i].name == name and self.locals[i].depth == self.scopeDepth:
-                print(f"Variable '{name}' already declared in this scope")
-                return False
-        self.locals.append(Local(name, len(self.locals), self.scopeDepth, isArgument))
-        return True
-    
-    def resolveLocal(self, name):
-        for i in range(len(self.locals) - 1, -1, -1):
-            if self.locals[i].name == name and self.locals[i].depth == self.scopeDepth:
-                return self.locals[i].index
-        return -1
+# The opcode table read by the listing, Optimizer's decoder, Closure, the .buc
+# version hash and Verifier.
+#   operands: the kind of each operand -- "local" (stack slot), "constant",
+#     "name" (global slot) or "byte", one byte each or two after WIDE; "jump"
+#     and "loop" are a 16-bit offset forward / back from the next instruction
+#   pops, pushes: values taken from and left on the stack; the conditional
+#     jumps only peek. SPAWN also pops its target's arity. pops is None for
+#     opcodes no Code may hold: the unused ones, the WIDE prefix itself and
+#     Quicken's specialized forms
+#   ends: control never falls through to the next instruction
+OPS = {}
+
+def opcode(op, name, operands=(), pops=0, pushes=0, ends=False):
+    OPS[op] = OpInfo(name, operands, pops, pushes, ends)
+
+opcode(OpCode.PUSH, "PUSH", ("byte",), None)
+opcode(OpCode.POP, "POP", pops=1)
+opcode(OpCode.DUP, "DUP", pops=1, pushes=2)
+opcode(OpCode.CONST, "CONST", ("constant",), pushes=1)
+opcode(OpCode.HALT, "HALT", ends=True)
+opcode(OpCode.NOW, "NOW", pushes=1)
+opcode(OpCode.PRINT, "PRINT", pops=1)
+opcode(OpCode.LOOP, "LOOP", ("loop",), ends=True)
+opcode(OpCode.BACK, "BACK", ("loop",), None, ends=True)
+opcode(OpCode.JUMP, "JUMP", ("jump",), ends=True)
+opcode(OpCode.JUMP_IF_FALSE, "JUMP_IF_FALSE", ("jump",), 1, 1)
+opcode(OpCode.JUMP_IF_TRUE, "JUMP_IF_TRUE", ("jump",), 1, 1)
+for op in (OpCode.ADD, OpCode.SUB, OpCode.MUL, OpCode.DIV, OpCode.MOD, OpCode.POW,
+           OpCode.EQUAL, OpCode.NOT_EQUAL, OpCode.GREATER, OpCode.GREATER_EQUAL, OpCode.LESS, OpCode.LESS_EQUAL):
+    opcode(op, op.name, pops=2, pushes=1)
+opcode(OpCode.NEG, "NEG", pops=None)
+opcode(OpCode.TRUE, "TRUE", pushes=1)
+opcode(OpCode.FALSE, "FALSE", pushes=1)
+opcode(OpCode.OPADD, "OP_ADD", pops=None)
+opcode(OpCode.OPSUB, "OP_SUB", pops=None)
+opcode(OpCode.OPMUL, "OP_MUL", pops=None)
+opcode(OpCode.OPDIV, "OP_DIV", pops=None)
+opcode(OpCode.OPINC, "OP_INC", pops=1, pushes=1)
+opcode(OpCode.OPDEC, "OP_DEC", pops=1, pushes=1)
+opcode(OpCode.AND, "AND", pops=None)
+opcode(OpCode.OR, "OR", pops=None)
+opcode(OpCode.NOT, "NOT", pops=1, pushes=1)
+opcode(OpCode.NEGATE, "NEGATE", pops=1, pushes=1)
+opcode(OpCode.NIL, "NIL", pushes=1)
+opcode(OpCode.RETURN, "RETURN", pops=1, ends=True)
+opcode(OpCode.GLOBAL_SET, "GLOBAL_SET", ("name",), pops=1)
+opcode(OpCode.GLOBAL_GET, "GLOBAL_GET", ("name",), pushes=1)
+opcode(OpCode.GLOBAL_ASSIGN, "GLOBAL_ASSIGN", ("name",), 1, 1)
+opcode(OpCode.LOCAL_SET, "LOCAL_SET", ("local",), 1, 1)
+opcode(OpCode.LOCAL_GET, "LOCAL_GET", ("local",), pushes=1)
+opcode(OpCode.WIDE, "WIDE", pops=None)
+opcode(OpCode.ADD_CONST, "ADD_CONST", ("constant",), 1, 1)
+opcode(OpCode.ADD_LOCALS, "ADD_LOCALS", ("local", "local"), pushes=1)
+opcode(OpCode.INC_GLOBAL, "INC_GLOBAL", ("name",), pushes=1)
+opcode(OpCode.DEC_GLOBAL, "DEC_GLOBAL", ("name",), pushes=1)
+opcode(OpCode.FRAME, "FRAME")
+opcode(OpCode.SPAWN, "SPAWN", ("constant",), pushes=1)
+for op in (OpCode.GLOBAL_GET_DEFINED, OpCode.GLOBAL_ASSIGN_DEFINED, OpCode.INC_GLOBAL_DEFINED, OpCode.DEC_GLOBAL_DEFINED):
+    opcode(op, op.name, ("name",), None)
+for op in (OpCode.LESS_JUMP, OpCode.LESS_EQUAL_JUMP, OpCode.GREATER_JUMP, OpCode.GREATER_EQUAL_JUMP,
+           OpCode.EQUAL_JUMP, OpCode.NOT_EQUAL_JUMP):
+    opcode(op, op.name, pops=None)
+
+
+class Names(list):
+    def __init__(self):
+        list.__init__(self)
+        self.slots = {}
+
+    def intern(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = len(self)
+            self.append(sys.intern(name))
+            self.slots[name] = slot
+        return slot
+
+
+class Chunk:
+    def __init__(self):
+        self.bytes = bytearray()
+        self.lines = array('I')
 
-    def push(self, value):
-        self.stack.append(value)
-    
-    def pop(self):
-        return self.stack.pop()
-    
-    def popn(self, n):
-        return [self.stack.pop() for _ in range(n)]
-    
-    def peek(self, index=0):
-        return self.stack[len(self.stack) - 1 - index]
-    
-    def addConstant(self, value):
-        if value in self.constants:
-            return self.constants.index(value)
-        self.constants.append(value)
-        return self.constants.index(value)
-    
     def write(self, byte, line):
         self.bytes.append(byte)
         self.lines.append(line)
 
-    def write_bytes(self, b0, b1, line):
-        self.write(b0, line)
-        self.write(b1, line)
+    def write_bytes(self, op, operand, line):
+        if operand > 0xFF:
+            self.write(OpCode.WIDE, line)
+            self.write(op, line)
+            self.write(operand >> 8, line)
+            self.write(operand & 0xFF, line)
+        else:
+            self.write(op, line)
+            self.write(operand, line)
 
-    def beginScope(self):
-        self.scopeDepth += 1
 
-    def endScope(self):
-        self.scopeDepth -= 1
+class Listing:
+    # disassembler shared by Compiler and Code; needs name, bytes, lines, constants and names
+    __slots__ = ()
 
     def disassemble(self):
         self.disassembleCode()
@@ -150,98 +232,26 @@ class Compiler:
             print("{:4d} ".format(self.lines[offset]),end='')
 
         instruction = self.bytes[offset]
-
-        if (instruction==OpCode.TRUE):
-            return self.simpleInstruction("TRUE", offset)
-        elif (instruction==OpCode.FALSE):
-            return self.simpleInstruction("FALSE", offset)
-        elif (instruction==OpCode.NIL):
-            return self.simpleInstruction("NIL", offset)
-        elif (instruction==OpCode.NOW):
-            return self.simpleInstruction("NOW", offset)
-        elif (instruction==OpCode.ADD):
-            return self.simpleInstruction("ADD", offset)
-        elif (instruction==OpCode.SUB):
-            return self.simpleInstruction("SUB", offset)
-        elif (instruction==OpCode.MUL):
-            return self.simpleInstruction("MUL", offset)
-        elif (instruction==OpCode.DIV):
-            return self.simpleInstruction("DIV", offset)
-        elif (instruction==OpCode.NEG):
-            return self.simpleInstruction("NEG", offset)
-        elif (instruction==OpCode.MOD):
-            return self.simpleInstruction("MOD", offset)
-        elif (instruction==OpCode.EQUAL):
-            return self.simpleInstruction("EQUAL", offset)
-        elif (instruction==OpCode.NOT_EQUAL):
-            return self.simpleInstruction("NOT_EQUAL", offset)
-        elif (instruction==OpCode.GREATER):
-            return self.simpleInstruction("GREATER", offset)
-        elif (instruction==OpCode.GREATER_EQUAL):
-            return self.simpleInstruction("GREATER_EQUAL", offset)
-        elif (instruction==OpCode.LESS):
-            return self.simpleInstruction("LESS", offset)
-        elif (instruction==OpCode.LESS_EQUAL):
-            return self.simpleInstruction("LESS_EQUAL", offset)
-        elif (instruction==OpCode.OPADD):
-            return self.simpleInstruction("OP_ADD", offset)
-        elif (instruction==OpCode.OPSUB):
-            return self.simpleInstruction("OP_SUB", offset)
-        elif (instruction==OpCode.OPMUL):
-            return self.simpleInstruction("OP_MUL", offset)
-        elif (instruction==OpCode.OPDIV):
-            return self.simpleInstruction("OP_DIV", offset)
-        elif (instruction==OpCode.OPINC):
-            return self.simpleInstruction("OP_INC", offset)
-        elif (instruction==OpCode.OPDEC):
-            return self.simpleInstruction("OP_DEC", offset)
-        elif (instruction==OpCode.AND):
-            return self.simpleInstruction("AND", offset)
-        elif (instruction==OpCode.OR):
-            return self.simpleInstruction("OR", offset)
-        elif (instruction==OpCode.NOT):
-            return self.simpleInstruction("NOT", offset)
-        elif (instruction==OpCode.PUSH):
-            return self.byteInstruction("PUSH", offset)
-        elif (instruction==OpCode.POP):
-            return self.simpleInstruction("POP", offset)
-        elif (instruction==OpCode.DUP):
-            return self.simpleInstruction("DUP", offset)
-        elif (instruction==OpCode.HALT):
-            return self.simpleInstruction("HALT", offset)
-        elif (instruction==OpCode.PRINT):
-            return self.simpleInstruction("PRINT", offset)
-        elif (instruction==OpCode.RETURN):
-            return self.simpleInstruction("RETURN", offset)
-        elif (instruction==OpCode.JUMP):
-            return self.jumpInstruction("JUMP", 1, offset)
-        elif (instruction==OpCode.JUMP_IF_FALSE):
-            return self.jumpInstruction("JUMP_IF_FALSE", 1, offset)
-        elif (instruction==OpCode.JUMP_IF_TRUE):
-            return self.jumpInstruction("JUMP_IF_TRUE", 1, offset)
-        elif (instruction==OpCode.LOOP):
-            return self.jumpInstruction("LOOP", -1, offset)
-        elif (instruction==OpCode.BACK):
-            return self.jumpInstruction("BACK", -1, offset)
-        elif (instruction==OpCode.LOCAL_GET):
-            return self.constantInstruction("LOCAL_GET", offset)
-        elif (instruction==OpCode.LOCAL_SET):
-            return self.constantInstruction("LOCAL_SET", offset)
-        elif (instruction==OpCode.CONST):
-            return self.constantInstruction("CONST", offset)
-        elif (instruction==OpCode.GLOBAL_GET):
-            return self.constantInstruction("GLOBAL_GET", offset)
-        elif (instruction==OpCode.GLOBAL_SET):
-            return self.constantInstruction("GLOBAL_SET", offset)
-        elif (instruction==OpCode.GLOBAL_ASSIGN):
-            return self.constantInstruction("GLOBAL_ASSIGN", offset)
-            
-        else :
+        if instruction == OpCode.WIDE:
+            return self.wideInstruction(offset)
+        info = OPS.get(instruction)
+        if info is None:
             print("UNKNOWN")
             return len(self.bytes)
-        
-
-
+        operands = info.operands
+        if not operands:
+            return self.simpleInstruction(info.name, offset)
+        if operands[0] == "jump":
+            return self.jumpInstruction(info.name, 1, offset)
+        if operands[0] == "loop":
+            return self.jumpInstruction(info.name, -1, offset)
+        if len(operands) == 2:
+            return self.twoByteInstruction(info.name, offset)
+        if operands[0] == "constant":
+            return self.constantInstruction(info.name, offset)
+        if operands[0] == "name":
+            return self.nameInstruction(info.name, offset)
+        return self.byteInstruction(info.name, offset)
 
     def simpleInstruction(self, name, offset):
         print(f"{name}")
@@ -252,12 +262,36 @@ class Compiler:
         print("{:<16s} {:>4d}".format(name, slot))
         return offset + 2
  
+    def twoByteInstruction(self, name, offset):
+        a = self.bytes[offset + 1]
+        b = self.bytes[offset + 2]
+        print("{:<16s} {:>4d} {:>4d}".format(name, a, b))
+        return offset + 3
+
     def constantInstruction(self, name, offset):
        slot = self.bytes[offset + 1]
        print("{:<16s} {:>4d} '".format(name, slot),end='')
        value = self.constants[slot]
        print(f"{value}'")
        return offset + 2
+    def nameInstruction(self, name, offset):
+       slot = self.bytes[offset + 1]
+       print("{:<16s} {:>4d} '{}'".format(name, slot, self.names[slot]))
+       return offset + 2
+
+    def wideInstruction(self, offset):
+        op = OpCode(self.bytes[offset + 1])
+        slot = self.bytes[offset + 2] << 8 | self.bytes[offset + 3]
+        print("{:<16s} {:>4d}".format("WIDE " + op.name, slot),end='')
+        kind = OPS[op].operands[0]
+        if kind == "name":
+            print(f" '{self.names[slot]}'")
+        elif kind == "constant":
+            print(f" '{self.constants[slot]}'")
+        else:
+            print("")
+        return offset + 4
+
     def jumpInstruction(self, name, sign, offset):
         jump = self.bytes[offset + 1] << 8
         jump |= self.bytes[offset + 2]
@@ -265,17 +299,289 @@ class Compiler:
         return offset + 3
 
 
+class Compiler(Chunk, Listing):
+    def __init__(self,name, interpreter):
+        Chunk.__init__(self)
+        self.constants = []
+        self.constantIndex = {}
+        self.names = interpreter.names
+        self.index = 0
+        self.name=name
+        self.scopes = []
+        self.localCount = 0
+        self.scopeDepth = 0
+        self.arity = 0
+        self.interpreter = interpreter
+
+    def __repr__(self):
+        return f"<process {self.name}>"
+
+    def declareVariable(self, name, isArgument):
+        # a local is the stack slot its initializer left behind, relative to the frame base
+        scope = self.scopes[-1]
+        if name in scope:
+            print(f"Variable '{name}' already declared in this scope")
+            return False
+        scope[name] = self.localCount
+        self.localCount += 1
+        return True
+    
+    def resolveLocal(self, name):
+        for scope in reversed(self.scopes):
+            slot = scope.get(name)
+            if slot is not None:
+                return slot
+        return -1
+
+    def addConstant(self, value):
+        # keyed on type so True, 1 and 1.0 keep separate slots
+        key = (type(value), value)
+        index = self.constantIndex.get(key)
+        if index is None:
+            index = len(self.constants)
+            self.constants.append(value)
+            self.constantIndex[key] = index
+        return index
+
+    def addName(self, name):
+        return self.names.intern(name)
+    
+    def beginScope(self):
+        self.scopeDepth += 1
+        self.scopes.append({})
+
+    def endScope(self):
+        self.scopeDepth -= 1
+        count = len(self.scopes.pop())
+        self.localCount -= count
+        return count
+
+
+
+class Code(Listing):
+    # Frozen output of the compiler: the bytecode, line table, constants and global
+    # names of one chunk. Fibers only read it, so any number of them, in any
+    # thread, can run the same Code at once.
+    __slots__ = ('name', 'arity', 'bytes', 'lines', 'constants', 'names', 'depth', '__weakref__')
+
+    def __init__(self, name, arity, code, lines, constants, names):
+        init = object.__setattr__
+        init(self, 'name', name)
+        init(self, 'arity', arity)
+        init(self, 'bytes', bytes(code))
+        init(self, 'lines', tuple(lines))
+        init(self, 'constants', tuple(constants))
+        init(self, 'names', tuple(names))
+        init(self, 'depth', None)
+
+    def link(self, constants):
+        # constants are filled in after every Code exists, since processes may spawn each other
+        object.__setattr__(self, 'constants', tuple(constants))
+
+    def verified(self, depth):
+        # set by Verifier: the deepest the stack gets, spawn arguments included
+        object.__setattr__(self, 'depth', depth)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Code objects are immutable")
+
+    def __repr__(self):
+        return f"<process {self.name}>"
+
+
+def freeze(compilers):
+    codes = {compiler: Code(compiler.name, compiler.arity, compiler.bytes, compiler.lines, (), compiler.names) for compiler in compilers}
+    for compiler, code in codes.items():
+        code.link(codes[value] if isinstance(value, Compiler) else value for value in compiler.constants)
+    return [codes[compiler] for compiler in compilers]
+
+
+class Fiber:
+    # Run-time state of one execution of a Code: ip, value stack and frame base.
+    # The code's tables are cached on the fiber to keep lookups in the loop short.
+    __slots__ = ('code', 'bytes', 'constants', 'names', 'globals', 'scheduler', 'engine',
+                 'stats', 'stack', 'ip', 'frame', 'wide', 'state', 'routine', 'sp')
+
+    def __init__(self, code, globals, scheduler=None, engine="loop", stats=None):
+        self.code = code
+        self.bytes = code.bytes
+        self.constants = code.constants
+        self.names = code.names
+        self.globals = globals
+        self.scheduler = scheduler
+        self.engine = engine
+        self.stats = stats
+        self.stack = []
+        self.ip = 0
+        self.frame = 0
+        self.wide = False
+        self.state = State.OK
+        self.routine = None
+        self.sp = 0
+
+    def push(self, value):
+        self.stack.append(value)
+    
+    def pop(self):
+        return self.stack.pop()
+    
+    def popn(self, n):
+        return [self.stack.pop() for _ in range(n)]
+    
+    def peek(self, index=0):
+        return self.stack[len(self.stack) - 1 - index]
+    
+
     def READ_BYTE(self):
         byte = self.bytes[self.ip]
         self.ip += 1
         return byte
+    def READ_OPERAND(self):
+        if self.wide:
+            self.wide = False
+            return self.READ_SHORT()
+        return self.READ_BYTE()
     def READ_CONSTANT(self):
-        return self.constants[self.READ_BYTE()]
+        return self.constants[self.READ_OPERAND()]
     def READ_SHORT(self):
         self.ip += 2
         return self.bytes[self.ip - 2] << 8 | self.bytes[self.ip - 1]
 
+    def execute(self):
+        return getattr(self, ENGINES[self.engine])()
+
+    def runTable(self):
+        code = self.bytes
+        stack = self.stack
+        table = HANDLERS
+        ip = self.ip
+        self.state = State.OK
+        while ip >= 0:
+            ip = table[code[ip]](self, code, ip + 1, stack)
+        return self.state
+
+    def runStats(self):
+        # runTable plus counters; only used when the "stats" engine is selected
+        if self.stats is None:
+            from Stats import Stats
+            self.stats = Stats()
+        stats = self.stats
+        counts = stats.counts
+        pairs = stats.pairs
+        offsets = stats.offsetsFor(self.code)
+        every = stats.sampleEvery
+        jitter = random.randrange
+        clock = time.perf_counter_ns
+        code = self.bytes
+        stack = self.stack
+        table = HANDLERS
+        ip = self.ip
+        previous = 0xFF
+        # carried across resumes, since a process slice is often shorter than the gap
+        countdown = stats.countdown
+        self.state = State.OK
+        while ip >= 0:
+            op = code[ip]
+            offsets[ip] += 1
+            counted = code[ip + 1] if op == OpCode.WIDE else op
+            counts[counted] += 1
+            pairs[previous << 8 | counted] += 1
+            previous = counted
+            countdown -= 1
+            if countdown:
+                ip = table[op](self, code, ip + 1, stack)
+            else:
+                # a random gap averaging `every` keeps the samples from locking onto a loop's period
+                countdown = jitter(1, 2 * every)
+                start = clock()
+                ip = table[op](self, code, ip + 1, stack)
+                stats.sample(counted, clock() - start)
+        stats.countdown = countdown
+        return self.state
+
+    def runQuick(self):
+        # runTable over the session's adaptive copy of the code, which Quicken rewrites as it runs
+        table = self.routine
+        if table is None:
+            from Quicken import HANDLERS, adaptive
+            self.bytes = adaptive(self)
+            table = self.routine = HANDLERS
+        code = self.bytes
+        stack = self.stack
+        ip = self.ip
+        self.state = State.OK
+        while ip >= 0:
+            ip = table[code[ip]](self, code, ip + 1, stack)
+        return self.state
+
+    def runClosure(self):
+        # the code translated to a Python generator by Closure; a FRAME is a yield
+        routine = self.routine
+        if routine is None:
+            import Closure
+            routine = self.routine = Closure.routine(self)
+        self.state = State.OK
+        try:
+            return next(routine)
+        except StopIteration:
+            return self.state
+        except Exception as error:
+            import Closure
+            Closure.annotate(error, self)
+            raise
+
+    def runPython(self):
+        # the process as a generator function built by Transpiler from the AST
+        routine = self.routine
+        if routine is None:
+            import Transpiler
+            routine = self.routine = Transpiler.routine(self)
+        self.state = State.OK
+        try:
+            return next(routine)
+        except StopIteration:
+            return self.state
+        except Exception as error:
+            import Transpiler
+            if isinstance(error, Transpiler.Fault):
+                print(error)
+                self.state = State.RUNTIME_ERROR
+                return self.state
+            Transpiler.annotate(error, self)
+            raise
+
+    def runRegister(self):
+        # three-address code from Register; the stack is the register file
+        from Register import HANDLERS, attach
+        program = self.routine
+        if program is None:
+            program = self.routine = attach(self)
+        code = program.code
+        table = HANDLERS
+        r = self.stack
+        pc = self.ip
+        self.state = State.OK
+        try:
+            while pc >= 0:
+                op, a, b, c = code[pc]
+                pc = table[op](self, r, pc + 1, a, b, c)
+        except Exception as error:
+            self.ip = pc
+            error.add_note(f"[line {program.lines[pc]}] in {program.name}")
+            raise
+        return self.state
+
+    def runFixed(self):
+        # Fixed's inline loop over a stack preallocated to the verified depth
+        run = self.routine
+        if run is None:
+            from Fixed import prepare
+            run = self.routine = prepare(self)
+        self.state = State.OK
+        return run(self)
+
     def run(self):
+        globals = self.globals
         while True:
             intruction = self.READ_BYTE()
             #lineIndex = ( self.ip - self.bytes ) // 2
@@ -327,6 +633,38 @@ class Compiler:
                 right = self.pop()
                 left = self.pop()
                 self.push(left % right)
+            elif intruction == OpCode.POW:
+                right = self.pop()
+                left = self.pop()
+                self.push(left ** right)
+            elif intruction == OpCode.EQUAL:
+                right = self.pop()
+                left = self.pop()
+                self.push(left == right)
+            elif intruction == OpCode.NOT_EQUAL:
+                right = self.pop()
+                left = self.pop()
+                self.push(left != right)
+            elif intruction == OpCode.GREATER:
+                right = self.pop()
+                left = self.pop()
+                self.push(left > right)
+            elif intruction == OpCode.GREATER_EQUAL:
+                right = self.pop()
+                left = self.pop()
+                self.push(left >= right)
+            elif intruction == OpCode.LESS:
+                right = self.pop()
+                left = self.pop()
+                self.push(left < right)
+            elif intruction == OpCode.LESS_EQUAL:
+                right = self.pop()
+                left = self.pop()
+                self.push(left <= right)
+            elif intruction == OpCode.NOT:
+                self.push(not self.pop())
+            elif intruction == OpCode.NEGATE:
+                self.push(-self.pop())
             #BUILT IN
             elif intruction == OpCode.PRINT:
                 value = self.pop()
@@ -335,34 +673,83 @@ class Compiler:
                 self.push(time.time())
             #VARIABLES LOCAL
             elif intruction == OpCode.LOCAL_GET:
-                slot = self.READ_BYTE()
-                self.locals[slot].value = self.peek(0)
+                slot = self.READ_OPERAND()
+                self.push(self.stack[self.frame + slot])
             elif intruction == OpCode.LOCAL_SET:
-                slot = self.READ_BYTE()
-                self.push(self.locals[slot].value)
+                slot = self.READ_OPERAND()
+                self.stack[self.frame + slot] = self.peek(0)
             #VARIABLES GLOBAL
             elif intruction == OpCode.GLOBAL_GET:
-                name = self.READ_CONSTANT()
-                value = self.interpreter.globals.get(name)
-                if not value:
-                    print(f"Variable {name} not defined")
+                slot = self.READ_OPERAND()
+                value = globals[slot]
+                if value is UNDEFINED:
+                    print(f"Variable {self.names[slot]} not defined")
                     return State.RUNTIME_ERROR
                 self.push(value)
             
             elif intruction == OpCode.GLOBAL_SET:
-                name  = self.READ_CONSTANT()
-                value = self.peek()
-                if  self.interpreter.globals.define(name,value)==False:
-                    print(f"Variable {name} already defined")
+                slot = self.READ_OPERAND()
+                if globals[slot] is not UNDEFINED:
+                    print(f"Variable {self.names[slot]} already defined")
                     return State.RUNTIME_ERROR
-                self.pop
+                globals[slot] = self.pop()
                 
             elif intruction == OpCode.GLOBAL_ASSIGN:
-                name = self.READ_CONSTANT()
-                value = self.peek()
-                if not self.interpreter.globals.assign(name,value):
-                    print(f"Undefined variable {name} ")
+                slot = self.READ_OPERAND()
+                if globals[slot] is UNDEFINED:
+                    print(f"Undefined variable {self.names[slot]} ")
                     return State.RUNTIME_ERROR
+                globals[slot] = self.peek()
+            elif intruction == OpCode.WIDE:
+                self.wide = True
+            #SUPERINSTRUCTIONS
+            elif intruction == OpCode.ADD_CONST:
+                const = self.READ_CONSTANT()
+                self.push(self.pop() + const)
+            elif intruction == OpCode.ADD_LOCALS:
+                a = self.READ_BYTE()
+                b = self.READ_BYTE()
+                self.push(self.stack[self.frame + a] + self.stack[self.frame + b])
+            elif intruction == OpCode.INC_GLOBAL:
+                slot = self.READ_OPERAND()
+                value = globals[slot]
+                if value is UNDEFINED:
+                    print(f"Variable {self.names[slot]} not defined")
+                    return State.RUNTIME_ERROR
+                globals[slot] = value + 1
+                self.push(value + 1)
+            elif intruction == OpCode.DEC_GLOBAL:
+                slot = self.READ_OPERAND()
+                value = globals[slot]
+                if value is UNDEFINED:
+                    print(f"Variable {self.names[slot]} not defined")
+                    return State.RUNTIME_ERROR
+                globals[slot] = value - 1
+                self.push(value - 1)
+            #FLOW
+            elif intruction == OpCode.JUMP:
+                offset = self.READ_SHORT()
+                self.ip += offset
+            elif intruction == OpCode.JUMP_IF_FALSE:
+                offset = self.READ_SHORT()
+                if not self.peek(0):
+                    self.ip += offset
+            elif intruction == OpCode.JUMP_IF_TRUE:
+                offset = self.READ_SHORT()
+                if self.peek(0):
+                    self.ip += offset
+            elif intruction == OpCode.LOOP:
+                offset = self.READ_SHORT()
+                self.ip -= offset
+            #PROCESS
+            elif intruction == OpCode.FRAME:
+                return State.FRAME
+            elif intruction == OpCode.SPAWN:
+                code = self.READ_CONSTANT()
+                base = len(self.stack) - code.arity
+                args = self.stack[base:]
+                del self.stack[base:]
+                self.push(self.scheduler.spawn(code, args))
             #CALL
             elif intruction == OpCode.RETURN:
                 self.pop()
@@ -374,4 +761,305 @@ class Compiler:
             
             
 
-        return State.OK
\ No newline at end of file
+        return State.OK
+
+
+ENGINES = {
+    "loop": "run",
+    "table": "runTable",
+    "stats": "runStats",
+    "quick": "runQuick",
+    "closure": "runClosure",
+    "python": "runPython",
+    "register": "runRegister",
+    "fixed": "runFixed",
+}
+
+
+# Handlers for Fiber.runTable: each receives the operand position in ip and
+# returns the next ip, or -1 after setting vm.state to stop the loop.
+
+def op_unknown(vm, code, ip, stack):
+    print(f"UNKNOWN INSTRUCTION {code[ip - 1]}")
+    vm.ip = ip
+    vm.state = State.RUNTIME_ERROR
+    return -1
+
+def op_halt(vm, code, ip, stack):
+    print("HALT")
+    vm.ip = ip
+    vm.state = State.ABORT
+    return -1
+
+def op_return(vm, code, ip, stack):
+    stack.pop()
+    vm.ip = ip
+    vm.state = State.OK
+    return -1
+
+def op_pop(vm, code, ip, stack):
+    stack.pop()
+    return ip
+
+def op_true(vm, code, ip, stack):
+    stack.append(True)
+    return ip
+
+def op_false(vm, code, ip, stack):
+    stack.append(False)
+    return ip
+
+def op_nil(vm, code, ip, stack):
+    stack.append(None)
+    return ip
+
+def op_dup(vm, code, ip, stack):
+    stack.append(stack[-1])
+    return ip
+
+def op_const(vm, code, ip, stack):
+    stack.append(vm.constants[code[ip]])
+    return ip + 1
+
+def op_inc(vm, code, ip, stack):
+    stack[-1] += 1
+    return ip
+
+def op_dec(vm, code, ip, stack):
+    stack[-1] -= 1
+    return ip
+
+def op_add(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] + right
+    return ip
+
+def op_sub(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] - right
+    return ip
+
+def op_mul(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] * right
+    return ip
+
+def op_div(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] / right
+    return ip
+
+def op_mod(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] % right
+    return ip
+
+def op_pow(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] ** right
+    return ip
+
+def op_equal(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] == right
+    return ip
+
+def op_not_equal(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] != right
+    return ip
+
+def op_greater(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] > right
+    return ip
+
+def op_greater_equal(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] >= right
+    return ip
+
+def op_less(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] < right
+    return ip
+
+def op_less_equal(vm, code, ip, stack):
+    right = stack.pop()
+    stack[-1] = stack[-1] <= right
+    return ip
+
+def op_not(vm, code, ip, stack):
+    stack[-1] = not stack[-1]
+    return ip
+
+def op_negate(vm, code, ip, stack):
+    stack[-1] = -stack[-1]
+    return ip
+
+def op_print(vm, code, ip, stack):
+    print(stack.pop())
+    return ip
+
+def op_now(vm, code, ip, stack):
+    stack.append(time.time())
+    return ip
+
+def op_local_get(vm, code, ip, stack):
+    stack.append(stack[vm.frame + code[ip]])
+    return ip + 1
+
+def op_local_set(vm, code, ip, stack):
+    stack[vm.frame + code[ip]] = stack[-1]
+    return ip + 1
+
+def op_global_get(vm, code, ip, stack):
+    slot = code[ip]
+    value = vm.globals[slot]
+    if value is UNDEFINED:
+        print(f"Variable {vm.names[slot]} not defined")
+        vm.ip = ip + 1
+        vm.state = State.RUNTIME_ERROR
+        return -1
+    stack.append(value)
+    return ip + 1
+
+def op_global_set(vm, code, ip, stack):
+    slot = code[ip]
+    globals = vm.globals
+    if globals[slot] is not UNDEFINED:
+        print(f"Variable {vm.names[slot]} already defined")
+        vm.ip = ip + 1
+        vm.state = State.RUNTIME_ERROR
+        return -1
+    globals[slot] = stack.pop()
+    return ip + 1
+
+def op_global_assign(vm, code, ip, stack):
+    slot = code[ip]
+    globals = vm.globals
+    if globals[slot] is UNDEFINED:
+        print(f"Undefined variable {vm.names[slot]} ")
+        vm.ip = ip + 1
+        vm.state = State.RUNTIME_ERROR
+        return -1
+    globals[slot] = stack[-1]
+    return ip + 1
+
+def op_add_const(vm, code, ip, stack):
+    stack[-1] = stack[-1] + vm.constants[code[ip]]
+    return ip + 1
+
+def op_add_locals(vm, code, ip, stack):
+    frame = vm.frame
+    stack.append(stack[frame + code[ip]] + stack[frame + code[ip + 1]])
+    return ip + 2
+
+def op_inc_global(vm, code, ip, stack):
+    slot = code[ip]
+    globals = vm.globals
+    value = globals[slot]
+    if value is UNDEFINED:
+        print(f"Variable {vm.names[slot]} not defined")
+        vm.ip = ip + 1
+        vm.state = State.RUNTIME_ERROR
+        return -1
+    globals[slot] = value = value + 1
+    stack.append(value)
+    return ip + 1
+
+def op_dec_global(vm, code, ip, stack):
+    slot = code[ip]
+    globals = vm.globals
+    value = globals[slot]
+    if value is UNDEFINED:
+        print(f"Variable {vm.names[slot]} not defined")
+        vm.ip = ip + 1
+        vm.state = State.RUNTIME_ERROR
+        return -1
+    globals[slot] = value = value - 1
+    stack.append(value)
+    return ip + 1
+
+def op_jump(vm, code, ip, stack):
+    return ip + 2 + (code[ip] << 8 | code[ip + 1])
+
+def op_jump_if_false(vm, code, ip, stack):
+    if not stack[-1]:
+        return ip + 2 + (code[ip] << 8 | code[ip + 1])
+    return ip + 2
+
+def op_jump_if_true(vm, code, ip, stack):
+    if stack[-1]:
+        return ip + 2 + (code[ip] << 8 | code[ip + 1])
+    return ip + 2
+
+def op_loop(vm, code, ip, stack):
+    return ip + 2 - (code[ip] << 8 | code[ip + 1])
+
+def op_frame(vm, code, ip, stack):
+    vm.ip = ip
+    vm.state = State.FRAME
+    return -1
+
+def op_spawn(vm, code, ip, stack):
+    target = vm.constants[code[ip]]
+    base = len(stack) - target.arity
+    args = stack[base:]
+    del stack[base:]
+    stack.append(vm.scheduler.spawn(target, args))
+    return ip + 1
+
+def op_wide(vm, code, ip, stack):
+    # run the prefixed handler against a one-operand buffer holding the 16-bit value
+    arg = code[ip + 1] << 8 | code[ip + 2]
+    if HANDLERS[code[ip]](vm, (arg,), 0, stack) < 0:
+        # the handler only saw the buffer; point at the end of the real instruction
+        vm.ip = ip + 3
+        return -1
+    return ip + 3
+
+
+HANDLERS = [op_unknown] * 256
+HANDLERS[OpCode.HALT] = op_halt
+HANDLERS[OpCode.RETURN] = op_return
+HANDLERS[OpCode.POP] = op_pop
+HANDLERS[OpCode.TRUE] = op_true
+HANDLERS[OpCode.FALSE] = op_false
+HANDLERS[OpCode.NIL] = op_nil
+HANDLERS[OpCode.DUP] = op_dup
+HANDLERS[OpCode.CONST] = op_const
+HANDLERS[OpCode.OPINC] = op_inc
+HANDLERS[OpCode.OPDEC] = op_dec
+HANDLERS[OpCode.ADD] = op_add
+HANDLERS[OpCode.SUB] = op_sub
+HANDLERS[OpCode.MUL] = op_mul
+HANDLERS[OpCode.DIV] = op_div
+HANDLERS[OpCode.MOD] = op_mod
+HANDLERS[OpCode.POW] = op_pow
+HANDLERS[OpCode.EQUAL] = op_equal
+HANDLERS[OpCode.NOT_EQUAL] = op_not_equal
+HANDLERS[OpCode.GREATER] = op_greater
+HANDLERS[OpCode.GREATER_EQUAL] = op_greater_equal
+HANDLERS[OpCode.LESS] = op_less
+HANDLERS[OpCode.LESS_EQUAL] = op_less_equal
+HANDLERS[OpCode.NOT] = op_not
+HANDLERS[OpCode.NEGATE] = op_negate
+HANDLERS[OpCode.PRINT] = op_print
+HANDLERS[OpCode.NOW] = op_now
+HANDLERS[OpCode.LOCAL_GET] = op_local_get
+HANDLERS[OpCode.LOCAL_SET] = op_local_set
+HANDLERS[OpCode.GLOBAL_GET] = op_global_get
+HANDLERS[OpCode.GLOBAL_SET] = op_global_set
+HANDLERS[OpCode.GLOBAL_ASSIGN] = op_global_assign
+HANDLERS[OpCode.WIDE] = op_wide
+HANDLERS[OpCode.ADD_CONST] = op_add_const
+HANDLERS[OpCode.ADD_LOCALS] = op_add_locals
+HANDLERS[OpCode.INC_GLOBAL] = op_inc_global
+HANDLERS[OpCode.DEC_GLOBAL] = op_dec_global
+HANDLERS[OpCode.JUMP] = op_jump
+HANDLERS[OpCode.JUMP_IF_FALSE] = op_jump_if_false
+HANDLERS[OpCode.JUMP_IF_TRUE] = op_jump_if_true
+HANDLERS[OpCode.LOOP] = op_loop
+HANDLERS[OpCode.FRAME] = op_frame
+HANDLERS[OpCode.SPAWN] = op_spawn
@@ -0,0 +1,289 @@
+import time
+
+from Compiler import OpCode, State, UNDEFINED
+
+
+# Fixed-stack engine (engine "fixed"). Only runs verified Code: Verifier has
+# proved every instruction's stack depth, so the fiber's stack is allocated
+# once at the code's maximum depth and addressed through an integer stack
+# pointer, with no growth, shrinking or bounds checks in the loop. A process's
+# frame base is always 0, so local slots index the stack directly. Dispatch is
+# one inline chain ordered by how often each opcode runs, so an instruction is
+# not a function call.
+
+# plain ints: comparing against IntEnum members is slower
+POP = int(OpCode.POP)
+DUP = int(OpCode.DUP)
+CONST = int(OpCode.CONST)
+HALT = int(OpCode.HALT)
+NOW = int(OpCode.NOW)
+PRINT = int(OpCode.PRINT)
+LOOP = int(OpCode.LOOP)
+JUMP = int(OpCode.JUMP)
+JUMP_IF_FALSE = int(OpCode.JUMP_IF_FALSE)
+JUMP_IF_TRUE = int(OpCode.JUMP_IF_TRUE)
+ADD = int(OpCode.ADD)
+SUB = int(OpCode.SUB)
+MUL = int(OpCode.MUL)
+DIV = int(OpCode.DIV)
+MOD = int(OpCode.MOD)
+POW = int(OpCode.POW)
+TRUE = int(OpCode.TRUE)
+FALSE = int(OpCode.FALSE)
+EQUAL = int(OpCode.EQUAL)
+NOT_EQUAL = int(OpCode.NOT_EQUAL)
+GREATER = int(OpCode.GREATER)
+GREATER_EQUAL = int(OpCode.GREATER_EQUAL)
+LESS = int(OpCode.LESS)
+LESS_EQUAL = int(OpCode.LESS_EQUAL)
+OPINC = int(OpCode.OPINC)
+OPDEC = int(OpCode.OPDEC)
+NOT = int(OpCode.NOT)
+NEGATE = int(OpCode.NEGATE)
+NIL = int(OpCode.NIL)
+RETURN = int(OpCode.RETURN)
+GLOBAL_SET = int(OpCode.GLOBAL_SET)
+GLOBAL_GET = int(OpCode.GLOBAL_GET)
+GLOBAL_ASSIGN = int(OpCode.GLOBAL_ASSIGN)
+LOCAL_SET = int(OpCode.LOCAL_SET)
+LOCAL_GET = int(OpCode.LOCAL_GET)
+WIDE = int(OpCode.WIDE)
+ADD_CONST = int(OpCode.ADD_CONST)
+ADD_LOCALS = int(OpCode.ADD_LOCALS)
+INC_GLOBAL = int(OpCode.INC_GLOBAL)
+DEC_GLOBAL = int(OpCode.DEC_GLOBAL)
+FRAME = int(OpCode.FRAME)
+SPAWN = int(OpCode.SPAWN)
+
+
+def prepare(fiber):
+    # grows the stack to the verified depth once; the live values stay at the bottom
+    if fiber.code.depth is None:
+        from Verifier import verify
+        verify([fiber.code])
+    stack = fiber.stack
+    fiber.sp = len(stack)
+    stack.extend([None] * (fiber.code.depth - len(stack)))
+    return run
+
+
+def run(vm):
+    code = vm.bytes
+    stack = vm.stack
+    constants = vm.constants
+    globals = vm.globals
+    ip = vm.ip
+    sp = vm.sp
+    try:
+        while True:
+            op = code[ip]
+            if op == LOCAL_GET:
+                stack[sp] = stack[code[ip + 1]]
+                sp += 1
+                ip += 2
+            elif op == GLOBAL_GET:
+                value = globals[code[ip + 1]]
+                if value is UNDEFINED:
+                    print(f"Variable {vm.names[code[ip + 1]]} not defined")
+                    return State.RUNTIME_ERROR
+                stack[sp] = value
+                sp += 1
+                ip += 2
+            elif op == POP:
+                sp -= 1
+                ip += 1
+            elif op == CONST:
+                stack[sp] = constants[code[ip + 1]]
+                sp += 1
+                ip += 2
+            elif op == LOCAL_SET:
+                stack[code[ip + 1]] = stack[sp - 1]
+                ip += 2
+            elif op == GLOBAL_ASSIGN:
+                slot = code[ip + 1]
+                if globals[slot] is UNDEFINED:
+                    print(f"Undefined variable {vm.names[slot]} ")
+                    return State.RUNTIME_ERROR
+                globals[slot] = stack[sp - 1]
+                ip += 2
+            elif op == JUMP_IF_FALSE:
+                if stack[sp - 1]:
+                    ip += 3
+                else:
+                    ip += 3 + (code[ip + 1] << 8 | code[ip + 2])
+            elif op == WIDE:
+                # the prefixed instruction with a 16-bit operand
+                op = code[ip + 1]
+                arg = code[ip + 2] << 8 | code[ip + 3]
+                if op == CONST:
+                    stack[sp] = constants[arg]
+                    sp += 1
+                elif op == GLOBAL_GET or op == INC_GLOBAL or op == DEC_GLOBAL:
+                    value = globals[arg]
+                    if value is UNDEFINED:
+                        print(f"Variable {vm.names[arg]} not defined")
+                        return State.RUNTIME_ERROR
+                    if op != GLOBAL_GET:
+                        globals[arg] = value = value + 1 if op == INC_GLOBAL else value - 1
+                    stack[sp] = value
+                    sp += 1
+                elif op == GLOBAL_SET:
+                    if globals[arg] is not UNDEFINED:
+                        print(f"Variable {vm.names[arg]} already defined")
+                        return State.RUNTIME_ERROR
+                    sp -= 1
+                    globals[arg] = stack[sp]
+                elif op == GLOBAL_ASSIGN:
+                    if globals[arg] is UNDEFINED:
+                        print(f"Undefined variable {vm.names[arg]} ")
+                        return State.RUNTIME_ERROR
+                    globals[arg] = stack[sp - 1]
+                elif op == LOCAL_GET:
+                    stack[sp] = stack[arg]
+                    sp += 1
+                elif op == LOCAL_SET:
+                    stack[arg] = stack[sp - 1]
+                elif op == ADD_CONST:
+                    stack[sp - 1] = stack[sp - 1] + constants[arg]
+                elif op == SPAWN:
+                    target = constants[arg]
+                    base = sp - target.arity
+                    stack[base] = vm.scheduler.spawn(target, stack[base:sp])
+                    sp = base + 1
+                else:
+                    print(f"UNKNOWN INSTRUCTION {op}")
+                    return State.RUNTIME_ERROR
+                ip += 4
+            elif op == ADD_CONST:
+                stack[sp - 1] = stack[sp - 1] + constants[code[ip + 1]]
+                ip += 2
+            elif op == LOOP:
+                ip += 3 - (code[ip + 1] << 8 | code[ip + 2])
+            elif op == LESS:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] < stack[sp]
+                ip += 1
+            elif op == ADD:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] + stack[sp]
+                ip += 1
+            elif op == ADD_LOCALS:
+                stack[sp] = stack[code[ip + 1]] + stack[code[ip + 2]]
+                sp += 1
+                ip += 3
+            elif op == INC_GLOBAL or op == DEC_GLOBAL:
+                slot = code[ip + 1]
+                value = globals[slot]
+                if value is UNDEFINED:
+                    print(f"Variable {vm.names[slot]} not defined")
+                    return State.RUNTIME_ERROR
+                globals[slot] = value = value + 1 if op == INC_GLOBAL else value - 1
+                stack[sp] = value
+                sp += 1
+                ip += 2
+            elif op == FRAME:
+                vm.ip = ip + 1
+                vm.sp = sp
+                return State.FRAME
+            elif op == MUL:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] * stack[sp]
+                ip += 1
+            elif op == SUB:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] - stack[sp]
+                ip += 1
+            elif op == JUMP:
+                ip += 3 + (code[ip + 1] << 8 | code[ip + 2])
+            elif op == GREATER:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] > stack[sp]
+                ip += 1
+            elif op == LESS_EQUAL:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] <= stack[sp]
+                ip += 1
+            elif op == GREATER_EQUAL:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] >= stack[sp]
+                ip += 1
+            elif op == EQUAL:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] == stack[sp]
+                ip += 1
+            elif op == NOT_EQUAL:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] != stack[sp]
+                ip += 1
+            elif op == JUMP_IF_TRUE:
+                if stack[sp - 1]:
+                    ip += 3 + (code[ip + 1] << 8 | code[ip + 2])
+                else:
+                    ip += 3
+            elif op == DIV:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] / stack[sp]
+                ip += 1
+            elif op == MOD:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] % stack[sp]
+                ip += 1
+            elif op == POW:
+                sp -= 1
+                stack[sp - 1] = stack[sp - 1] ** stack[sp]
+                ip += 1
+            elif op == NOT:
+                stack[sp - 1] = not stack[sp - 1]
+                ip += 1
+            elif op == NEGATE:
+                stack[sp - 1] = -stack[sp - 1]
+                ip += 1
+            elif op == OPINC:
+                stack[sp - 1] += 1
+                ip += 1
+            elif op == OPDEC:
+                stack[sp - 1] -= 1
+                ip += 1
+            elif op == DUP:
+                stack[sp] = stack[sp - 1]
+                sp += 1
+                ip += 1
+            elif op == TRUE or op == FALSE or op == NIL:
+                stack[sp] = True if op == TRUE else False if op == FALSE else None
+                sp += 1
+                ip += 1
+            elif op == NOW:
+                stack[sp] = time.time()
+                sp += 1
+                ip += 1
+            elif op == PRINT:
+                sp -= 1
+                print(stack[sp])
+                ip += 1
+            elif op == GLOBAL_SET:
+                slot = code[ip + 1]
+                if globals[slot] is not UNDEFINED:
+                    print(f"Variable {vm.names[slot]} already defined")
+                    return State.RUNTIME_ERROR
+                sp -= 1
+                globals[slot] = stack[sp]
+                ip += 2
+            elif op == SPAWN:
+                target = constants[code[ip + 1]]
+                base = sp - target.arity
+                stack[base] = vm.scheduler.spawn(target, stack[base:sp])
+                sp = base + 1
+                ip += 2
+            elif op == RETURN:
+                return State.OK
+            elif op == HALT:
+                print("HALT")
+                return State.ABORT
+            else:
+                print(f"UNKNOWN INSTRUCTION {op}")
+                return State.RUNTIME_ERROR
+    except Exception as error:
+        # ip still points at the instruction that raised
+        vm.ip = ip
+        error.add_note(f"[line {vm.code.lines[ip]}] in {vm.code.name}")
+        raise
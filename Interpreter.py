@@ -5,62 +5,160 @@ from Parser import Parser
 from Visitor import Visitor
 from Ast import  *
 from ByteCode import ByteGenerator
-from Compiler import Compiler
+from Compiler import Compiler, Names, UNDEFINED, freeze
+from Optimizer import Peephole, ConstantFolder
+from Types import TypeInference
+from Verifier import verify
+from Scheduler import Scheduler
+from Transpiler import Transpiler
+from Register import RegisterGenerator
+from Stats import Stats
 
 import threading
 
 
 
 class Environment:
-    def __init__(self):
-        self.values = {}
+    # Globals live in a list indexed by the slot the name table assigned at
+    # compile time; the name-based methods are kept for reflection and debugging.
+    def __init__(self, names):
+        self.names = list(names)
+        self.index = {name: slot for slot, name in enumerate(self.names)}
+        self.slots = [UNDEFINED] * len(self.names)
 
     def define(self, name, value):
-        if name in self.values:
+        slot = self.index.get(name)
+        if slot is None:
+            # names the code never mentions get slots past the compiled ones
+            slot = self.index[name] = len(self.names)
+            self.names.append(name)
+            self.slots.append(UNDEFINED)
+        if self.slots[slot] is not UNDEFINED:
             return False
-        self.values[name] = value
+        self.slots[slot] = value
         return True
 
     def get(self, name):
-        if name in self.values:
-            return self.values[name]
-        return None
-        
-
+        slot = self.index.get(name)
+        if slot is None or self.slots[slot] is UNDEFINED:
+            return None
+        return self.slots[slot]
 
     def assign(self, name, value):
-        if name in self.values:
-            self.values[name] = value
-            return True
-        return False
+        slot = self.index.get(name)
+        if slot is None or self.slots[slot] is UNDEFINED:
+            return False
+        self.slots[slot] = value
+        return True
+
+    def values(self):
+        return {name: value for name, value in zip(self.names, self.slots) if value is not UNDEFINED}
     
     def debug(self):
-        print(self.values)
+        print(self.values())
+
+
+
+
+
 
 
+class Session:
+    # One run of a compiled script: its own globals and scheduler over Code that
+    # may be shared with any number of other sessions. The "stats" engine also
+    # collects per-opcode, per-pair and per-line counts into self.stats; given a
+    # Stats, the "quick" engine records the sites it specializes there.
+    def __init__(self, code, engine="loop", stats=None):
+        self.code = code
+        self.globals = Environment(code.names)
+        if stats is None and engine == "stats":
+            stats = Stats()
+        self.stats = stats
+        self.scheduler = Scheduler(self.globals.slots, engine, self.stats)
 
+    def run(self, maxTicks=None):
+        # the main program is the first process; the run ends when none is left alive
+        self.scheduler.spawn(self.code)
+        return self.scheduler.run(maxTicks)
 
 
+# engines whose code is built from the AST after the bytecode, by the named method;
+# a .buc cache holds only bytecode, so they always compile from source
+AST_ENGINES = {"python": "transpile", "register": "allocate"}
 
 
 class Interpreter:
-    def __init__(self):
-        self.globals = Environment()
-        self.current = Compiler("__main__", self)
+    def __init__(self, engine="loop", optimize=True, debug=False):
+        self.engine = engine
+        self.optimize = optimize
+        self.debug = debug
+        self.names = Names()
+        self.compilers = []
+        self.current = self.NewCompiler("__main__")
         self.generator = ByteGenerator(self)
+        self.codes = []
+        self.code = None
 
     def GetCurrent(self):
         return self.current
     
     def NewCompiler(self, name):
         compiler = Compiler(name, self)
+        self.compilers.append(compiler)
         return compiler
 
     def compile(self, statements):
-        self.generator.compile(statements)
-        self.current.disassemble()
-        self.current.run()
-        self.globals.debug()
+        self.build(statements)
+        self.execute()
+
+    def build(self, statements):
+        types = None
+        if self.optimize:
+            statements = ConstantFolder().fold(statements)
+            types = TypeInference().infer(statements)
+        self.generator.compile(statements, types)
+        if self.optimize:
+            removed = sum(Peephole(compiler).optimize() for compiler in self.compilers)
+            if self.debug:
+                print(f"peephole: removed {removed} instructions")
+        codes = freeze(self.compilers)
+        verify(codes)
+        self.load(codes)
+        lower = AST_ENGINES.get(self.engine)
+        if lower is not None:
+            getattr(self, lower)(statements)
+
+    def transpile(self, statements):
+        # the "python" engine runs the AST lowered to Python functions, attached to these codes
+        Transpiler(self).load(statements, self.codes)
+
+    def allocate(self, statements):
+        # the "register" engine runs three-address code generated from the AST
+        RegisterGenerator(self, self.codes).load(statements)
+
+    def load(self, codes):
+        self.codes = codes
+        self.code = codes[0]
+
+    def session(self, engine=None, stats=None):
+        return Session(self.code, engine or self.engine, stats)
+
+    def disassemble(self):
+        for code in self.codes:
+            code.disassemble()
+        if self.engine == "register":
+            from Register import PROGRAMS
+            for code in self.codes:
+                PROGRAMS[code].disassemble()
+
+    def execute(self, maxTicks=None, stats=None):
+        if self.debug:
+            self.disassemble()
+        session = self.session(stats=stats)
+        session.run(maxTicks)
+        if self.debug:
+            session.globals.debug()
+        return session
 
     def error(self, token, message):
         if token.type == TokenType.EOF:
@@ -1,5 +1,40 @@
+import re
 from Token import Token, TokenType
 
+KEYWORDS = {
+    'var': TokenType.VAR,
+    'process': TokenType.PROCESS,
+    'def': TokenType.DEF,
+    'else': TokenType.ELSE,
+    'print': TokenType.PRINT,
+    'struct': TokenType.STRUCT,
+    'if': TokenType.IF,
+    'elif': TokenType.ELIF,
+    'while': TokenType.WHILE,
+    'do': TokenType.DO,
+    'return': TokenType.RETURN,
+    'nil': TokenType.NIL,
+    'true': TokenType.TRUE,
+    'false': TokenType.FALSE,
+    'for': TokenType.FOR,
+    'break': TokenType.BREAK,
+    'continue': TokenType.CONTINUE,
+    'goto': TokenType.GOTO,
+    'eval': TokenType.EVAL,
+    'now': TokenType.NOW,
+    'import': TokenType.IMPORT,
+    'frame': TokenType.FRAME,
+    'switch': TokenType.SWITCH,
+    'case': TokenType.CASE,
+    'default': TokenType.DEFAULT,
+    'loop': TokenType.LOOP,
+    'and': TokenType.AND,
+    'or': TokenType.OR,
+    'not': TokenType.BANG,
+    'xor': TokenType.XOR,
+    'mod': TokenType.MOD,
+}
+
 class Lexer:
     def __init__(self, source):
         self.source = source
@@ -18,13 +53,28 @@ class Lexer:
             self.start = self.current
             self.scan_token()
         self.tokens.append(Token(TokenType.EOF, "EOF", None, self.line))
+        self.check_balance()
+        return self.tokens
+
+    def scan(self):
+        # generator mode: self.tokens only buffers what the last scan_token produced
+        tokens = self.tokens
+        while not self.is_at_end():
+            self.start = self.current
+            self.scan_token()
+            if tokens:
+                yield from tokens
+                tokens.clear()
+        self.check_balance()
+        yield Token(TokenType.EOF, "EOF", None, self.line)
+
+    def check_balance(self):
         if self.bracket_count > 0:
             raise Exception(" Brackets are not matched ")
         if self.braces_count > 0:
             raise Exception(" Braces are not matched ")
         if self.parenthesis_count > 0:
             raise Exception(" Parenthesis are not matched ")
-        return self.tokens
 
     def is_at_end(self):
         return self.current >= len(self.source)
@@ -34,8 +84,10 @@ class Lexer:
         return self.source[self.current - 1]
 
     def add_token(self, type, literal=None):
-        text = self.source[self.start:self.current]
-        self.tokens.append(Token(type, text, literal, self.line))
+        if literal is None:
+            self.tokens.append(Token(type, self.source[self.start:self.current], None, self.line))
+        else:
+            self.tokens.append(Token.lazy(type, self.source, self.start, self.current, literal, self.line))
 
     def scan_token(self):
         char = self.advance()
@@ -168,74 +220,11 @@ class Lexer:
         while self.peek().isalnum() or self.peek() == '_':
             self.advance()
         text = self.source[self.start:self.current].lower()
-        if text == 'var':
-            self.add_token(TokenType.VAR)
-        elif text == 'process':
-            self.add_token(TokenType.PROCESS)
-        elif text == 'def':
-            self.add_token(TokenType.DEF)
-        elif text == 'else':
-            self.add_token(TokenType.ELSE)
-        elif text == 'print':
-            self.add_token(TokenType.PRINT)
-        elif text == 'struct':
-            self.add_token(TokenType.STRUCT)
-        elif text == 'if':
-            self.add_token(TokenType.IF)
-        elif text == 'elif':
-            self.add_token(TokenType.ELIF)
-        elif text == 'while':
-            self.add_token(TokenType.WHILE)
-        elif text == 'do':
-            self.add_token(TokenType.DO)
-        elif text == 'return':
-            self.add_token(TokenType.RETURN)
-        elif text == 'nil':
-            self.add_token(TokenType.NIL)
-        elif text == 'true':
-            self.add_token(TokenType.TRUE)
-        elif text == 'false':
-            self.add_token(TokenType.FALSE)
-        elif text == 'for':
-            self.add_token(TokenType.FOR)
-        elif text == 'break':
-            self.add_token(TokenType.BREAK) 
-        elif text == 'continue':
-            self.add_token(TokenType.CONTINUE)
-        elif text == 'goto':
-            self.add_token(TokenType.GOTO)
-        elif text == 'eval':
-            self.add_token(TokenType.EVAL)
-        elif text == 'now':
-            self.add_token(TokenType.NOW)
-        elif text == 'import':
-            self.add_token(TokenType.IMPORT)
-        elif text == 'frame':
-            self.add_token(TokenType.FRAME)
-        elif text == 'def':
-            self.add_token(TokenType.DEF)
-        elif text == 'struct':
-            self.add_token(TokenType.STRUCT)
-        elif text == 'switch':
-            self.add_token(TokenType.SWITCH)
-        elif text == 'case':
-            self.add_token(TokenType.CASE)
-        elif text == 'default':
-            self.add_token(TokenType.DEFAULT)
-        elif text == 'loop':
-            self.add_token(TokenType.LOOP)
-        elif text == 'and':
-            self.add_token(TokenType.AND)
-        elif text == 'or':
-            self.add_token(TokenType.OR)
-        elif text == 'not':
-            self.add_token(TokenType.BANG)
-        elif text == 'xor':
-            self.add_token(TokenType.XOR)
-        elif text == 'mod':
-            self.add_token(TokenType.MOD)
-        else:
+        type = KEYWORDS.get(text)
+        if type is None:
             self.add_token(TokenType.IDENTIFIER, text)
+        else:
+            self.add_token(type)
 
     def line_comment(self):
         while self.peek() != '\n' and not self.is_at_end():
@@ -260,3 +249,121 @@ class Lexer:
         if self.current + 1 >= len(self.source):
             return '\0'
         return self.source[self.current + 1]
+
+
+OPERATORS = {
+    '++': TokenType.PLUS_PLUS,
+    '+=': TokenType.EQUAL_PLUS,
+    '+': TokenType.PLUS,
+    '--': TokenType.MINUS_MINUS,
+    '-=': TokenType.EQUAL_MINUS,
+    '-': TokenType.MINUS,
+    '!=': TokenType.BANG_EQUAL,
+    '!': TokenType.BANG,
+    '<=': TokenType.LESS_EQUAL,
+    '<': TokenType.LESS,
+    '>=': TokenType.GREATER_EQUAL,
+    '>': TokenType.GREATER,
+    '*=': TokenType.EQUAL_MULT,
+    '*': TokenType.STAR,
+    '/=': TokenType.EQUAL_DIV,
+    '/': TokenType.SLASH,
+    '%': TokenType.PERCENT,
+    '^': TokenType.POWER,
+    '==': TokenType.EQUAL_EQUAL,
+    '=': TokenType.EQUAL,
+    ';': TokenType.SEMICOLON,
+    '(': TokenType.LPAREN,
+    ')': TokenType.RPAREN,
+    '{': TokenType.LBRACE,
+    '}': TokenType.RBRACE,
+    '[': TokenType.LBRACKET,
+    ']': TokenType.RBRACKET,
+    ',': TokenType.COMMA,
+    ':': TokenType.COLON,
+    '&': TokenType.AND,
+    '|': TokenType.OR,
+}
+
+# one shared lexeme string per operator and keyword type
+OPERATOR_TEXT = {type: text for text, type in OPERATORS.items()}
+KEYWORD_TEXT = {type: text for text, type in KEYWORDS.items()}
+
+BRACKETS = {'(': 0, ')': 0, '{': 1, '}': 1, '[': 2, ']': 2}
+
+# '.' never reaches OPERATORS: like Lexer.scan_token, a dot starts a number, and
+# only dots after the first character make it a float
+MASTER = re.compile(r'''
+    (?P<space>[ \t\r]+)
+  | (?P<newline>\n)
+  | (?P<identifier>[^\W\d_]\w*)
+  | (?P<number>[\d.]+)
+  | (?P<string>"[^"]*")
+  | (?P<comment>//[^\n]*)
+  | (?P<block>/\*.*?\*/)
+  | (?P<unterminated>["]|/\*)
+  | (?P<operator>\+\+|\+=|--|-=|!=|<=|>=|\*=|/=|==|[-+!<>*/%^=;(){}\[\],:&|])
+  | (?P<unexpected>.)
+''', re.VERBOSE | re.DOTALL)
+
+
+class RegexLexer(Lexer):
+    # Same Token stream and line numbers as Lexer, scanned with one master regex.
+    def tokenize(self):
+        self.tokens.extend(self.scan())
+        return self.tokens
+
+    def scan(self):
+        source = self.source
+        keywords = KEYWORDS
+        operators = OPERATORS
+        line = self.line
+        brackets = BRACKETS
+        balance = [self.parenthesis_count, self.braces_count, self.bracket_count]
+        for m in MASTER.finditer(source, self.current):
+            kind = m.lastgroup
+            text = m.group()
+            if kind == 'space' or kind == 'comment':
+                continue
+            if kind == 'newline':
+                line += 1
+            elif kind == 'operator':
+                type = operators[text]
+                yield Token(type, OPERATOR_TEXT[type], None, line)
+                if text in brackets:
+                    balance[brackets[text]] += 1 if text in '([{' else -1
+            elif kind == 'identifier':
+                # lowercase names share the literal string as their lexeme
+                lower = text.lower()
+                type = keywords.get(lower)
+                if type is None:
+                    if lower == text:
+                        yield Token(TokenType.IDENTIFIER, lower, lower, line)
+                    else:
+                        yield Token.lazy(TokenType.IDENTIFIER, source, m.start(), m.end(), lower, line)
+                elif lower == text:
+                    yield Token(type, KEYWORD_TEXT[type], None, line)
+                else:
+                    yield Token.lazy(type, source, m.start(), m.end(), None, line)
+            elif kind == 'number':
+                if '.' in text[1:]:
+                    yield Token.lazy(TokenType.NUMBER, source, m.start(), m.end(), float(text), line)
+                else:
+                    yield Token.lazy(TokenType.NUMBER, source, m.start(), m.end(), int(text), line)
+            elif kind == 'string':
+                line += text.count('\n')
+                yield Token.lazy(TokenType.STRING, source, m.start(), m.end(), text[1:-1], line)
+            elif kind == 'block':
+                line += text.count('\n')
+            elif kind == 'unterminated':
+                line += source.count('\n', m.end())
+                if text == '"':
+                    raise Exception("Unterminated string " + " at line: " + str(line))
+                raise Exception("Unterminated block comment at line: " + str(line))
+            else:
+                raise Exception(f"Unexpected character: {text} at line: {line}")
+        self.current = len(source)
+        self.line = line
+        self.parenthesis_count, self.braces_count, self.bracket_count = balance
+        self.check_balance()
+        yield Token(TokenType.EOF, "EOF", None, line)
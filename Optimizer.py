@@ -0,0 +1,332 @@
+from array import array
+import operator
+from Compiler import OpCode, OPS
+from Visitor import Visitor
+from Token import TokenType
+from Ast import *
+
+
+# operand count of each non-jump instruction, and the direction of each jump's
+# 16-bit offset, from the opcode table
+OPERANDS = {op: len(info.operands) for op, info in OPS.items()
+            if info.operands and info.operands[0] not in ("jump", "loop")}
+
+JUMPS = {op: 1 if info.operands[0] == "jump" else -1 for op, info in OPS.items()
+         if info.operands and info.operands[0] in ("jump", "loop")}
+
+# instructions that only push a value, so a following POP cancels them
+PURE = (OpCode.CONST, OpCode.LOCAL_GET, OpCode.NIL, OpCode.TRUE, OpCode.FALSE, OpCode.DUP)
+
+
+class Instruction:
+    def __init__(self, op, args, line):
+        self.op = op
+        self.args = args
+        self.line = line
+        self.target = None
+        self.leader = False
+        self.offset = 0
+
+    def size(self):
+        if self.op in JUMPS:
+            return 3
+        if any(arg > 0xFF for arg in self.args):
+            return 2 + 2 * len(self.args)
+        return 1 + len(self.args)
+
+
+class Peephole:
+    def __init__(self, compiler):
+        self.compiler = compiler
+
+    def optimize(self):
+        instructions = self.decode()
+        before = len(instructions)
+        instructions = self.fuse(instructions)
+        self.encode(instructions)
+        return before - len(instructions)
+
+    def decode(self):
+        code = self.compiler.bytes
+        lines = self.compiler.lines
+        instructions = []
+        index = {}
+        offset = 0
+        while offset < len(code):
+            start = offset
+            op = code[offset]
+            wide = op == OpCode.WIDE
+            if wide:
+                offset += 1
+                op = code[offset]
+            offset += 1
+            ins = Instruction(OpCode(op), [], lines[start])
+            ins.offset = start
+            if op in JUMPS:
+                jump = code[offset] << 8 | code[offset + 1]
+                offset += 2
+                ins.target = offset + JUMPS[op] * jump
+            else:
+                for _ in range(OPERANDS.get(op, 0)):
+                    if wide:
+                        ins.args.append(code[offset] << 8 | code[offset + 1])
+                        offset += 2
+                    else:
+                        ins.args.append(code[offset])
+                        offset += 1
+            index[start] = ins
+            instructions.append(ins)
+        # a jump may land just past the last instruction
+        index[offset] = Instruction(None, [], 0)
+        index[offset].offset = offset
+        for ins in instructions:
+            if ins.target is not None:
+                ins.target = index[ins.target]
+                ins.target.leader = True
+        self.end = index[offset]
+        return instructions
+
+    def fuse(self, instructions):
+        out = []
+        for ins in instructions:
+            out.append(ins)
+            while self.rewrite(out):
+                pass
+        return out
+
+    def rewrite(self, out):
+        # fused instructions reuse the first object, so jumps aimed at it stay valid;
+        # nothing after the first may be a jump target
+        if len(out) >= 3 and not out[-2].leader and not out[-1].leader:
+            a, b, c = out[-3], out[-2], out[-1]
+            if a.op == OpCode.GLOBAL_GET and c.op == OpCode.GLOBAL_ASSIGN and a.args == c.args:
+                if b.op == OpCode.OPINC:
+                    a.op = OpCode.INC_GLOBAL
+                    del out[-2:]
+                    return True
+                if b.op == OpCode.OPDEC:
+                    a.op = OpCode.DEC_GLOBAL
+                    del out[-2:]
+                    return True
+            if a.op == OpCode.LOCAL_GET and b.op == OpCode.LOCAL_GET and c.op == OpCode.ADD:
+                if a.args[0] <= 0xFF and b.args[0] <= 0xFF:
+                    a.op = OpCode.ADD_LOCALS
+                    a.args = a.args + b.args
+                    del out[-2:]
+                    return True
+        if len(out) >= 2 and not out[-1].leader:
+            a, b = out[-2], out[-1]
+            if a.op == OpCode.CONST and b.op == OpCode.ADD:
+                a.op = OpCode.ADD_CONST
+                del out[-1]
+                return True
+            if a.op in PURE and b.op == OpCode.POP and not a.leader:
+                del out[-2:]
+                return True
+        return False
+
+    def encode(self, instructions):
+        offset = 0
+        for ins in instructions:
+            ins.offset = offset
+            offset += ins.size()
+        self.end.offset = offset
+
+        code = bytearray()
+        lines = array('I')
+        for ins in instructions:
+            if ins.op in JUMPS:
+                after = ins.offset + 3
+                jump = (ins.target.offset - after) * JUMPS[ins.op]
+                code += bytes((ins.op, jump >> 8, jump & 0xFF))
+            elif ins.size() > 1 + len(ins.args):
+                code.append(OpCode.WIDE)
+                code.append(ins.op)
+                for arg in ins.args:
+                    code += bytes((arg >> 8, arg & 0xFF))
+            else:
+                code.append(ins.op)
+                code += bytes(ins.args)
+            lines.extend([ins.line] * (len(code) - len(lines)))
+        self.compiler.bytes = code
+        self.compiler.lines = lines
+
+
+class ConstantFolder(Visitor):
+    # Folds Binary/Unary/Grouping nodes over literals. Division or modulo by zero,
+    # overflow and huge results are left for the VM; identities such as x*1 need
+    # x's type, so ByteGenerator applies them after TypeInference.
+
+    def fold(self, program):
+        return self.visit(program)
+
+    def literal(self, node):
+        return isinstance(node, (Number, String, Boolean))
+
+    def make(self, value, token):
+        if isinstance(value, bool):
+            return Boolean(value, token)
+        if isinstance(value, (int, float)):
+            return Number(value, token)
+        if isinstance(value, str):
+            return String(value, token)
+        return None
+
+    def bounded(self, op, a, b):
+        # big int powers and repeated strings stay for the VM, so a dead branch
+        # cannot stall the compiler or bloat the constant table
+        if op == TokenType.POWER and type(a) in (int, bool) and type(b) in (int, bool) and b > 0:
+            return abs(a) <= 1 or a.bit_length() * b <= MAX_FOLD_BITS
+        if op in (TokenType.STAR, TokenType.EQUAL_MULT) and (type(a) is str or type(b) is str):
+            text, count = (a, b) if type(a) is str else (b, a)
+            return type(count) is str or len(text) * count <= MAX_FOLD_LENGTH
+        return True
+
+    def visit_program(self, program):
+        program.statements = [self.visit(statement) for statement in program.statements]
+        return program
+
+    def visit_block_statement(self, stmt):
+        stmt.statements = [self.visit(statement) for statement in stmt.statements]
+        return stmt
+
+    def visit_expression_statement(self, stmt):
+        stmt.expression = self.visit(stmt.expression)
+        return stmt
+
+    def visit_print_statement(self, stmt):
+        stmt.expression = self.visit(stmt.expression)
+        return stmt
+
+    def visit_process_declaration(self, stmt):
+        stmt.body = self.visit(stmt.body)
+        return stmt
+
+    def visit_if_statement(self, stmt):
+        stmt.condition = self.visit(stmt.condition)
+        stmt.then_branch = self.visit(stmt.then_branch)
+        if stmt.else_branch is not None:
+            stmt.else_branch = self.visit(stmt.else_branch)
+        return stmt
+
+    def visit_while_statement(self, stmt):
+        stmt.condition = self.visit(stmt.condition)
+        stmt.body = self.visit(stmt.body)
+        return stmt
+
+    def visit_loop_statement(self, stmt):
+        stmt.body = self.visit(stmt.body)
+        return stmt
+
+    def visit_frame_statement(self, stmt):
+        return stmt
+
+    def visit_return_statement(self, stmt):
+        if stmt.value is not None:
+            stmt.value = self.visit(stmt.value)
+        return stmt
+
+    def visit_call(self, expr):
+        expr.arguments = [self.visit(argument) for argument in expr.arguments]
+        return expr
+
+    def visit_declaration(self, expr):
+        if expr.initializer is not None:
+            expr.initializer = self.visit(expr.initializer)
+        return expr
+
+    def visit_assign(self, expr):
+        expr.value = self.visit(expr.value)
+        return expr
+
+    def visit_logical(self, expr):
+        expr.left = self.visit(expr.left)
+        expr.right = self.visit(expr.right)
+        return expr
+
+    def visit_grouping(self, expr):
+        return self.visit(expr.expression)
+
+    def visit_unary(self, expr):
+        expr.right = self.visit(expr.right)
+        right = expr.right
+        op = expr.operator.type
+        if op == TokenType.MINUS and isinstance(right, Number):
+            return Number(-right.value, expr.operator)
+        if op == TokenType.BANG and self.literal(right):
+            return Boolean(not right.value, expr.operator)
+        return expr
+
+    def visit_binary(self, expr):
+        expr.left = self.visit(expr.left)
+        expr.right = self.visit(expr.right)
+        left, right = expr.left, expr.right
+        op = expr.operator.type
+        function = FOLDABLE.get(op)
+        if function is None:
+            return expr
+
+        if self.literal(left) and self.literal(right):
+            if op in ZERO_DIVISION and right.value == 0:
+                return expr
+            if not self.bounded(op, left.value, right.value):
+                return expr
+            try:
+                value = function(left.value, right.value)
+            except (TypeError, ValueError, ArithmeticError):
+                return expr
+            node = self.make(value, expr.operator)
+            return expr if node is None else node
+        return expr
+
+    def visit_number(self, expr):
+        return expr
+
+    def visit_string(self, expr):
+        return expr
+
+    def visit_boolean(self, expr):
+        return expr
+
+    def visit_nil(self, expr):
+        return expr
+
+    def visit_now(self, expr):
+        return expr
+
+    def visit_variable(self, expr):
+        return expr
+
+    def visit_pre_process(self, expr):
+        return expr
+
+    def visit_post_process(self, expr):
+        return expr
+
+
+# largest folded int power, in bits, and repeated string, in characters
+MAX_FOLD_BITS = 4096
+MAX_FOLD_LENGTH = 4096
+
+ZERO_DIVISION = (TokenType.SLASH, TokenType.EQUAL_DIV, TokenType.PERCENT, TokenType.MOD)
+
+# same Python operators the VM applies for each token
+FOLDABLE = {
+    TokenType.PLUS: operator.add,
+    TokenType.EQUAL_PLUS: operator.add,
+    TokenType.MINUS: operator.sub,
+    TokenType.EQUAL_MINUS: operator.sub,
+    TokenType.STAR: operator.mul,
+    TokenType.EQUAL_MULT: operator.mul,
+    TokenType.SLASH: operator.truediv,
+    TokenType.EQUAL_DIV: operator.truediv,
+    TokenType.PERCENT: operator.mod,
+    TokenType.MOD: operator.mod,
+    TokenType.POWER: operator.pow,
+    TokenType.EQUAL_EQUAL: operator.eq,
+    TokenType.BANG_EQUAL: operator.ne,
+    TokenType.GREATER: operator.gt,
+    TokenType.GREATER_EQUAL: operator.ge,
+    TokenType.LESS: operator.lt,
+    TokenType.LESS_EQUAL: operator.le,
+}
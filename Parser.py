@@ -3,13 +3,56 @@ from Token import TokenType, Token
 from enum import Enum, auto
 from Visitor import Visitor
 from Ast import *
+from collections import deque
+
+
+class TokenStream:
+    # Feeds the parser from a token iterator (e.g. Lexer.scan()), keeping only the
+    # previous token, the current one and a bounded window of lookahead.
+    def __init__(self, tokens, lookahead=2):
+        self.tokens = iter(tokens)
+        self.ahead = deque()
+        self.size = lookahead
+        self.last = None
+        self.current = next(self.tokens)
+
+    def peek(self):
+        return self.current
+
+    def previous(self):
+        return self.last
+
+    def advance(self):
+        if self.current.type != TokenType.EOF:
+            self.last = self.current
+            self.current = self.ahead.popleft() if self.ahead else next(self.tokens)
+        return self.last
+
+    def lookahead(self, n=1):
+        if n > self.size:
+            raise IndexError(f"lookahead {n} exceeds buffer of {self.size}")
+        while len(self.ahead) < n:
+            if self.ahead and self.ahead[-1].type == TokenType.EOF:
+                return self.ahead[-1]
+            if not self.ahead and self.current.type == TokenType.EOF:
+                return self.current
+            self.ahead.append(next(self.tokens))
+        return self.ahead[n - 1]
+
 
 class Parser:
-    def __init__(self, tokens):
+    def __init__(self, tokens, pratt=False):
         self.tokens = tokens
         self.current = 0
         self.current_loop = None
         self.isPanicMode = False
+        self.pratt = pratt
+        if not isinstance(tokens, list):
+            # streaming mode: route token access through a TokenStream instead of indexing
+            self.tokens = TokenStream(tokens)
+            self.peek = self.tokens.peek
+            self.previous = self.tokens.previous
+            self.advance = self.tokens.advance
 
     def match(self, *types):
         for type in types:
@@ -62,7 +105,82 @@ class Parser:
 
 
     def expression(self):
+        if self.pratt:
+            return self.parse_precedence(0)
         return self.assignment()
+
+    # Pratt parser: one loop driven by the PREFIX and INFIX tables at the end of
+    # this module, building the same nodes as the assignment -> unary chain.
+    def parse_precedence(self, rbp):
+        token = self.peek()
+        prefix = PREFIX.get(token.type)
+        if prefix is None:
+            self.error(token, "Expect expression")
+        self.advance()
+        left = prefix(self, token)
+        while True:
+            infix = INFIX.get(self.peek().type)
+            if infix is None or infix[0] <= rbp:
+                return left
+            token = self.advance()
+            left = infix[2](self, left, token, infix[1])
+
+    def prefix_literal(self, token):
+        type = token.type
+        if type == TokenType.NUMBER:
+            return Number(token.literal, token)
+        if type == TokenType.STRING:
+            return String(token.literal, token)
+        if type == TokenType.TRUE:
+            return Boolean(True, token)
+        if type == TokenType.FALSE:
+            return Boolean(False, token)
+        if type == TokenType.NIL:
+            return Nil(token)
+        return Now(token)
+
+    def prefix_variable(self, token):
+        return Variable(token)
+
+    def prefix_grouping(self, token):
+        return self.grouping()
+
+    def prefix_unary(self, token):
+        return Unary(token, self.parse_precedence(UNARY_POWER))
+
+    def prefix_process(self, token):
+        expr = self.parse_precedence(UNARY_POWER)
+        if isinstance(expr, Variable):
+            return PreProcess(expr, token)
+        if token.type == TokenType.PLUS_PLUS:
+            self.error(token, "Invalid increment target")
+        self.error(token, "Invalid decrement target")
+
+    def infix_binary(self, left, token, rbp):
+        return Binary(left, token, self.parse_precedence(rbp))
+
+    def infix_logical(self, left, token, rbp):
+        return Logical(left, token, self.parse_precedence(rbp))
+
+    def infix_assign(self, left, token, rbp):
+        value = self.parse_precedence(rbp)
+        if not isinstance(left, Variable):
+            self.error(token, "Invalid assignment target")
+        if token.type == TokenType.EQUAL:
+            return Assign(left.name, value)
+        return Assign(left.name, Binary(left, token, value))
+
+    def infix_call(self, left, token, rbp):
+        if not isinstance(left, Variable):
+            self.error(token, "Can only call processes by name")
+        return self.finish_call(left)
+
+    def infix_postfix(self, left, token, rbp):
+        if isinstance(left, Variable):
+            return PostProcesst(left, token)
+        if token.type == TokenType.PLUS_PLUS:
+            self.error(token, "Invalid increment target")
+        self.error(token, "Invalid decrement target")
     
     def assignment(self):
             expr = self.expr_or()
@@ -197,7 +315,10 @@ class Parser:
 
         
         if self.match(TokenType.IDENTIFIER):
-            return Variable(self.previous())
+            expr = Variable(self.previous())
+            if self.match(TokenType.LPAREN):
+                return self.finish_call(expr)
+            return expr
         
         
         if self.match(TokenType.LPAREN):
@@ -208,6 +329,16 @@ class Parser:
         return None
     
 
+    def finish_call(self, callee):
+        paren = self.previous()
+        arguments = []
+        if not self.check(TokenType.RPAREN):
+            arguments.append(self.expression())
+            while self.match(TokenType.COMMA):
+                arguments.append(self.expression())
+        self.consume(TokenType.RPAREN, "Expect ')' after arguments")
+        return Call(callee, paren, arguments)
+
     def grouping(self):
         expr = self.expression()
         self.consume(TokenType.RPAREN, "Expect ')' after expression")
@@ -224,8 +355,22 @@ class Parser:
     def declaration(self):
         if self.match(TokenType.VAR):
             return self.var_declaration()
+        if self.match(TokenType.PROCESS):
+            return self.process_declaration()
         return self.statement()
 
+    def process_declaration(self):
+        name = self.consume(TokenType.IDENTIFIER, "Expect process name")
+        self.consume(TokenType.LPAREN, "Expect '(' after process name")
+        params = []
+        if not self.check(TokenType.RPAREN):
+            params.append(self.consume(TokenType.IDENTIFIER, "Expect parameter name"))
+            while self.match(TokenType.COMMA):
+                params.append(self.consume(TokenType.IDENTIFIER, "Expect parameter name"))
+        self.consume(TokenType.RPAREN, "Expect ')' after parameters")
+        self.consume(TokenType.LBRACE, "Expect '{' before process body")
+        return ProcessDeclaration(name, params, self.block())
+
     def var_declaration(self):
         name = self.consume(TokenType.IDENTIFIER, "Expect variable name")
         initializer = None
@@ -242,9 +387,64 @@ class Parser:
         
         if self.match(TokenType.LBRACE):
             return self.block()
+
+        if self.match(TokenType.IF):
+            return self.if_statement()
+
+        if self.match(TokenType.WHILE):
+            return self.while_statement()
+
+        if self.match(TokenType.LOOP):
+            return self.loop_statement()
+
+        if self.match(TokenType.FRAME):
+            token = self.previous()
+            self.consume(TokenType.SEMICOLON, "Expect ';' after 'frame'")
+            return FrameStatement(token)
+
+        if self.match(TokenType.RETURN):
+            return self.return_statement()
         
         return self.expr_statement()
 
+    def if_statement(self):
+        keyword = self.previous()
+        self.consume(TokenType.LPAREN, "Expect '(' after 'if'")
+        condition = self.expression()
+        self.consume(TokenType.RPAREN, "Expect ')' after condition")
+        then_branch = self.statement()
+        else_branch = None
+        if self.match(TokenType.ELIF):
+            else_branch = self.if_statement()
+        elif self.match(TokenType.ELSE):
+            else_branch = self.statement()
+        node = IfStatement(condition, then_branch, else_branch)
+        node.token = keyword
+        return node
+
+    def while_statement(self):
+        keyword = self.previous()
+        self.consume(TokenType.LPAREN, "Expect '(' after 'while'")
+        condition = self.expression()
+        self.consume(TokenType.RPAREN, "Expect ')' after condition")
+        node = WhileStatement(condition, self.statement())
+        node.token = keyword
+        return node
+
+    def loop_statement(self):
+        keyword = self.previous()
+        node = LoopStatement(self.statement())
+        node.token = keyword
+        return node
+
+    def return_statement(self):
+        token = self.previous()
+        value = None
+        if not self.check(TokenType.SEMICOLON):
+            value = self.expression()
+        self.consume(TokenType.SEMICOLON, "Expect ';' after return value")
+        return ReturnStatement(token, value)
+
     def expr_statement(self):
         expr = self.expression()
         self.consume(TokenType.SEMICOLON, "Expect ';' after expression")
@@ -261,3 +461,47 @@ class Parser:
         return node
 
 
+PREFIX = {
+    TokenType.NUMBER: Parser.prefix_literal,
+    TokenType.STRING: Parser.prefix_literal,
+    TokenType.TRUE: Parser.prefix_literal,
+    TokenType.FALSE: Parser.prefix_literal,
+    TokenType.NIL: Parser.prefix_literal,
+    TokenType.NOW: Parser.prefix_literal,
+    TokenType.IDENTIFIER: Parser.prefix_variable,
+    TokenType.LPAREN: Parser.prefix_grouping,
+    TokenType.MINUS: Parser.prefix_unary,
+    TokenType.BANG: Parser.prefix_unary,
+    TokenType.PLUS_PLUS: Parser.prefix_process,
+    TokenType.MINUS_MINUS: Parser.prefix_process,
+}
+
+UNARY_POWER = 80
+
+# token -> (left binding power, binding power for the right operand, handler);
+# a right operand parsed one below the left power makes the operator right-associative
+INFIX = {
+    TokenType.EQUAL: (10, 9, Parser.infix_assign),
+    TokenType.EQUAL_PLUS: (10, 9, Parser.infix_assign),
+    TokenType.EQUAL_MINUS: (10, 9, Parser.infix_assign),
+    TokenType.EQUAL_MULT: (10, 9, Parser.infix_assign),
+    TokenType.EQUAL_DIV: (10, 9, Parser.infix_assign),
+    TokenType.OR: (20, 20, Parser.infix_logical),
+    TokenType.AND: (30, 29, Parser.infix_logical),
+    TokenType.EQUAL_EQUAL: (40, 40, Parser.infix_binary),
+    TokenType.BANG_EQUAL: (40, 40, Parser.infix_binary),
+    TokenType.GREATER: (50, 50, Parser.infix_binary),
+    TokenType.GREATER_EQUAL: (50, 50, Parser.infix_binary),
+    TokenType.LESS: (50, 50, Parser.infix_binary),
+    TokenType.LESS_EQUAL: (50, 50, Parser.infix_binary),
+    TokenType.PLUS: (60, 60, Parser.infix_binary),
+    TokenType.MINUS: (60, 60, Parser.infix_binary),
+    TokenType.STAR: (70, 70, Parser.infix_binary),
+    TokenType.SLASH: (70, 70, Parser.infix_binary),
+    TokenType.PERCENT: (70, 70, Parser.infix_binary),
+    TokenType.MOD: (70, 70, Parser.infix_binary),
+    TokenType.POWER: (90, 89, Parser.infix_binary),
+    TokenType.PLUS_PLUS: (100, 100, Parser.infix_postfix),
+    TokenType.MINUS_MINUS: (100, 100, Parser.infix_postfix),
+    TokenType.LPAREN: (110, 0, Parser.infix_call),
+}
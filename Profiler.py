@@ -0,0 +1,95 @@
+import sys
+import threading
+from collections import Counter
+
+from Compiler import Fiber
+from Closure import FILES
+from Fixed import run as runFixed
+from Transpiler import SOURCES
+
+
+# dispatch loops whose frames carry the running fiber (self, or vm in Fixed);
+# run() keeps ip on the fiber, the others keep it in a local
+VM_FRAMES = {
+    Fiber.run.__code__: False,
+    Fiber.runTable.__code__: True,
+    Fiber.runStats.__code__: True,
+    Fiber.runQuick.__code__: True,
+    runFixed.__code__: True,
+}
+
+
+class Profiler:
+    # Sampling profiler. A daemon thread wakes every `interval` seconds, finds the
+    # VM dispatch frame of the profiled thread through sys._current_frames(), and
+    # records "<process>;<chunk>:<line>" from the fiber's ip and the code's line
+    # table. Time outside the VM is recorded as "[host];<python function>".
+    # collapsed() gives the flamegraph.pl / speedscope folded-stack text.
+    def __init__(self, interval=0.005, thread=None):
+        self.interval = interval
+        self.target = thread.ident if thread is not None else threading.main_thread().ident
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.worker = None
+
+    def start(self):
+        self.stopped.clear()
+        self.worker = threading.Thread(target=self.loop, name="bu-profiler", daemon=True)
+        self.worker.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            if frame is not None:
+                self.samples[self.stack(frame)] += 1
+
+    def stack(self, frame):
+        innermost = frame
+        while frame is not None:
+            local = VM_FRAMES.get(frame.f_code)
+            if local is not None:
+                variables = frame.f_locals
+                fiber = variables["self"] if "self" in variables else variables["vm"]
+                ip = variables.get("ip", 0) if local else fiber.ip - 1
+                code = fiber.code
+                lines = code.lines
+                line = lines[min(max(ip, 0), len(lines) - 1)] if lines else 0
+                return f"{code.name};{code.name}:{line}"
+            if frame.f_code is Fiber.runRegister.__code__:
+                # register code has its own line table, indexed by pc
+                variables = frame.f_locals
+                program = variables.get("program")
+                if program is not None:
+                    pc = min(max(variables.get("pc", 0), 0), len(program.lines) - 1)
+                    return f"{program.name};{program.name}:{program.lines[pc]}"
+            compiled = FILES.get(frame.f_code.co_filename)
+            if compiled is not None:
+                # generated by the closure engine: map the Python line back to the bytecode
+                name = compiled.name
+                return f"{name};{name}:{compiled.line(frame.f_lineno)}"
+            code = SOURCES.get(frame.f_code)
+            if code is not None:
+                # transpiled: the Python line is the BU line
+                return f"{code.name};{code.name}:{frame.f_lineno}"
+            frame = frame.f_back
+        return f"[host];{innermost.f_code.co_name}"
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.write(self.collapsed())
@@ -0,0 +1,202 @@
+import weakref
+
+from Compiler import OpCode, UNDEFINED, HANDLERS as GENERIC, op_global_get, op_global_assign, op_inc_global, op_dec_global
+from Optimizer import Peephole
+
+
+# Runtime quickening (engine "quick"). The first fiber of a session to run a
+# Code quickens it: the session gets an adaptive copy of the bytecode, in which
+#
+# - a comparison followed by JUMP_IF_FALSE with a POP on both paths (the shape
+#   of every if and while condition) becomes one compare-and-branch that leaves
+#   nothing on the stack, and
+# - GLOBAL_GET / GLOBAL_ASSIGN / INC_GLOBAL / DEC_GLOBAL stay adaptive: once a
+#   site has seen its slot hold a value it rewrites itself to the *_DEFINED
+#   form without the inline check. A session's globals never become undefined
+#   again, so the specialized form needs no guard or deoptimization path.
+#
+# Specialized opcodes never appear in a Code or a .buc file. Arithmetic is not
+# specialized by operand type: on CPython the type guard costs more than the
+# generic `+`, which CPython already specializes underneath. Operands prefixed
+# by WIDE run the generic handlers and are never rewritten.
+
+COMPARE_JUMP = {
+    OpCode.LESS: OpCode.LESS_JUMP,
+    OpCode.LESS_EQUAL: OpCode.LESS_EQUAL_JUMP,
+    OpCode.GREATER: OpCode.GREATER_JUMP,
+    OpCode.GREATER_EQUAL: OpCode.GREATER_EQUAL_JUMP,
+    OpCode.EQUAL: OpCode.EQUAL_JUMP,
+    OpCode.NOT_EQUAL: OpCode.NOT_EQUAL_JUMP,
+}
+
+
+# plain ints: a bytearray store of an IntEnum goes through __index__
+GLOBAL_GET_DEFINED = int(OpCode.GLOBAL_GET_DEFINED)
+GLOBAL_ASSIGN_DEFINED = int(OpCode.GLOBAL_ASSIGN_DEFINED)
+INC_GLOBAL_DEFINED = int(OpCode.INC_GLOBAL_DEFINED)
+DEC_GLOBAL_DEFINED = int(OpCode.DEC_GLOBAL_DEFINED)
+
+# quickened bytecode and the fused opcodes in it, by Code
+QUICKENED = weakref.WeakKeyDictionary()
+
+
+def adaptive(fiber):
+    # one rewritable copy of each Code per session, shared by all its processes
+    scheduler = fiber.scheduler
+    cache = scheduler.adaptive if scheduler is not None else {}
+    code = cache.get(fiber.code)
+    if code is None:
+        quickened, fused = quicken(fiber.code)
+        code = cache[fiber.code] = bytearray(quickened)
+        if fiber.stats is not None:
+            for op in fused:
+                fiber.stats.specialized(op)
+    return code
+
+
+def quicken(code):
+    # the session-independent part, done once per Code
+    quickened = QUICKENED.get(code)
+    if quickened is None:
+        bytecode = bytearray(code.bytes)
+        fused = []
+        instructions = Peephole(code).decode()
+        for index, ins in enumerate(instructions[:-2]):
+            op = COMPARE_JUMP.get(ins.op)
+            branch = instructions[index + 1]
+            if op is not None and branch.op == OpCode.JUMP_IF_FALSE and \
+                    instructions[index + 2].op == OpCode.POP and branch.target.op == OpCode.POP:
+                bytecode[ins.offset] = op
+                fused.append(op)
+        quickened = QUICKENED[code] = (bytes(bytecode), tuple(fused))
+    return quickened
+
+
+# adaptive forms: the generic handler's work inline, then the rewrite; an
+# undefined slot goes to the generic handler, which reports the error
+
+def q_global_get(vm, code, ip, stack):
+    value = vm.globals[code[ip]]
+    if value is UNDEFINED:
+        return op_global_get(vm, code, ip, stack)
+    stack.append(value)
+    code[ip - 1] = GLOBAL_GET_DEFINED
+    if vm.stats is not None:
+        vm.stats.specialized(GLOBAL_GET_DEFINED)
+    return ip + 1
+
+def q_global_assign(vm, code, ip, stack):
+    globals = vm.globals
+    slot = code[ip]
+    if globals[slot] is UNDEFINED:
+        return op_global_assign(vm, code, ip, stack)
+    globals[slot] = stack[-1]
+    code[ip - 1] = GLOBAL_ASSIGN_DEFINED
+    if vm.stats is not None:
+        vm.stats.specialized(GLOBAL_ASSIGN_DEFINED)
+    return ip + 1
+
+def q_inc_global(vm, code, ip, stack):
+    globals = vm.globals
+    slot = code[ip]
+    value = globals[slot]
+    if value is UNDEFINED:
+        return op_inc_global(vm, code, ip, stack)
+    globals[slot] = value = value + 1
+    stack.append(value)
+    code[ip - 1] = INC_GLOBAL_DEFINED
+    if vm.stats is not None:
+        vm.stats.specialized(INC_GLOBAL_DEFINED)
+    return ip + 1
+
+def q_dec_global(vm, code, ip, stack):
+    globals = vm.globals
+    slot = code[ip]
+    value = globals[slot]
+    if value is UNDEFINED:
+        return op_dec_global(vm, code, ip, stack)
+    globals[slot] = value = value - 1
+    stack.append(value)
+    code[ip - 1] = DEC_GLOBAL_DEFINED
+    if vm.stats is not None:
+        vm.stats.specialized(DEC_GLOBAL_DEFINED)
+    return ip + 1
+
+def q_global_get_defined(vm, code, ip, stack):
+    stack.append(vm.globals[code[ip]])
+    return ip + 1
+
+def q_global_assign_defined(vm, code, ip, stack):
+    vm.globals[code[ip]] = stack[-1]
+    return ip + 1
+
+def q_inc_global_defined(vm, code, ip, stack):
+    globals = vm.globals
+    slot = code[ip]
+    globals[slot] = value = globals[slot] + 1
+    stack.append(value)
+    return ip + 1
+
+def q_dec_global_defined(vm, code, ip, stack):
+    globals = vm.globals
+    slot = code[ip]
+    globals[slot] = value = globals[slot] - 1
+    stack.append(value)
+    return ip + 1
+
+
+# compare-and-branch: the condition is consumed here, so both POPs are skipped;
+# ip is at the JUMP_IF_FALSE, the fall-through POP is at ip + 3
+
+def q_less_jump(vm, code, ip, stack):
+    right = stack.pop()
+    if stack.pop() < right:
+        return ip + 4
+    return ip + 4 + (code[ip + 1] << 8 | code[ip + 2])
+
+def q_less_equal_jump(vm, code, ip, stack):
+    right = stack.pop()
+    if stack.pop() <= right:
+        return ip + 4
+    return ip + 4 + (code[ip + 1] << 8 | code[ip + 2])
+
+def q_greater_jump(vm, code, ip, stack):
+    right = stack.pop()
+    if stack.pop() > right:
+        return ip + 4
+    return ip + 4 + (code[ip + 1] << 8 | code[ip + 2])
+
+def q_greater_equal_jump(vm, code, ip, stack):
+    right = stack.pop()
+    if stack.pop() >= right:
+        return ip + 4
+    return ip + 4 + (code[ip + 1] << 8 | code[ip + 2])
+
+def q_equal_jump(vm, code, ip, stack):
+    right = stack.pop()
+    if stack.pop() == right:
+        return ip + 4
+    return ip + 4 + (code[ip + 1] << 8 | code[ip + 2])
+
+def q_not_equal_jump(vm, code, ip, stack):
+    right = stack.pop()
+    if stack.pop() != right:
+        return ip + 4
+    return ip + 4 + (code[ip + 1] << 8 | code[ip + 2])
+
+
+HANDLERS = list(GENERIC)
+HANDLERS[OpCode.GLOBAL_GET] = q_global_get
+HANDLERS[OpCode.GLOBAL_ASSIGN] = q_global_assign
+HANDLERS[OpCode.INC_GLOBAL] = q_inc_global
+HANDLERS[OpCode.DEC_GLOBAL] = q_dec_global
+HANDLERS[OpCode.GLOBAL_GET_DEFINED] = q_global_get_defined
+HANDLERS[OpCode.GLOBAL_ASSIGN_DEFINED] = q_global_assign_defined
+HANDLERS[OpCode.INC_GLOBAL_DEFINED] = q_inc_global_defined
+HANDLERS[OpCode.DEC_GLOBAL_DEFINED] = q_dec_global_defined
+HANDLERS[OpCode.LESS_JUMP] = q_less_jump
+HANDLERS[OpCode.LESS_EQUAL_JUMP] = q_less_equal_jump
+HANDLERS[OpCode.GREATER_JUMP] = q_greater_jump
+HANDLERS[OpCode.GREATER_EQUAL_JUMP] = q_greater_equal_jump
+HANDLERS[OpCode.EQUAL_JUMP] = q_equal_jump
+HANDLERS[OpCode.NOT_EQUAL_JUMP] = q_not_equal_jump
@@ -0,0 +1,618 @@
+import time
+import weakref
+from enum import IntEnum
+
+from Visitor import Visitor
+from Ast import *
+from Compiler import State, UNDEFINED
+from Token import TokenType
+
+
+# Register machine (engine "register"). Instructions are (op, a, b, c) tuples,
+# `a` usually the destination: ADD a, b, c is r[a] = r[b] + r[c]. The register
+# file of a process is its fiber's stack: parameters and block locals own fixed
+# registers from 0 up, temporaries are allocated above them and reused after
+# every statement, and constants are negative registers, preloaded at the end of
+# the file, so an operand never has to be pushed or fetched to be used.
+
+class RegOp(IntEnum):
+    MOVE = 0
+    ADD = 1
+    SUB = 2
+    MUL = 3
+    DIV = 4
+    MOD = 5
+    POW = 6
+    EQUAL = 7
+    NOT_EQUAL = 8
+    GREATER = 9
+    GREATER_EQUAL = 10
+    LESS = 11
+    LESS_EQUAL = 12
+    NOT = 13
+    NEGATE = 14
+    GLOBAL_GET = 15
+    GLOBAL_SET = 16
+    GLOBAL_DEFINE = 17
+    PRINT = 18
+    NOW = 19
+    JUMP = 20
+    JUMP_IF_FALSE = 21
+    JUMP_IF_TRUE = 22
+    FRAME = 23
+    SPAWN = 24
+    RETURN = 25
+
+
+BINARY = {
+    TokenType.PLUS: RegOp.ADD,
+    TokenType.EQUAL_PLUS: RegOp.ADD,
+    TokenType.MINUS: RegOp.SUB,
+    TokenType.EQUAL_MINUS: RegOp.SUB,
+    TokenType.STAR: RegOp.MUL,
+    TokenType.EQUAL_MULT: RegOp.MUL,
+    TokenType.SLASH: RegOp.DIV,
+    TokenType.EQUAL_DIV: RegOp.DIV,
+    TokenType.PERCENT: RegOp.MOD,
+    TokenType.MOD: RegOp.MOD,
+    TokenType.POWER: RegOp.POW,
+    TokenType.GREATER: RegOp.GREATER,
+    TokenType.GREATER_EQUAL: RegOp.GREATER_EQUAL,
+    TokenType.LESS: RegOp.LESS,
+    TokenType.LESS_EQUAL: RegOp.LESS_EQUAL,
+    TokenType.BANG_EQUAL: RegOp.NOT_EQUAL,
+    TokenType.EQUAL_EQUAL: RegOp.EQUAL,
+}
+
+# operand kinds for the listing: r register, g global slot, j jump target, p process
+# (held through a weakref, so a program does not keep its own or another Code alive)
+OPERANDS = {
+    RegOp.MOVE: "rr",
+    RegOp.NOT: "rr",
+    RegOp.NEGATE: "rr",
+    RegOp.GLOBAL_GET: "rg",
+    RegOp.GLOBAL_SET: "gr",
+    RegOp.GLOBAL_DEFINE: "gr",
+    RegOp.PRINT: "r",
+    RegOp.NOW: "r",
+    RegOp.JUMP: "j",
+    RegOp.JUMP_IF_FALSE: "rj",
+    RegOp.JUMP_IF_TRUE: "rj",
+    RegOp.FRAME: "",
+    RegOp.SPAWN: "rpr",
+    RegOp.RETURN: "",
+}
+for op in set(BINARY.values()):
+    OPERANDS[op] = "rrr"
+
+# register program by the stack Code it was generated alongside
+PROGRAMS = weakref.WeakKeyDictionary()
+
+
+class RegisterCode:
+    # Frozen register program of one process; `template` is a fresh register file
+    # minus the parameters: None for locals and temporaries, then the constants.
+    __slots__ = ('name', 'arity', 'code', 'lines', 'constants', 'names', 'size', 'template')
+
+    def __init__(self, name, arity, code, lines, constants, names, size):
+        self.name = name
+        self.arity = arity
+        self.code = tuple(code)
+        self.lines = tuple(lines)
+        self.constants = tuple(constants)
+        self.names = names
+        self.size = size
+        self.template = tuple([None] * (size - arity) + list(reversed(constants)))
+
+    def __repr__(self):
+        return f"<registers {self.name}>"
+
+    def operand(self, kind, value):
+        if kind == "r":
+            return repr(self.constants[-1 - value]) if value < 0 else f"r{value}"
+        if kind == "g":
+            return self.names[value]
+        if kind == "j":
+            return f"-> {value:04d}"
+        if kind == "p":
+            return repr(value())
+        return repr(value)
+
+    def disassemble(self):
+        print(f"== {self.name} ({self.size} registers) ==")
+        for pc, (op, *args) in enumerate(self.code):
+            kinds = OPERANDS[op]
+            operands = ", ".join(self.operand(kind, arg) for kind, arg in zip(kinds, args))
+            print(f"{pc:04d} {self.lines[pc]:4d} {RegOp(op).name:<16} {operands}")
+
+
+def attach(fiber):
+    program = PROGRAMS.get(fiber.code)
+    if program is None:
+        raise RuntimeError(f"{fiber.code!r} has no register code; build it from source with engine 'register'")
+    # parameters are already on the stack, as SPAWN left them
+    fiber.stack.extend(program.template)
+    return program
+
+
+def writes(node):
+    # whether evaluating node may assign a variable, so that a local read before it must be copied
+    if isinstance(node, (Assign, PreProcess)):
+        return True
+    if isinstance(node, (Binary, Logical)):
+        return writes(node.left) or writes(node.right)
+    if isinstance(node, Unary):
+        return writes(node.right)
+    if isinstance(node, Grouping):
+        return writes(node.expression)
+    if isinstance(node, Call):
+        return any(writes(argument) for argument in node.arguments)
+    return False
+
+
+class Routine:
+    # the register program of one process while it is being generated
+    def __init__(self, name, arity):
+        self.name = name
+        self.arity = arity
+        self.code = []
+        self.lines = []
+        self.constants = []
+        self.constantIndex = {}
+        self.scopes = []
+        self.live = 0
+        self.top = 0
+        self.size = 0
+        self.tasks = []
+
+
+class RegisterGenerator(Visitor):
+    # Expression visitors return the register holding their value. self.target is
+    # the register the caller wants it in, when it has one; visitors that can
+    # write their result anywhere use it and save a MOVE.
+    def __init__(self, interpreter, codes):
+        self.interpreter = interpreter
+        self.names = interpreter.names
+        self.codes = {code.name: code for code in codes}
+        self.routine = None
+        self.target = None
+        self.programs = {}
+
+    def load(self, program):
+        self.visit(program)
+        for name, code in self.codes.items():
+            PROGRAMS[code] = self.programs[name]
+
+    # registers
+
+    def emit(self, op, a=0, b=0, c=0, line=0):
+        self.routine.code.append((op, a, b, c))
+        self.routine.lines.append(line)
+        return len(self.routine.code) - 1
+
+    def patch(self, index, target=None):
+        op, a, b, c = self.routine.code[index]
+        target = len(self.routine.code) if target is None else target
+        if op == RegOp.JUMP:
+            self.routine.code[index] = (op, target, b, c)
+        else:
+            self.routine.code[index] = (op, a, target, c)
+
+    def temp(self):
+        routine = self.routine
+        register = routine.top
+        routine.top += 1
+        if routine.top > routine.size:
+            routine.size = routine.top
+        return register
+
+    def constant(self, value):
+        # keyed on type so True, 1 and 1.0 keep separate registers
+        routine = self.routine
+        key = (type(value), value)
+        index = routine.constantIndex.get(key)
+        if index is None:
+            index = routine.constantIndex[key] = len(routine.constants)
+            routine.constants.append(value)
+        return -1 - index
+
+    def resolve(self, lexeme):
+        for scope in reversed(self.routine.scopes):
+            register = scope.get(lexeme)
+            if register is not None:
+                return register
+        return None
+
+    def slot(self, token):
+        return self.names.intern(token.lexeme)
+
+    def value(self, node, target=None):
+        saved = self.target
+        self.target = target
+        register = self.visit(node)
+        self.target = saved
+        return register
+
+    def into(self, node, register, line):
+        result = self.value(node, register)
+        if result != register:
+            self.emit(RegOp.MOVE, register, result, 0, line)
+
+    def result(self):
+        return self.target if self.target is not None else self.temp()
+
+    def step(self, operator):
+        return RegOp.ADD if operator.type == TokenType.PLUS_PLUS else RegOp.SUB
+
+    def update(self, variable, operator):
+        # x = x +/- 1 in place; returns the register holding the new value
+        token = variable.name
+        line = operator.line
+        local = self.resolve(token.lexeme)
+        if local is not None:
+            self.emit(self.step(operator), local, local, self.constant(1), line)
+            return local
+        slot = self.slot(token)
+        register = self.result()
+        self.emit(RegOp.GLOBAL_GET, register, slot, 0, line)
+        self.emit(self.step(operator), register, register, self.constant(1), line)
+        self.emit(RegOp.GLOBAL_SET, slot, register, 0, line)
+        return register
+
+    def flush(self):
+        # the deferred updates of postfix ++/--, as ByteGenerator's tasks
+        tasks = self.routine.tasks
+        self.routine.tasks = []
+        for variable, operator in tasks:
+            mark = self.routine.top
+            self.value(PreProcess(variable, operator))
+            self.routine.top = mark
+
+    def statement(self, node, op=None, line=0):
+        # evaluates node for one statement, then releases its temporaries
+        mark = self.routine.top
+        register = self.value(node)
+        if op is not None:
+            self.emit(op, register, 0, 0, line)
+        self.flush()
+        self.routine.top = mark
+        return register
+
+    # expressions
+
+    def visit_number(self, expr):
+        return self.constant(expr.value)
+
+    def visit_string(self, expr):
+        return self.constant(expr.value)
+
+    def visit_boolean(self, expr):
+        return self.constant(expr.value)
+
+    def visit_nil(self, expr):
+        return self.constant(None)
+
+    def visit_now(self, expr):
+        register = self.result()
+        self.emit(RegOp.NOW, register, 0, 0, expr.token.line)
+        return register
+
+    def visit_grouping(self, expr):
+        return self.value(expr.expression, self.target)
+
+    def visit_variable(self, expr):
+        local = self.resolve(expr.name.lexeme)
+        if local is not None:
+            return local
+        register = self.result()
+        self.emit(RegOp.GLOBAL_GET, register, self.slot(expr.name), 0, expr.name.line)
+        return register
+
+    def visit_unary(self, expr):
+        target = self.target
+        mark = self.routine.top
+        source = self.value(expr.right)
+        self.routine.top = mark
+        register = target if target is not None else self.temp()
+        op = RegOp.NEGATE if expr.operator.type == TokenType.MINUS else RegOp.NOT
+        self.emit(op, register, source, 0, expr.operator.line)
+        return register
+
+    def visit_binary(self, expr):
+        target = self.target
+        line = expr.operator.line
+        mark = self.routine.top
+        left = self.value(expr.left)
+        if 0 <= left < self.routine.live and writes(expr.right):
+            copy = self.temp()
+            self.emit(RegOp.MOVE, copy, left, 0, line)
+            left = copy
+        right = self.value(expr.right)
+        self.routine.top = mark
+        register = target if target is not None else self.temp()
+        self.emit(BINARY[expr.operator.type], register, left, right, line)
+        return register
+
+    def visit_logical(self, expr):
+        # both operands land in one register; a local target would be clobbered by the left one
+        target = self.target
+        line = expr.operator.line
+        register = target if target is not None and target >= self.routine.live else self.temp()
+        mark = self.routine.top
+        self.into(expr.left, register, line)
+        self.routine.top = mark
+        op = RegOp.JUMP_IF_FALSE if expr.operator.type == TokenType.AND else RegOp.JUMP_IF_TRUE
+        jump = self.emit(op, register, 0, 0, line)
+        self.into(expr.right, register, line)
+        self.routine.top = mark
+        self.patch(jump)
+        return register
+
+    def visit_assign(self, expr):
+        line = expr.name.line
+        local = self.resolve(expr.name.lexeme)
+        if local is not None:
+            self.into(expr.value, local, line)
+            return local
+        register = self.value(expr.value, self.target)
+        self.emit(RegOp.GLOBAL_SET, self.slot(expr.name), register, 0, line)
+        return register
+
+    def visit_pre_process(self, expr):
+        if isinstance(expr.variable, Variable):
+            return self.update(expr.variable, expr.operator)
+        target = self.target
+        mark = self.routine.top
+        source = self.value(expr.variable)
+        self.routine.top = mark
+        register = target if target is not None else self.temp()
+        self.emit(self.step(expr.operator), register, source, self.constant(1), expr.operator.line)
+        return register
+
+    def visit_post_process(self, expr):
+        self.routine.tasks.append((expr.variable, expr.operator))
+        return self.value(expr.variable, self.target)
+
+    def visit_call(self, expr):
+        code = self.codes[expr.callee.name.lexeme]
+        line = expr.paren.line
+        target = self.target
+        mark = self.routine.top
+        # arguments go to consecutive registers, which become the new process's parameters
+        registers = [self.temp() for _ in expr.arguments]
+        for argument, register in zip(expr.arguments, registers):
+            self.into(argument, register, line)
+        self.routine.top = mark
+        register = target if target is not None else self.temp()
+        self.emit(RegOp.SPAWN, register, weakref.ref(code), mark, line)
+        return register
+
+    # statements
+
+    def visit_expression_statement(self, stmt):
+        expr = stmt.expression
+        if isinstance(expr, PostProcesst) and isinstance(expr.variable, Variable):
+            # the value is discarded, so there is nothing to defer
+            expr = PreProcess(expr.variable, expr.operator)
+        self.statement(expr)
+
+    def visit_print_statement(self, stmt):
+        self.statement(stmt.expression, RegOp.PRINT, stmt.token.line)
+
+    def visit_declaration(self, expr):
+        line = expr.name.line
+        initializer = expr.initializer if expr.initializer is not None else Nil(expr.name)
+        routine = self.routine
+        if not routine.scopes:
+            mark = routine.top
+            register = self.value(initializer)
+            self.emit(RegOp.GLOBAL_DEFINE, self.slot(expr.name), register, 0, line)
+            self.flush()
+            routine.top = mark
+            return
+        register = self.temp()
+        self.into(initializer, register, line)
+        routine.top = routine.live = register + 1
+        self.flush()
+        routine.top = routine.live
+        routine.scopes[-1][expr.name.lexeme] = register
+
+    def visit_block_statement(self, stmt):
+        routine = self.routine
+        routine.scopes.append({})
+        mark = routine.top
+        for statement in stmt.statements:
+            self.visit(statement)
+        self.flush()
+        routine.scopes.pop()
+        routine.top = routine.live = mark
+
+    def visit_if_statement(self, stmt):
+        line = stmt.token.line
+        condition = self.statement(stmt.condition)
+        thenJump = self.emit(RegOp.JUMP_IF_FALSE, condition, 0, 0, line)
+        self.visit(stmt.then_branch)
+        if stmt.else_branch is None:
+            self.patch(thenJump)
+            return
+        elseJump = self.emit(RegOp.JUMP, 0, 0, 0, line)
+        self.patch(thenJump)
+        self.visit(stmt.else_branch)
+        self.patch(elseJump)
+
+    def visit_while_statement(self, stmt):
+        line = stmt.token.line
+        start = len(self.routine.code)
+        condition = self.statement(stmt.condition)
+        exitJump = self.emit(RegOp.JUMP_IF_FALSE, condition, 0, 0, line)
+        self.visit(stmt.body)
+        self.emit(RegOp.JUMP, start, 0, 0, line)
+        self.patch(exitJump)
+
+    def visit_loop_statement(self, stmt):
+        start = len(self.routine.code)
+        self.visit(stmt.body)
+        self.emit(RegOp.JUMP, start, 0, 0, stmt.token.line)
+
+    def visit_frame_statement(self, stmt):
+        self.flush()
+        self.emit(RegOp.FRAME, 0, 0, 0, stmt.token.line)
+
+    def visit_return_statement(self, stmt):
+        if stmt.value is not None:
+            self.statement(stmt.value)
+        self.flush()
+        self.emit(RegOp.RETURN, 0, 0, 0, stmt.token.line)
+
+    def visit_process_declaration(self, stmt):
+        enclosing = self.routine
+        self.routine = Routine(stmt.name.lexeme, len(stmt.params))
+        self.routine.scopes.append({})
+        for param in stmt.params:
+            self.routine.scopes[-1][param.lexeme] = self.temp()
+        self.routine.live = self.routine.top
+        for statement in stmt.body.statements:
+            self.visit(statement)
+        self.flush()
+        self.finish(stmt.name.line)
+        self.routine = enclosing
+
+    def visit_program(self, program):
+        self.routine = Routine("__main__", 0)
+        for statement in program.statements:
+            self.visit(statement)
+        self.flush()
+        self.finish(self.routine.lines[-1] + 1 if self.routine.lines else 1)
+        self.routine = None
+
+    def finish(self, line):
+        routine = self.routine
+        self.emit(RegOp.RETURN, 0, 0, 0, line)
+        code = self.codes[routine.name]
+        self.programs[routine.name] = RegisterCode(routine.name, routine.arity, routine.code, routine.lines,
+                                                   routine.constants, code.names, routine.size)
+
+
+# Handlers for Fiber.runRegister: each receives the register file and the next
+# pc, and returns the pc to continue at, or -1 after setting vm.state.
+
+def fail(vm, pc, message):
+    print(message)
+    vm.ip = pc
+    vm.state = State.RUNTIME_ERROR
+    return -1
+
+def rop_move(vm, r, pc, a, b, c):
+    r[a] = r[b]
+    return pc
+
+def rop_add(vm, r, pc, a, b, c):
+    r[a] = r[b] + r[c]
+    return pc
+
+def rop_sub(vm, r, pc, a, b, c):
+    r[a] = r[b] - r[c]
+    return pc
+
+def rop_mul(vm, r, pc, a, b, c):
+    r[a] = r[b] * r[c]
+    return pc
+
+def rop_div(vm, r, pc, a, b, c):
+    r[a] = r[b] / r[c]
+    return pc
+
+def rop_mod(vm, r, pc, a, b, c):
+    r[a] = r[b] % r[c]
+    return pc
+
+def rop_pow(vm, r, pc, a, b, c):
+    r[a] = r[b] ** r[c]
+    return pc
+
+def rop_equal(vm, r, pc, a, b, c):
+    r[a] = r[b] == r[c]
+    return pc
+
+def rop_not_equal(vm, r, pc, a, b, c):
+    r[a] = r[b] != r[c]
+    return pc
+
+def rop_greater(vm, r, pc, a, b, c):
+    r[a] = r[b] > r[c]
+    return pc
+
+def rop_greater_equal(vm, r, pc, a, b, c):
+    r[a] = r[b] >= r[c]
+    return pc
+
+def rop_less(vm, r, pc, a, b, c):
+    r[a] = r[b] < r[c]
+    return pc
+
+def rop_less_equal(vm, r, pc, a, b, c):
+    r[a] = r[b] <= r[c]
+    return pc
+
+def rop_not(vm, r, pc, a, b, c):
+    r[a] = not r[b]
+    return pc
+
+def rop_negate(vm, r, pc, a, b, c):
+    r[a] = -r[b]
+    return pc
+
+def rop_global_get(vm, r, pc, a, b, c):
+    value = vm.globals[b]
+    if value is UNDEFINED:
+        return fail(vm, pc, f"Variable {vm.names[b]} not defined")
+    r[a] = value
+    return pc
+
+def rop_global_set(vm, r, pc, a, b, c):
+    globals = vm.globals
+    if globals[a] is UNDEFINED:
+        return fail(vm, pc, f"Undefined variable {vm.names[a]} ")
+    globals[a] = r[b]
+    return pc
+
+def rop_global_define(vm, r, pc, a, b, c):
+    globals = vm.globals
+    if globals[a] is not UNDEFINED:
+        return fail(vm, pc, f"Variable {vm.names[a]} already defined")
+    globals[a] = r[b]
+    return pc
+
+def rop_print(vm, r, pc, a, b, c):
+    print(r[a])
+    return pc
+
+def rop_now(vm, r, pc, a, b, c):
+    r[a] = time.time()
+    return pc
+
+def rop_jump(vm, r, pc, a, b, c):
+    return a
+
+def rop_jump_if_false(vm, r, pc, a, b, c):
+    return pc if r[a] else b
+
+def rop_jump_if_true(vm, r, pc, a, b, c):
+    return b if r[a] else pc
+
+def rop_frame(vm, r, pc, a, b, c):
+    vm.ip = pc
+    vm.state = State.FRAME
+    return -1
+
+def rop_spawn(vm, r, pc, a, b, c):
+    target = b()
+    r[a] = vm.scheduler.spawn(target, r[c:c + target.arity])
+    return pc
+
+def rop_return(vm, r, pc, a, b, c):
+    vm.ip = pc
+    return -1
+
+
+HANDLERS = [globals()[f"rop_{op.name.lower()}"] for op in RegOp]
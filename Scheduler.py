@@ -0,0 +1,129 @@
+from Compiler import State, Fiber
+
+
+class Process(Fiber):
+    # One live instance of a process: a Fiber over the shared Code whose stack
+    # starts with the spawn arguments, plus the scheduler's bookkeeping.
+    __slots__ = ('id', 'priority', 'sleep', 'alive')
+
+    def __init__(self, id, code, args, priority, scheduler):
+        Fiber.__init__(self, code, scheduler.globals, scheduler, scheduler.engine, scheduler.stats)
+        self.stack.extend(args)
+        self.id = id
+        self.priority = priority
+        self.sleep = 0
+        self.alive = True
+
+    def __repr__(self):
+        return f"<process {self.code.name} #{self.id}>"
+
+
+class Scheduler:
+    # Cooperative Div-style scheduler. Each tick resumes every live process, highest
+    # priority first, until it executes FRAME (runs again next tick) or RETURN (dies).
+    # Processes spawned during a tick get their first slice in that same tick.
+    # One scheduler is one session: its processes share the given globals.
+    def __init__(self, globals, engine="loop", stats=None):
+        self.globals = globals
+        self.engine = engine
+        self.stats = stats
+        self.processes = []
+        self.spawned = []
+        self.byId = {}
+        self.nextId = 1
+        self.dirty = False
+        self.ticks = 0
+        self.current = None
+        # per-Code bytecode the "quick" engine rewrites for this session
+        self.adaptive = {}
+
+    def spawn(self, code, args=(), priority=0):
+        process = Process(self.nextId, code, args, priority, self)
+        self.nextId += 1
+        self.byId[process.id] = process
+        self.spawned.append(process)
+        return process.id
+
+    def get(self, id):
+        return self.byId.get(id)
+
+    def count(self):
+        return len(self.byId)
+
+    def kill(self, id):
+        process = self.byId.pop(id, None)
+        if process is None:
+            return False
+        process.alive = False
+        return True
+
+    def killAll(self):
+        for process in self.byId.values():
+            process.alive = False
+        self.byId.clear()
+
+    def sleep(self, id, frames):
+        process = self.byId.get(id)
+        if process is None:
+            return False
+        process.sleep = frames
+        return True
+
+    def setPriority(self, id, priority):
+        process = self.byId.get(id)
+        if process is None:
+            return False
+        if process.priority != priority:
+            process.priority = priority
+            self.dirty = True
+        return True
+
+    def resume(self, process):
+        self.current = process
+        state = process.execute()
+        self.current = None
+        return state
+
+    def tick(self):
+        if self.spawned:
+            self.processes.extend(self.spawned)
+            self.spawned = []
+            self.dirty = True
+        if self.dirty:
+            self.processes.sort(key=priorityOf, reverse=True)
+            self.dirty = False
+        survivors = []
+        batch = self.processes
+        while batch:
+            for process in batch:
+                if not process.alive:
+                    continue
+                if process.sleep > 0:
+                    process.sleep -= 1
+                    survivors.append(process)
+                    continue
+                state = self.resume(process)
+                if state is State.FRAME:
+                    if process.alive:
+                        survivors.append(process)
+                    continue
+                process.alive = False
+                self.byId.pop(process.id, None)
+                if state is State.ABORT:
+                    self.killAll()
+            batch = self.spawned
+            if batch:
+                self.spawned = []
+                self.dirty = True
+        self.processes = survivors
+        self.ticks += 1
+        return len(self.byId)
+
+    def run(self, maxTicks=None):
+        while self.byId and (maxTicks is None or self.ticks < maxTicks):
+            self.tick()
+        return self.ticks
+
+
+def priorityOf(process):
+    return process.priority
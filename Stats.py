@@ -0,0 +1,111 @@
+import json
+from Compiler import OpCode
+
+
+def opName(op):
+    try:
+        return OpCode(op).name
+    except ValueError:
+        return str(op)
+
+
+class Stats:
+    # Filled by Fiber.runStats (engine "stats"): executions per opcode, per
+    # (previous, next) opcode pair and per bytecode offset of every Code, plus the
+    # handler time of about one in `sampleEvery` instructions as a log2 histogram in ns.
+    # The "quick" engine records the sites it specializes, by specialized opcode.
+    def __init__(self, sampleEvery=16):
+        self.sampleEvery = sampleEvery
+        self.countdown = sampleEvery
+        self.counts = [0] * 256
+        self.pairs = [0] * 65536
+        self.offsets = {}
+        self.time = [0] * 256
+        self.samples = [0] * 256
+        self.histogram = [{} for _ in range(256)]
+        self.specializations = {}
+
+    def offsetsFor(self, code):
+        counts = self.offsets.get(code)
+        if counts is None:
+            counts = self.offsets[code] = [0] * len(code.bytes)
+        return counts
+
+    def sample(self, op, ns):
+        self.time[op] += ns
+        self.samples[op] += 1
+        bucket = ns.bit_length()
+        histogram = self.histogram[op]
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def specialized(self, op):
+        name = opName(op)
+        self.specializations[name] = self.specializations.get(name, 0) + 1
+
+    def total(self):
+        return sum(self.counts)
+
+    def opcodes(self):
+        rows = []
+        for op, count in enumerate(self.counts):
+            if count:
+                samples = self.samples[op]
+                mean = self.time[op] / samples if samples else None
+                rows.append((opName(op), count, mean))
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return rows
+
+    def pairCounts(self):
+        rows = [(opName(index >> 8), opName(index & 0xFF), count) for index, count in enumerate(self.pairs) if count and index >> 8 != 0xFF]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+
+    def lineCounts(self):
+        lines = {}
+        for code, counts in self.offsets.items():
+            for offset, count in enumerate(counts):
+                if count:
+                    key = (code.name, code.lines[offset])
+                    lines[key] = lines.get(key, 0) + count
+        return sorted(lines.items(), key=lambda item: item[1], reverse=True)
+
+    def asDict(self):
+        return {
+            "instructions": self.total(),
+            "sampleEvery": self.sampleEvery,
+            "opcodes": {name: {"count": count, "meanNs": mean} for name, count, mean in self.opcodes()},
+            "pairs": [{"first": a, "second": b, "count": count} for a, b, count in self.pairCounts()],
+            "lines": [{"chunk": name, "line": line, "count": count} for (name, line), count in self.lineCounts()],
+            "histograms": {opName(op): {str(1 << bucket): count for bucket, count in sorted(histogram.items())}
+                           for op, histogram in enumerate(self.histogram) if histogram},
+            "specialized": dict(sorted(self.specializations.items(), key=lambda item: item[1], reverse=True)),
+        }
+
+    def json(self):
+        return json.dumps(self.asDict(), indent=2)
+
+    def text(self, top=15):
+        out = []
+        if self.total():
+            out += self.counted(top)
+        if self.specializations:
+            if out:
+                out.append("")
+            out.append("specialized                       sites")
+            for name, count in sorted(self.specializations.items(), key=lambda item: item[1], reverse=True)[:top]:
+                out.append(f"{name:<32} {count:>7}")
+        return "\n".join(out)
+
+    def counted(self, top):
+        total = self.total()
+        out = [f"instructions executed: {total}", "", "opcode              count      %   mean ns"]
+        for name, count, mean in self.opcodes()[:top]:
+            ns = f"{mean:9.0f}" if mean is not None else "        -"
+            out.append(f"{name:<16} {count:>9} {100.0 * count / total:6.2f} {ns}")
+        out += ["", "pair                              count"]
+        for a, b, count in self.pairCounts()[:top]:
+            out.append(f"{a + ' ' + b:<32} {count:>7}")
+        out += ["", "line                              count"]
+        for (name, line), count in self.lineCounts()[:top]:
+            out.append(f"{name + ':' + str(line):<32} {count:>7}")
+        return out
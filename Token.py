@@ -102,11 +102,33 @@ class TokenType(Enum):
 
 
 class Token:
+    # Lazy tokens keep only an offset and length into the shared source; the lexeme
+    # string is sliced the first time something (a name lookup, an error) asks for it.
+    __slots__ = ('type', 'literal', 'line', '_lexeme', 'source', 'start', 'length')
+
     def __init__(self, type, lexeme, literal, line):
         self.type = type
-        self.lexeme = lexeme
         self.literal = literal
         self.line = line
+        self._lexeme = lexeme
+
+    @classmethod
+    def lazy(cls, type, source, start, end, literal, line):
+        token = cls.__new__(cls)
+        token.type = type
+        token.literal = literal
+        token.line = line
+        token._lexeme = None
+        token.source = source
+        token.start = start
+        token.length = end - start
+        return token
+
+    @property
+    def lexeme(self):
+        if self._lexeme is None:
+            self._lexeme = self.source[self.start:self.start + self.length]
+        return self._lexeme
 
     def __repr__(self):
         if self.literal is None:
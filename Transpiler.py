@@ -0,0 +1,363 @@
+import ast
+import time
+import weakref
+
+from Visitor import Visitor
+from Ast import *
+from Compiler import State, UNDEFINED
+from Token import TokenType
+
+
+# Lowers the Program AST to a Python module with one generator function per
+# process (engine "python"), compiled and run by CPython itself. Globals stay
+# slots of the session list `g`, block locals become Python locals, PRINT and
+# NOW are direct calls and FRAME is a yield. Every node carries its BU line, so
+# a Python traceback through the generated code points at the script.
+
+FILENAME = "<bu>"
+
+# transpiled function by Code, and Code by the function's Python code object
+FUNCTIONS = weakref.WeakKeyDictionary()
+SOURCES = weakref.WeakValueDictionary()
+
+OPERATORS = {
+    TokenType.PLUS: ast.Add,
+    TokenType.EQUAL_PLUS: ast.Add,
+    TokenType.MINUS: ast.Sub,
+    TokenType.EQUAL_MINUS: ast.Sub,
+    TokenType.STAR: ast.Mult,
+    TokenType.EQUAL_MULT: ast.Mult,
+    TokenType.SLASH: ast.Div,
+    TokenType.EQUAL_DIV: ast.Div,
+    TokenType.PERCENT: ast.Mod,
+    TokenType.MOD: ast.Mod,
+    TokenType.POWER: ast.Pow,
+}
+
+COMPARISONS = {
+    TokenType.GREATER: ast.Gt,
+    TokenType.GREATER_EQUAL: ast.GtE,
+    TokenType.LESS: ast.Lt,
+    TokenType.LESS_EQUAL: ast.LtE,
+    TokenType.BANG_EQUAL: ast.NotEq,
+    TokenType.EQUAL_EQUAL: ast.Eq,
+}
+
+
+class Fault(Exception):
+    # a BU runtime error; printed the way the bytecode engines print it
+    pass
+
+
+def fault(message):
+    raise Fault(message)
+
+
+def assign(g, slot, value, message):
+    if g[slot] is UNDEFINED:
+        raise Fault(message)
+    g[slot] = value
+    return value
+
+
+RUNTIME = {
+    "UNDEFINED": UNDEFINED,
+    "FRAME": State.FRAME,
+    "fault": fault,
+    "assign": assign,
+    "now": time.time,
+}
+
+
+def routine(fiber):
+    function = FUNCTIONS.get(fiber.code)
+    if function is None:
+        raise RuntimeError(f"{fiber.code!r} was not transpiled; build it from source with engine 'python'")
+    return function(fiber, fiber.globals, *fiber.stack)
+
+
+def annotate(error, fiber):
+    traceback = error.__traceback__
+    found = None
+    while traceback is not None:
+        code = SOURCES.get(traceback.tb_frame.f_code)
+        if code is not None:
+            found = (code, traceback.tb_lineno)
+        traceback = traceback.tb_next
+    if found is not None:
+        code, line = found
+        error.add_note(f"[line {line}] in {code.name}")
+
+
+def at(node, line):
+    node.lineno = node.end_lineno = line
+    node.col_offset = node.end_col_offset = 0
+    return node
+
+
+def name(id, store=False):
+    return ast.Name(id, ast.Store() if store else ast.Load())
+
+
+def call(function, *args):
+    return ast.Call(name(function), list(args), [])
+
+
+class Transpiler(Visitor):
+    # Expression visitors return a Python expression, statement visitors a list
+    # of statements. Runs after ByteGenerator, so names are already interned and
+    # scope errors already reported.
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.names = interpreter.names
+        self.scopes = []
+        self.locals = 0
+        self.tasks = []
+        self.spawns = False
+
+    def transpile(self, program):
+        return ast.fix_missing_locations(self.visit(program))
+
+    def load(self, program, codes):
+        # spawn targets through weak references, so the functions, which live as
+        # long as their Codes, do not keep those Codes alive
+        namespace = dict(RUNTIME)
+        for code in codes:
+            namespace[f"code_{code.name}"] = weakref.ref(code)
+        exec(compile(self.transpile(program), FILENAME, "exec"), namespace)
+        for code in codes:
+            function = namespace[f"bu_{code.name}"]
+            FUNCTIONS[code] = function
+            SOURCES[function.__code__] = code
+
+    # names
+
+    def declare(self, lexeme):
+        # a fresh Python name per declaration, so shadowing in nested blocks stays apart
+        local = f"{lexeme}_{self.locals}"
+        self.locals += 1
+        self.scopes[-1][lexeme] = local
+        return local
+
+    def resolve(self, lexeme):
+        for scope in reversed(self.scopes):
+            local = scope.get(lexeme)
+            if local is not None:
+                return local
+        return None
+
+    def slot(self, token):
+        return ast.Constant(self.names.intern(token.lexeme))
+
+    def read(self, token):
+        # g[slot], or a fault while the global is undefined
+        line = token.line
+        value = ast.Subscript(name("g"), self.slot(token), ast.Load())
+        test = ast.Compare(ast.NamedExpr(name("_v", True), value), [ast.IsNot()], [name("UNDEFINED")])
+        missing = call("fault", ast.Constant(f"Variable {token.lexeme} not defined"))
+        return at(ast.IfExp(test, name("_v"), at(missing, line)), line)
+
+    def write(self, token, value):
+        line = token.line
+        local = self.resolve(token.lexeme)
+        if local is not None:
+            return at(ast.NamedExpr(name(local, True), value), line)
+        message = ast.Constant(f"Undefined variable {token.lexeme} ")
+        return at(call("assign", name("g"), self.slot(token), value, message), line)
+
+    def step(self, variable, operator):
+        op = ast.Add() if operator.type == TokenType.PLUS_PLUS else ast.Sub()
+        return at(ast.BinOp(variable, op, ast.Constant(1)), operator.line)
+
+    def increment(self, expr):
+        # x++ / x-- as a statement; globals were already checked by the read
+        token = expr.variable.name
+        local = self.resolve(token.lexeme)
+        if local is not None:
+            target = name(local, True)
+            value = self.step(name(local), expr.operator)
+        else:
+            target = ast.Subscript(name("g"), self.slot(token), ast.Store())
+            value = self.step(self.read(token), expr.operator)
+        return at(ast.Assign([target], value), expr.operator.line)
+
+    def flush(self):
+        tasks = self.tasks
+        self.tasks = []
+        return tasks
+
+    def body(self, stmt):
+        statements = self.visit(stmt)
+        return statements or [ast.Pass()]
+
+    # expressions
+
+    def visit_number(self, expr):
+        return at(ast.Constant(expr.value), expr.token.line)
+
+    def visit_string(self, expr):
+        return at(ast.Constant(expr.value), expr.token.line)
+
+    def visit_boolean(self, expr):
+        return at(ast.Constant(expr.value), expr.token.line)
+
+    def visit_nil(self, expr):
+        return at(ast.Constant(None), expr.token.line)
+
+    def visit_now(self, expr):
+        return at(call("now"), expr.token.line)
+
+    def visit_grouping(self, expr):
+        return self.visit(expr.expression)
+
+    def visit_unary(self, expr):
+        op = ast.USub() if expr.operator.type == TokenType.MINUS else ast.Not()
+        return at(ast.UnaryOp(op, self.visit(expr.right)), expr.operator.line)
+
+    def visit_binary(self, expr):
+        left = self.visit(expr.left)
+        right = self.visit(expr.right)
+        op = expr.operator.type
+        if op in COMPARISONS:
+            return at(ast.Compare(left, [COMPARISONS[op]()], [right]), expr.operator.line)
+        return at(ast.BinOp(left, OPERATORS[op](), right), expr.operator.line)
+
+    def visit_logical(self, expr):
+        op = ast.And() if expr.operator.type == TokenType.AND else ast.Or()
+        return at(ast.BoolOp(op, [self.visit(expr.left), self.visit(expr.right)]), expr.operator.line)
+
+    def visit_variable(self, expr):
+        local = self.resolve(expr.name.lexeme)
+        if local is not None:
+            return at(name(local), expr.name.line)
+        return self.read(expr.name)
+
+    def visit_assign(self, expr):
+        return self.write(expr.name, self.visit(expr.value))
+
+    def visit_pre_process(self, expr):
+        value = self.step(self.visit(expr.variable), expr.operator)
+        if isinstance(expr.variable, Variable):
+            return self.write(expr.variable.name, value)
+        return value
+
+    def visit_post_process(self, expr):
+        # the update runs after the enclosing statement, as ByteGenerator's tasks do
+        value = self.visit(expr.variable)
+        self.tasks.append(self.increment(expr))
+        return value
+
+    def visit_call(self, expr):
+        self.spawns = True
+        arguments = ast.List([self.visit(argument) for argument in expr.arguments], ast.Load())
+        return at(call("spawn", call(f"code_{expr.callee.name.lexeme}"), arguments), expr.paren.line)
+
+    # statements
+
+    def visit_expression_statement(self, stmt):
+        expr = stmt.expression
+        if isinstance(expr, (PreProcess, PostProcesst)) and isinstance(expr.variable, Variable):
+            return [self.increment(expr)]
+        if isinstance(expr, Assign) and self.resolve(expr.name.lexeme) is None:
+            # value first, then the check, as GLOBAL_ASSIGN does
+            line = expr.name.line
+            slot = self.slot(expr.name)
+            missing = ast.If(ast.Compare(ast.Subscript(name("g"), slot, ast.Load()), [ast.Is()], [name("UNDEFINED")]),
+                             [ast.Expr(call("fault", ast.Constant(f"Undefined variable {expr.name.lexeme} ")))], [])
+            return [at(ast.Assign([name("_t", True)], self.visit(expr.value)), line), at(missing, line),
+                    at(ast.Assign([ast.Subscript(name("g"), slot, ast.Store())], name("_t")), line)] + self.flush()
+        if isinstance(expr, Assign):
+            line = expr.name.line
+            return [at(ast.Assign([name(self.resolve(expr.name.lexeme), True)], self.visit(expr.value)), line)] + self.flush()
+        value = self.visit(expr)
+        return [at(ast.Expr(value), getattr(value, "lineno", 0))] + self.flush()
+
+    def visit_print_statement(self, stmt):
+        return [at(ast.Expr(call("print", self.visit(stmt.expression))), stmt.token.line)] + self.flush()
+
+    def visit_declaration(self, expr):
+        line = expr.name.line
+        value = at(ast.Constant(None), line) if expr.initializer is None else self.visit(expr.initializer)
+        if not self.scopes:
+            slot = self.slot(expr.name)
+            defined = ast.If(ast.Compare(ast.Subscript(name("g"), slot, ast.Load()), [ast.IsNot()], [name("UNDEFINED")]),
+                             [ast.Expr(call("fault", ast.Constant(f"Variable {expr.name.lexeme} already defined")))], [])
+            return [at(ast.Assign([name("_t", True)], value), line), at(defined, line),
+                    at(ast.Assign([ast.Subscript(name("g"), slot, ast.Store())], name("_t")), line)] + self.flush()
+        return [at(ast.Assign([name(self.declare(expr.name.lexeme), True)], value), line)] + self.flush()
+
+    def visit_block_statement(self, stmt):
+        self.scopes.append({})
+        statements = []
+        for statement in stmt.statements:
+            statements += self.visit(statement)
+        statements += self.flush()
+        self.scopes.pop()
+        return statements
+
+    def visit_if_statement(self, stmt):
+        line = stmt.token.line
+        condition = self.visit(stmt.condition)
+        prologue = []
+        if self.tasks:
+            prologue = [at(ast.Assign([name("_c", True)], condition), line)] + self.flush()
+            condition = name("_c")
+        then = self.body(stmt.then_branch)
+        orelse = self.visit(stmt.else_branch) if stmt.else_branch is not None else []
+        return prologue + [at(ast.If(condition, then, orelse), line)]
+
+    def visit_while_statement(self, stmt):
+        line = stmt.token.line
+        condition = self.visit(stmt.condition)
+        if not self.tasks:
+            return [at(ast.While(condition, self.body(stmt.body), []), line)]
+        test = [at(ast.Assign([name("_c", True)], condition), line)] + self.flush()
+        test.append(at(ast.If(ast.UnaryOp(ast.Not(), name("_c")), [ast.Break()], []), line))
+        return [at(ast.While(ast.Constant(True), test + self.visit(stmt.body), []), line)]
+
+    def visit_loop_statement(self, stmt):
+        return [at(ast.While(ast.Constant(True), self.body(stmt.body), []), stmt.token.line)]
+
+    def visit_frame_statement(self, stmt):
+        return self.flush() + [at(ast.Expr(ast.Yield(name("FRAME"))), stmt.token.line)]
+
+    def visit_return_statement(self, stmt):
+        line = stmt.token.line
+        statements = []
+        if stmt.value is not None:
+            statements.append(at(ast.Expr(self.visit(stmt.value)), line))
+        return statements + self.flush() + [at(ast.Return(None), line)]
+
+    def visit_process_declaration(self, stmt):
+        enclosing = (self.scopes, self.locals, self.spawns)
+        self.scopes, self.locals, self.spawns = [{}], 0, False
+        params = [self.declare(param.lexeme) for param in stmt.params]
+        statements = []
+        for statement in stmt.body.statements:
+            statements += self.visit(statement)
+        statements += self.flush()
+        function = self.function(stmt.name.lexeme, params, statements, stmt.name.line)
+        self.scopes, self.locals, self.spawns = enclosing
+        return function
+
+    def visit_program(self, program):
+        functions = []
+        statements = []
+        for statement in program.statements:
+            if isinstance(statement, ProcessDeclaration):
+                functions.append(self.visit(statement))
+            else:
+                statements += self.visit(statement)
+        statements += self.flush()
+        functions.insert(0, self.function("__main__", [], statements, 1))
+        return ast.Module(functions, [])
+
+    def function(self, process, params, statements, line):
+        prologue = []
+        if self.spawns:
+            spawn = ast.Attribute(ast.Attribute(name("fiber"), "scheduler", ast.Load()), "spawn", ast.Load())
+            prologue.append(at(ast.Assign([name("spawn", True)], spawn), line))
+        # the trailing yield is never reached; it keeps processes without FRAME generators too
+        epilogue = [at(ast.Return(None), line), at(ast.Expr(ast.Yield(None)), line)]
+        arguments = ast.arguments([], [ast.arg(arg) for arg in ["fiber", "g"] + params], None, [], [], None, [])
+        return at(ast.FunctionDef(f"bu_{process}", arguments, prologue + statements + epilogue, [], None), line)
@@ -0,0 +1,258 @@
+from Visitor import Visitor
+from Ast import *
+from Token import TokenType
+from Optimizer import FOLDABLE
+
+
+# Flow-insensitive type inference over the folded AST. A type is a set of
+# value kinds (bits below). Every variable gets the union of all values ever
+# stored in it -- declarations, assignments, ++/--, and for parameters the
+# arguments of every spawn -- iterated to a fixed point, and every expression
+# node the kinds its value can have. An expression that can only raise has type
+# NONE. ByteGenerator picks cheaper code where an identity holds only for the
+# inferred type and falls back to the generic opcodes otherwise.
+
+NONE = 0
+INT = 1
+FLOAT = 2
+BOOL = 4
+STRING = 8
+NIL = 16
+OTHER = 32
+ANY = INT | FLOAT | BOOL | STRING | NIL | OTHER
+NUMBER = INT | FLOAT
+
+# values standing for each kind; operators whose result kind depends on the
+# value (a negative exponent, a string format) get one sample of each case
+SAMPLES = {
+    INT: (0, 3, -2),
+    FLOAT: (1.5, -0.5),
+    BOOL: (True, False),
+    STRING: ("s", "%d", "%s"),
+    NIL: (None,),
+}
+
+
+def kind(value):
+    if isinstance(value, bool):
+        return BOOL
+    if isinstance(value, int):
+        return INT
+    if isinstance(value, float):
+        return FLOAT
+    if isinstance(value, str):
+        return STRING
+    if value is None:
+        return NIL
+    return OTHER
+
+
+def table(function):
+    # result type for each pair of single-kind operands, by running the
+    # operator the VM applies over the samples
+    results = {}
+    for left, lefts in SAMPLES.items():
+        for right, rights in SAMPLES.items():
+            result = NONE
+            for a in lefts:
+                for b in rights:
+                    try:
+                        result |= kind(function(a, b))
+                    except (TypeError, ValueError, ZeroDivisionError, OverflowError):
+                        pass
+            results[left, right] = result
+    return results
+
+
+BINARY = {op: table(function) for op, function in FOLDABLE.items()}
+
+
+def kinds(type):
+    return [bit for bit in SAMPLES if type & bit]
+
+
+def only(type, allowed):
+    # true when the value is known and always one of the allowed kinds
+    return type != NONE and type & ~allowed == 0
+
+
+class TypeInference(Visitor):
+    def __init__(self):
+        self.variables = {}
+        self.types = {}
+        self.scopes = []
+        self.processes = {}
+        self.changed = False
+
+    def infer(self, program):
+        # iterates until no variable widens; the last pass types every node
+        for statement in program.statements:
+            if isinstance(statement, ProcessDeclaration):
+                self.processes[statement.name.lexeme] = statement
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            self.types = {}
+            self.visit(program)
+        return self.types
+
+    # variables: a global by name, a local or parameter by its declaring token
+
+    def resolve(self, token):
+        for scope in reversed(self.scopes):
+            key = scope.get(token.lexeme)
+            if key is not None:
+                return key
+        return token.lexeme
+
+    def store(self, key, type):
+        old = self.variables.get(key, NONE)
+        if old | type != old:
+            self.variables[key] = old | type
+            self.changed = True
+
+    def load(self, key):
+        # a variable that is never stored can only be read as an error
+        return self.variables.get(key, NONE)
+
+    def typed(self, node, type):
+        self.types[node] = type
+        return type
+
+    # expressions
+
+    def visit_number(self, expr):
+        return self.typed(expr, kind(expr.value))
+
+    def visit_string(self, expr):
+        return self.typed(expr, STRING)
+
+    def visit_boolean(self, expr):
+        return self.typed(expr, BOOL)
+
+    def visit_nil(self, expr):
+        return self.typed(expr, NIL)
+
+    def visit_now(self, expr):
+        return self.typed(expr, FLOAT)
+
+    def visit_grouping(self, expr):
+        return self.typed(expr, self.visit(expr.expression))
+
+    def visit_unary(self, expr):
+        right = self.visit(expr.right)
+        if expr.operator.type == TokenType.BANG:
+            return self.typed(expr, BOOL)
+        result = NONE
+        for bit in kinds(right):
+            if bit & (INT | BOOL):
+                result |= INT
+            elif bit == FLOAT:
+                result |= FLOAT
+        if right & OTHER:
+            result = ANY
+        return self.typed(expr, result)
+
+    def visit_binary(self, expr):
+        left = self.visit(expr.left)
+        right = self.visit(expr.right)
+        results = BINARY.get(expr.operator.type)
+        if results is None or (left | right) & OTHER:
+            return self.typed(expr, ANY)
+        result = NONE
+        for a in kinds(left):
+            for b in kinds(right):
+                result |= results[a, b]
+        return self.typed(expr, result)
+
+    def visit_logical(self, expr):
+        # and/or yield one of their operands
+        return self.typed(expr, self.visit(expr.left) | self.visit(expr.right))
+
+    def visit_variable(self, expr):
+        return self.typed(expr, self.load(self.resolve(expr.name)))
+
+    def visit_assign(self, expr):
+        type = self.visit(expr.value)
+        self.store(self.resolve(expr.name), type)
+        return self.typed(expr, type)
+
+    def step(self, expr):
+        # the value ++/-- stores: the variable plus or minus one
+        type = self.visit(expr.variable)
+        results = BINARY[TokenType.PLUS]
+        stepped = ANY if type & OTHER else NONE
+        for bit in kinds(type):
+            stepped |= results[bit, INT]
+        if isinstance(expr.variable, Variable):
+            self.store(self.resolve(expr.variable.name), stepped)
+        return type, stepped
+
+    def visit_pre_process(self, expr):
+        return self.typed(expr, self.step(expr)[1])
+
+    def visit_post_process(self, expr):
+        return self.typed(expr, self.step(expr)[0])
+
+    def visit_call(self, expr):
+        # spawn returns the new process id
+        process = self.processes.get(expr.callee.name.lexeme)
+        for index, argument in enumerate(expr.arguments):
+            type = self.visit(argument)
+            if process is not None and index < len(process.params):
+                self.store(process.params[index], type)
+        return self.typed(expr, INT)
+
+    # statements
+
+    def visit_declaration(self, expr):
+        type = NIL if expr.initializer is None else self.visit(expr.initializer)
+        if self.scopes:
+            self.scopes[-1][expr.name.lexeme] = expr.name
+            self.store(expr.name, type)
+        else:
+            self.store(expr.name.lexeme, type)
+        return self.typed(expr, type)
+
+    def visit_expression_statement(self, stmt):
+        self.visit(stmt.expression)
+
+    def visit_print_statement(self, stmt):
+        self.visit(stmt.expression)
+
+    def visit_block_statement(self, stmt):
+        self.scopes.append({})
+        for statement in stmt.statements:
+            self.visit(statement)
+        self.scopes.pop()
+
+    def visit_if_statement(self, stmt):
+        self.visit(stmt.condition)
+        self.visit(stmt.then_branch)
+        if stmt.else_branch is not None:
+            self.visit(stmt.else_branch)
+
+    def visit_while_statement(self, stmt):
+        self.visit(stmt.condition)
+        self.visit(stmt.body)
+
+    def visit_loop_statement(self, stmt):
+        self.visit(stmt.body)
+
+    def visit_frame_statement(self, stmt):
+        pass
+
+    def visit_return_statement(self, stmt):
+        if stmt.value is not None:
+            self.visit(stmt.value)
+
+    def visit_process_declaration(self, stmt):
+        enclosing = self.scopes
+        self.scopes = [{param.lexeme: param for param in stmt.params}]
+        for statement in stmt.body.statements:
+            self.visit(statement)
+        self.scopes = enclosing
+
+    def visit_program(self, program):
+        for statement in program.statements:
+            self.visit(statement)
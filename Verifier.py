@@ -0,0 +1,87 @@
+from Compiler import OpCode, OPS, Code
+from Optimizer import Peephole
+
+
+# Checks frozen Code before it runs, from the stack effects in OPS: every byte
+# decodes to an instruction an engine implements, operands index existing
+# constants, names and live locals, jumps land on an instruction, the stack
+# never underflows, all paths into an instruction agree on its depth, and
+# control never runs off the end. Unreachable code only has to decode. The
+# deepest the stack gets is recorded on the Code, for the "fixed" engine.
+
+class VerifyError(Exception):
+    pass
+
+
+def verify(codes):
+    # codes must be linked, since SPAWN's arity comes from its target
+    for code in codes:
+        code.verified(Verifier(code).verify())
+
+
+class Verifier:
+    def __init__(self, code):
+        self.code = code
+
+    def fail(self, ins, message):
+        raise VerifyError(f"{self.code.name} at {ins.offset}: {message}")
+
+    def verify(self):
+        code = self.code
+        try:
+            instructions = Peephole(code).decode()
+        except KeyError as error:
+            raise VerifyError(f"{code.name}: jump to {error.args[0]}, which is not an instruction") from None
+        except (ValueError, IndexError) as error:
+            raise VerifyError(f"{code.name}: undecodable bytecode ({error})") from None
+        if not instructions:
+            raise VerifyError(f"{code.name}: no instructions")
+        positions = {ins.offset: index for index, ins in enumerate(instructions)}
+        # spawn arguments are already on the stack when a process starts
+        depths = [None] * len(instructions)
+        depths[0] = deepest = code.arity
+        work = [0]
+        while work:
+            index = work.pop()
+            ins = instructions[index]
+            depth = depths[index]
+            info = OPS[ins.op]
+            if info.pops is None:
+                self.fail(ins, f"{info.name} cannot appear in a Code")
+            pops = info.pops + self.operands(ins, info, depth)
+            if depth < pops:
+                self.fail(ins, f"{info.name} pops {pops} with {depth} on the stack")
+            depth += info.pushes - pops
+            deepest = max(deepest, depth)
+            if ins.target is not None:
+                self.flow(ins, depths, work, positions.get(ins.target.offset), depth)
+            if not info.ends:
+                self.flow(ins, depths, work, index + 1, depth)
+        return deepest
+
+    def operands(self, ins, info, depth):
+        # checks each operand against what it indexes; returns the extra values SPAWN pops
+        code = self.code
+        for kind, arg in zip(info.operands, ins.args):
+            if kind == "constant" and arg >= len(code.constants):
+                self.fail(ins, f"constant {arg} out of range")
+            if kind == "name" and arg >= len(code.names):
+                self.fail(ins, f"name {arg} out of range")
+            if kind == "local" and arg >= depth:
+                self.fail(ins, f"local {arg} is not on the stack")
+        if ins.op == OpCode.SPAWN:
+            target = code.constants[ins.args[0]]
+            if not isinstance(target, Code):
+                self.fail(ins, "SPAWN of a constant that is not a process")
+            return target.arity
+        return 0
+
+    def flow(self, ins, depths, work, index, depth):
+        if index is None or index >= len(depths):
+            self.fail(ins, "control runs off the end of the code")
+        known = depths[index]
+        if known is None:
+            depths[index] = depth
+            work.append(index)
+        elif known != depth:
+            self.fail(ins, f"stack depth {depth} where another path has {known}")
@@ -1,6 +1,20 @@
 
 
 class Visitor:
+    # node class -> handler function, one cache per Visitor subclass
+    dispatch = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dispatch = {}
+
+    def visit(self, node):
+        handler = self.dispatch.get(node.__class__)
+        if handler is None:
+            handler = getattr(self.__class__, node.visitName)
+            self.dispatch[node.__class__] = handler
+        return handler(self, node)
+
     def visit_binary(self, expr):
         pass
 
@@ -25,6 +39,21 @@ class Visitor:
     def visit_post_decrement(self, expr):
         pass
 
+    def visit_pre_process(self, expr):
+        pass
+
+    def visit_post_process(self, expr):
+        pass
+
+    def visit_logical(self, expr):
+        pass
+
+    def visit_now(self, expr):
+        pass
+
+    def visit_empty(self, expr):
+        pass
+
 
     def visit_variable(self, expr):
         pass
@@ -50,3 +79,24 @@ class Visitor:
     def visit_print_statement(self, stmt):
         pass
 
+
+    def visit_call(self, expr):
+        pass
+
+    def visit_if_statement(self, stmt):
+        pass
+
+    def visit_while_statement(self, stmt):
+        pass
+
+    def visit_loop_statement(self, stmt):
+        pass
+
+    def visit_frame_statement(self, stmt):
+        pass
+
+    def visit_return_statement(self, stmt):
+        pass
+
+    def visit_process_declaration(self, stmt):
+        pass
@@ -0,0 +1,212 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+from Lexer import RegexLexer
+from Parser import Parser
+from Interpreter import Interpreter, AST_ENGINES
+from Cache import BytecodeCache
+from Compiler import ENGINES
+from Optimizer import Peephole
+from Profiler import Profiler
+from Stats import Stats
+
+
+# Command-line runner:
+#   bu run script.bu [--timings] [--stats] [--profile out.folded] [--engine table]
+#   bu compile | disasm | tokens | bench script.bu
+# Nothing but the script's own output reaches stdout unless --debug is given;
+# --timings reports per-phase wall time as JSON on stderr.
+
+
+class Timer:
+    def __init__(self):
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def read_source(path):
+    with open(path, "rt") as f:
+        return f.read()
+
+
+def count_instructions(codes):
+    return sum(len(Peephole(code).decode()) for code in codes)
+
+
+def compile_source(interpreter, source, timer):
+    with timer.phase("lex"):
+        tokens = RegexLexer(source).tokenize()
+    with timer.phase("parse"):
+        program = Parser(tokens, pratt=True).parse()
+    with timer.phase("codegen"):
+        interpreter.build(program)
+    return len(tokens)
+
+
+def load(args, timer, report):
+    # compiles the script, or restores it from the .buc cache unless --no-cache;
+    # engines built from the AST always compile
+    source = read_source(args.script)
+    interpreter = Interpreter(args.engine, not args.no_optimize, args.debug)
+    cache = None if args.no_cache or args.engine in AST_ENGINES else BytecodeCache(interpreter)
+    report["cached"] = False
+    if cache is not None:
+        with timer.phase("load"):
+            report["cached"] = cache.load(args.script, source)
+    if not report["cached"]:
+        report["tokens"] = compile_source(interpreter, source, timer)
+        if cache is not None:
+            cache.save(args.script, source)
+    report["chunks"] = len(interpreter.codes)
+    report["instructions"] = count_instructions(interpreter.codes)
+    report["bytes"] = sum(len(code.bytes) for code in interpreter.codes)
+    return interpreter
+
+
+def emit_timings(args, timer, report):
+    if not args.timings:
+        return
+    report["script"] = args.script
+    report["engine"] = args.engine
+    report.update({name: round(seconds, 6) for name, seconds in timer.phases.items()})
+    report["total"] = round(sum(timer.phases.values()), 6)
+    print(json.dumps(report), file=sys.stderr)
+
+
+def cmd_run(args):
+    # --stats counts on the stats engine, or records specializations on quick
+    if args.stats and args.engine not in (None, "stats", "quick"):
+        print(f"bu: --stats needs --engine stats or quick, not {args.engine}", file=sys.stderr)
+        return 1
+    args.engine = args.engine or ("stats" if args.stats else "loop")
+    timer = Timer()
+    report = {}
+    interpreter = load(args, timer, report)
+    profiler = Profiler(args.profile_interval / 1000.0) if args.profile else None
+    with timer.phase("execute"):
+        if profiler is not None:
+            profiler.start()
+        try:
+            session = interpreter.execute(args.ticks, Stats() if args.stats else None)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                profiler.write(args.profile)
+    report["ticks"] = session.scheduler.ticks
+    emit_timings(args, timer, report)
+    if args.stats == "json":
+        print(session.stats.json(), file=sys.stderr)
+    elif args.stats:
+        print(session.stats.text(), file=sys.stderr)
+    return 0
+
+
+def cmd_compile(args):
+    timer = Timer()
+    report = {}
+    source = read_source(args.script)
+    interpreter = Interpreter(args.engine, not args.no_optimize, args.debug)
+    report["tokens"] = compile_source(interpreter, source, timer)
+    with timer.phase("save"):
+        saved = BytecodeCache(interpreter, args.output).save(args.script, source)
+    report["chunks"] = len(interpreter.codes)
+    report["instructions"] = count_instructions(interpreter.codes)
+    report["bytes"] = sum(len(code.bytes) for code in interpreter.codes)
+    emit_timings(args, timer, report)
+    if not saved:
+        print(f"bu: could not write cache for {args.script}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_disasm(args):
+    interpreter = Interpreter(args.engine, not args.no_optimize, args.debug)
+    compile_source(interpreter, read_source(args.script), Timer())
+    interpreter.disassemble()
+    return 0
+
+
+def cmd_tokens(args):
+    for token in RegexLexer(read_source(args.script)).tokenize():
+        print(token)
+    return 0
+
+
+def cmd_bench(args):
+    # compiles and runs the script --repeat times with its output discarded,
+    # then prints best and mean seconds per phase as JSON
+    source = read_source(args.script)
+    runs = []
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        for _ in range(args.repeat):
+            timer = Timer()
+            interpreter = Interpreter(args.engine, not args.no_optimize)
+            compile_source(interpreter, source, timer)
+            with timer.phase("execute"):
+                interpreter.execute(args.ticks)
+            runs.append(timer.phases)
+    report = {"script": args.script, "engine": args.engine, "repeat": args.repeat,
+              "instructions": count_instructions(interpreter.codes)}
+    for name in runs[0]:
+        samples = [run[name] for run in runs]
+        report[name] = {"best": round(min(samples), 6), "mean": round(sum(samples) / len(samples), 6)}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bu", description="BU language runner")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add(name, handler, help):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("script")
+        command.add_argument("--engine", choices=sorted(ENGINES), default="loop")
+        command.add_argument("--no-optimize", action="store_true", help="skip constant folding and peephole")
+        command.add_argument("--debug", action="store_true", help="print disassembly and globals")
+        command.set_defaults(handler=handler)
+        return command
+
+    run = add("run", cmd_run, "compile (or load from cache) and run a script")
+    run.add_argument("--timings", action="store_true", help="report phase timings as JSON on stderr")
+    run.add_argument("--ticks", type=int, default=None, help="stop after this many scheduler ticks")
+    run.add_argument("--no-cache", action="store_true", help="ignore and do not write the .buc cache")
+    run.add_argument("--stats", nargs="?", const="text", choices=("text", "json"),
+                     help="report opcode, pair and line counts on stderr (runs the stats engine unless "
+                          "--engine quick is given, which reports the specialized sites)")
+    run.add_argument("--profile", metavar="PATH", help="sample the running script and write collapsed stacks to PATH")
+    run.add_argument("--profile-interval", type=float, default=5.0, metavar="MS", help="sampling period (default 5 ms)")
+    # unset, so --stats can tell a chosen engine from the default
+    run.set_defaults(engine=None)
+
+    build = add("compile", cmd_compile, "compile a script to its .buc cache")
+    build.add_argument("--timings", action="store_true", help="report phase timings as JSON on stderr")
+    build.add_argument("-o", "--output", default=None, help="directory for the .buc file")
+
+    add("disasm", cmd_disasm, "print the bytecode of every chunk")
+    add("tokens", cmd_tokens, "print the token stream")
+
+    bench = add("bench", cmd_bench, "time compile and run phases over several runs")
+    bench.add_argument("--repeat", type=int, default=5)
+    bench.add_argument("--ticks", type=int, default=None, help="stop each run after this many ticks")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,33 @@
-
 from Lexer import Lexer
 from Token import TokenType, Token
 from Parser import Parser
 from Interpreter import Interpreter
+from Cache import BytecodeCache
 
 f = open("main.bu","rt")
 source_code = f.read()
 f.close()
 
 
-lexer = Lexer(source_code)
-tokens = lexer.tokenize()
+interpreter = Interpreter()
+cache = BytecodeCache(interpreter)
 
+if not cache.load("main.bu", source_code):
+    lexer = Lexer(source_code)
+    tokens = lexer.tokenize()
 
-for token in tokens:
-     print(token)
 
+    for token in tokens:
+         print(token)
 
 
-parser = Parser(tokens)
-node = parser.parse() 
 
+    parser = Parser(tokens)
+    node = parser.parse() 
 
-interpreter = Interpreter()
-interpreter.compile(node)
 
+    interpreter.build(node)
+    cache.save("main.bu", source_code)
 
+interpreter.execute()
 
@@ -0,0 +1,61 @@
+import glob
+import os
+import random
+import unittest
+
+from Lexer import Lexer, RegexLexer, KEYWORDS, OPERATORS
+
+
+# Differential test: RegexLexer must produce the same tokens, line numbers and
+# errors as the reference Lexer, over the shipped scripts, every keyword and
+# operator, the error cases, and random sources built from all token kinds.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PIECES = (
+    list(KEYWORDS) + [keyword.upper() for keyword in KEYWORDS] + [keyword.title() for keyword in KEYWORDS]
+    + list(OPERATORS)
+    + ["x", "Name", "_", "a_1", "b2c", "é", "0", "42", "007", "3.5", ".5", "1.", "1.2.3", "..",
+       '""', '"text"', '"two\nlines"', "// comment", "/* block */", "/* two\nlines */",
+       " ", "\t", "\r", "\n", "\n\n", "(", ")", "{", "}", "[", "]"]
+)
+
+# each raises in both lexers
+BROKEN = ['"open', "/* open", "print(1", "{", "[", "@", "x = 1 $ 2", "1..2", '"a\nb', "/*\n\n"]
+
+
+def run(lexer, source):
+    try:
+        return [(token.type, token.lexeme, token.literal, token.line) for token in lexer(source).tokenize()]
+    except Exception as error:
+        return (type(error), str(error))
+
+
+class LexerTest(unittest.TestCase):
+    def same(self, source):
+        self.assertEqual(run(RegexLexer, source), run(Lexer, source), repr(source))
+
+    def test_scripts(self):
+        paths = glob.glob(os.path.join(HERE, "benchmarks", "*.bu")) + [os.path.join(HERE, "main.bu")]
+        for path in paths:
+            with open(path, "rt") as f:
+                self.same(f.read())
+
+    def test_keywords_and_operators(self):
+        for piece in PIECES:
+            self.same(piece)
+            self.same(f"{piece} {piece}\n{piece}")
+
+    def test_errors(self):
+        for source in BROKEN:
+            self.assertIsInstance(run(Lexer, source), tuple, repr(source))
+            self.same(source)
+
+    def test_random(self):
+        generator = random.Random(2024)
+        for _ in range(3000):
+            self.same("".join(generator.choice(PIECES) for _ in range(generator.randint(1, 30))))
+
+
+if __name__ == "__main__":
+    unittest.main()